@@ -129,6 +129,14 @@ MEDIA_URL = "/media/"
 MEDIA_ROOT = os.path.join(os.path.dirname(BASE_DIR), "media_root")
 
 
+# Reverie backend transport
+# Set this to the address of Reverie's HTTP transport (reverie_transport =
+# "http" in reverie/backend_server/utils.py) to hand each step to the backend
+# directly instead of through the storage files.
+# e.g., REVERIE_BACKEND_URL=http://127.0.0.1:8001
+REVERIE_BACKEND_URL = os.environ.get("REVERIE_BACKEND_URL", "")
+
+
 # CORS_ORIGIN_WHITELIST = [
 # 'http://127.0.0.1:8080'
 # ]
@@ -7,6 +7,8 @@ import datetime
 import json
 import os
 
+import requests
+from django.conf import settings
 from django.http import HttpResponse, JsonResponse
 from django.shortcuts import render
 from global_methods import *
@@ -212,17 +214,24 @@ def replay_persona_state(request, sim_code, step, persona_name):
     with open(memory + "/spatial_memory.json") as json_file:
         spatial = json.load(json_file)
 
-    with open(memory + "/associative_memory/nodes.json") as json_file:
-        associative = json.load(json_file)
+    # The nodes are in nodes.jsonl (one line per node, oldest first), or in
+    # nodes.json for the memories saved before it.
+    if os.path.exists(memory + "/associative_memory/nodes.jsonl"):
+        associative = []
+        with open(memory + "/associative_memory/nodes.jsonl") as log_file:
+            for line in log_file:
+                if line.endswith("\n"):
+                    associative += [json.loads(line)]
+    else:
+        with open(memory + "/associative_memory/nodes.json") as json_file:
+            nodes = json.load(json_file)
+        associative = [nodes[f"node_{count + 1!s}"] for count in range(len(nodes))]
 
     a_mem_event = []
     a_mem_chat = []
     a_mem_thought = []
 
-    for count in range(len(associative.keys()), 0, -1):
-        node_id = f"node_{count!s}"
-        node_details = associative[node_id]
-
+    for node_details in reversed(associative):
         if node_details["type"] == "event":
             a_mem_event += [node_details]
 
@@ -258,7 +267,8 @@ def process_environment(request):
     <FRONTEND to BACKEND>
     This sends the frontend visual world information to the backend server.
     It does this by writing the current environment representation to
-    "storage/environment.json" file.
+    "storage/environment.json" file. If REVERIE_BACKEND_URL is set, the
+    environment is first handed to the backend directly.
 
     ARGS:
       request: Django request
@@ -274,6 +284,19 @@ def process_environment(request):
     sim_code = data["sim_code"]
     environment = data["environment"]
 
+    if settings.REVERIE_BACKEND_URL:
+        try:
+            requests.post(
+                f"{settings.REVERIE_BACKEND_URL}/process_environment",
+                data=request.body,
+                timeout=10,
+            )
+        except requests.RequestException:
+            # The backend will still pick up the file below if it is polling.
+            pass
+
+    # The environment files are also what the simulator home page and forks
+    # of the simulation start from, so we always write them.
     with open(f"storage/{sim_code}/environment/{step}.json", "w") as outfile:
         outfile.write(json.dumps(environment, indent=2))
 
@@ -286,7 +309,8 @@ def update_environment(request):
     This sends the backend computation of the persona behavior to the frontend
     visual server.
     It does this by reading the new movement information from
-    "storage/movement.json" file.
+    "storage/movement.json" file. If REVERIE_BACKEND_URL is set, it instead
+    waits on the backend (long-polling) until the movements are ready.
 
     ARGS:
       request: Django request
@@ -302,6 +326,18 @@ def update_environment(request):
     sim_code = data["sim_code"]
 
     response_data = {"<step>": -1}
+    if settings.REVERIE_BACKEND_URL:
+        try:
+            response = requests.post(
+                f"{settings.REVERIE_BACKEND_URL}/update_environment",
+                data=request.body,
+                timeout=30,
+            )
+            if response.status_code == 200:
+                return JsonResponse(response.json())
+        except requests.RequestException:
+            pass
+
     if check_if_file_exists(f"storage/{sim_code}/movement/{step}.json"):
         with open(f"storage/{sim_code}/movement/{step}.json") as json_file:
             response_data = json.load(json_file)
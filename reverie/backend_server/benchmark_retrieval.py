@@ -0,0 +1,146 @@
+"""
+File: benchmark_retrieval.py
+Description: Compares new_retrieve with the approximate nearest neighbour
+index (see persona/memory_structures/ann_index.py) to the exact retrieval, on
+a synthetic associative memory. It reports the recall (the share of the
+exactly retrieved nodes that the index retrieves too) and the time per call.
+
+The synthetic embeddings are clustered around <topics> random directions,
+like the embeddings of a persona's memories are, and the focal points are
+drawn around the same directions. No API calls are made.
+
+Run it from this folder, e.g.,
+  python benchmark_retrieval.py --nodes 20000 --queries 50
+"""
+
+import argparse
+import datetime
+import json
+import tempfile
+import time
+from types import SimpleNamespace
+
+import numpy as np
+from persona.cognitive_modules import retrieve as retrieve_module
+from persona.cognitive_modules.retrieve import *
+from persona.memory_structures import associative_memory
+from persona.memory_structures.associative_memory import *
+
+
+def random_embeddings(rng, centers, n, noise):
+    """
+    Returns <n> unit length embeddings around random <centers>.
+    """
+    topics = rng.integers(0, len(centers), n)
+    embeddings = centers[topics] + noise * rng.normal(size=(n, centers.shape[1]))
+    embeddings /= np.linalg.norm(embeddings, axis=1, keepdims=True)
+    return embeddings.astype(np.float32)
+
+
+def build_memory(folder, embeddings, poignancy, start):
+    """
+    Returns an associative memory with one thought per embedding, created a
+    minute apart from <start>.
+    """
+    a_mem = AssociativeMemory(folder)
+    for count, embedding in enumerate(embeddings):
+        created = start + datetime.timedelta(minutes=count)
+        a_mem.add_thought(
+            created,
+            None,
+            "persona",
+            "thinks",
+            f"thought {count}",
+            f"persona thinks thought {count}",
+            set(["persona"]),
+            int(poignancy[count]),
+            (f"benchmark thought {count}", embedding),
+            [],
+        )
+    return a_mem
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--nodes", type=int, default=20000)
+    parser.add_argument("--queries", type=int, default=50)
+    parser.add_argument("--topics", type=int, default=500)
+    parser.add_argument("--dim", type=int, default=1536)
+    parser.add_argument("--noise", type=float, default=0.03)
+    parser.add_argument("--n_count", type=int, default=30)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    # The per-node debug printing of new_retrieve would dominate the times.
+    retrieve_module.debug = False
+
+    rng = np.random.default_rng(args.seed)
+    centers = rng.normal(size=(args.topics, args.dim))
+    centers /= np.linalg.norm(centers, axis=1, keepdims=True)
+    embeddings = random_embeddings(rng, centers, args.nodes, args.noise)
+    poignancy = rng.integers(1, 11, args.nodes)
+    focal_embeddings = random_embeddings(rng, centers, args.queries, args.noise)
+
+    # Two identical memories: one is retrieved from exactly, and the other one
+    # with the index.
+    folder = tempfile.mkdtemp()
+    with open(f"{folder}/embeddings.json", "w") as outfile:
+        json.dump(dict(), outfile)
+    with open(f"{folder}/nodes.json", "w") as outfile:
+        json.dump(dict(), outfile)
+    with open(f"{folder}/kw_strength.json", "w") as outfile:
+        json.dump({"kw_strength_event": None, "kw_strength_thought": None}, outfile)
+    start = datetime.datetime(2023, 2, 13)
+    exact_mem = build_memory(folder, embeddings, poignancy, start)
+    ann_mem = build_memory(folder, embeddings, poignancy, start)
+
+    # The focal points are put in the embedding store, so that new_retrieve
+    # finds their embeddings there.
+    focal_points = [f"benchmark focal point {i}" for i in range(args.queries)]
+    for focal_pt, focal_embedding in zip(focal_points, focal_embeddings):
+        get_embedding_store().add(focal_pt, focal_embedding)
+
+    scratch = SimpleNamespace(
+        recency_w=1,
+        relevance_w=1,
+        importance_w=1,
+        recency_decay=0.99,
+        curr_time=start + datetime.timedelta(minutes=args.nodes),
+    )
+    exact_persona = SimpleNamespace(a_mem=exact_mem, scratch=scratch)
+    ann_persona = SimpleNamespace(a_mem=ann_mem, scratch=scratch)
+
+    associative_memory.ann_index_type = "ivf"
+    associative_memory.ann_min_nodes = 0
+    s = time.perf_counter()
+    ann_mem.get_ann_index()
+    build_time = time.perf_counter() - s
+
+    exact_time = 0
+    ann_time = 0
+    recalls = []
+    for count, focal_pt in enumerate(focal_points):
+        scratch.curr_time += datetime.timedelta(minutes=10)
+
+        associative_memory.ann_index_type = None
+        s = time.perf_counter()
+        exact = new_retrieve(exact_persona, [focal_pt], args.n_count)[focal_pt]
+        exact_time += time.perf_counter() - s
+
+        associative_memory.ann_index_type = "ivf"
+        s = time.perf_counter()
+        approx = new_retrieve(ann_persona, [focal_pt], args.n_count)[focal_pt]
+        ann_time += time.perf_counter() - s
+
+        exact_ids = set(node.node_id for node in exact)
+        approx_ids = set(node.node_id for node in approx)
+        recalls += [len(exact_ids & approx_ids) / len(exact_ids)]
+
+        # Both memories continue from the exact retrieval's access times.
+        ann_mem.node_last_accessed[:] = exact_mem.node_last_accessed
+
+    print(f"nodes: {args.nodes}, queries: {args.queries}, n_count: {args.n_count}")
+    print(f"index build: {build_time * 1000:.0f} ms")
+    print(f"exact retrieval: {exact_time / args.queries * 1000:.2f} ms per call")
+    print(f"ann retrieval: {ann_time / args.queries * 1000:.2f} ms per call")
+    print(f"recall@{args.n_count}: {np.mean(recalls):.3f} (min {np.min(recalls):.3f})")
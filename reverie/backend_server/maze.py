@@ -6,12 +6,21 @@ Description: Defines the Maze class, which represents the map of the simulated
 world in a 2-dimensional matrix.
 """
 
+import hashlib
 import json
 import math
+import os
+import shutil
 
+import numpy as np
 from global_methods import *
+from path_finder import *
 from utils import *
 
+# <maze_snapshot_version> is part of the key of the binary map snapshots (see
+# Maze._save_snapshot). Bump it whenever the snapshot layout changes.
+maze_snapshot_version = 1
+
 
 class Maze:
     def __init__(self, maze_name):
@@ -31,6 +40,60 @@ class Maze:
         # e.g., "planning to stay at home all day and never go out of her home"
         self.special_constraint = meta_info["special_constraint"]
 
+        # LOADING THE MAP
+        # Parsing the matrices below (and computing the path engine's distance
+        # fields) takes a while, so the first time we load a map, we save the
+        # result as a binary snapshot in <env_matrix>/maze_cache. The snapshot
+        # is keyed by the hash of the matrix folder, so editing the map simply
+        # results in a new snapshot. Later loads memory-map the snapshot.
+        maze_cache_folder = f"{env_matrix}/maze_cache/{self._get_matrix_hash()}"
+        if not self._load_snapshot(maze_cache_folder):
+            self._build_from_matrix()
+            self._save_snapshot(maze_cache_folder)
+
+        # <self.tile_events> holds the set of events taking place on a tile, and
+        # only has entries for tiles that actually carry events.
+        # e.g., self.tile_events[(58, 9)] ==
+        #   {('double studio:double studio:bedroom 2:bed', None, None, None)}
+        # Each game object occupies an event in the tile. We are setting up the
+        # default event value here.
+        self.tile_events = dict()
+        go_labels = self.tile_path_labels["game_object"]
+        for i, j in zip(*np.nonzero(self.game_object_labels)):
+            object_name = self.tile_path_names["game_object"][go_labels[i, j]]
+            self.tile_events[(int(j), int(i))] = {(object_name, None, None, None)}
+
+        # EVENT INDEX
+        # Perception only cares about the few tiles that carry events within
+        # the persona's vision radius and arena. To answer that without looking
+        # at every tile, we index the tiles that have events both by their arena
+        # address and by square buckets of <event_bucket_size> tiles.
+        # e.g., self.arena_event_tiles["the Ville:Hobbs Cafe:cafe"] ==
+        #         {(72, 14), (73, 14), ...}
+        # e.g., self.event_buckets[(9, 1)] == {(72, 14), (73, 14), ...}
+        self.event_bucket_size = 8
+        self.arena_event_tiles = dict()
+        self.event_buckets = dict()
+        for tile in self.tile_events:
+            self._index_event_tile(tile)
+
+        # <self.arena_masks> caches, per arena address, a boolean array marking
+        # the tiles of that arena, and <self.distance_kernels> caches, per
+        # vision radius, the distance of every tile in the vision window from
+        # its center. See get_arena_mask and get_distance_kernel.
+        self.arena_masks = dict()
+        self.distance_kernels = dict()
+
+    def _build_from_matrix(self):
+        """
+        Reads the special blocks and the matrices of the map from <env_matrix>
+        and sets up the label arrays, <self.address_tiles> and the path engine.
+
+        INPUT
+          None
+        OUTPUT
+          None
+        """
         # READING IN SPECIAL BLOCKS
         # Special blocks are those that are colored in the Tiled map.
 
@@ -99,118 +162,299 @@ class Maze:
         # example format: [['0', '0', ... '25309', '0',...], ['0',...]...]
         # 25309 is the collision bar number right now.
         self.collision_maze = []
-        sector_maze = []
-        arena_maze = []
-        game_object_maze = []
-        spawning_location_maze = []
-        for i in range(0, len(collision_maze_raw), meta_info["maze_width"]):
-            tw = meta_info["maze_width"]
+        for i in range(0, len(collision_maze_raw), self.maze_width):
+            tw = self.maze_width
             self.collision_maze += [collision_maze_raw[i : i + tw]]
-            sector_maze += [sector_maze_raw[i : i + tw]]
-            arena_maze += [arena_maze_raw[i : i + tw]]
-            game_object_maze += [game_object_maze_raw[i : i + tw]]
-            spawning_location_maze += [spawning_location_maze_raw[i : i + tw]]
-
-        # Once we are done loading in the maze, we now set up self.tiles. This is
-        # a matrix accessed by row:col where each access point is a dictionary
-        # that contains all the things that are taking place in that tile.
-        # More specifically, it contains information about its "world," "sector,"
-        # "arena," "game_object," "spawning_location," as well as whether it is a
-        # collision block, and a set of all events taking place in it.
-        # e.g., self.tiles[32][59] = {'world': 'double studio',
-        #            'sector': '', 'arena': '', 'game_object': '',
-        #            'spawning_location': '', 'collision': False, 'events': set()}
-        # e.g., self.tiles[9][58] = {'world': 'double studio',
-        #         'sector': 'double studio', 'arena': 'bedroom 2',
-        #         'game_object': 'bed', 'spawning_location': 'bedroom-2-a',
-        #         'collision': False,
-        #         'events': {('double studio:double studio:bedroom 2:bed',
-        #                    None, None)}}
-        self.tiles = []
-        for i in range(self.maze_height):
-            row = []
-            for j in range(self.maze_width):
-                tile_details = dict()
-                tile_details["world"] = wb
-
-                tile_details["sector"] = ""
-                if sector_maze[i][j] in sb_dict:
-                    tile_details["sector"] = sb_dict[sector_maze[i][j]]
-
-                tile_details["arena"] = ""
-                if arena_maze[i][j] in ab_dict:
-                    tile_details["arena"] = ab_dict[arena_maze[i][j]]
-
-                tile_details["game_object"] = ""
-                if game_object_maze[i][j] in gob_dict:
-                    tile_details["game_object"] = gob_dict[game_object_maze[i][j]]
-
-                tile_details["spawning_location"] = ""
-                if spawning_location_maze[i][j] in slb_dict:
-                    tile_details["spawning_location"] = slb_dict[
-                        spawning_location_maze[i][j]
-                    ]
-
-                tile_details["collision"] = False
-                if self.collision_maze[i][j] != "0":
-                    tile_details["collision"] = True
-
-                tile_details["events"] = set()
-
-                row += [tile_details]
-            self.tiles += [row]
-        # Each game object occupies an event in the tile. We are setting up the
-        # default event value here.
-        for i in range(self.maze_height):
-            for j in range(self.maze_width):
-                if self.tiles[i][j]["game_object"]:
-                    object_name = ":".join(
-                        [
-                            self.tiles[i][j]["world"],
-                            self.tiles[i][j]["sector"],
-                            self.tiles[i][j]["arena"],
-                            self.tiles[i][j]["game_object"],
-                        ],
-                    )
-                    go_event = (object_name, None, None, None)
-                    self.tiles[i][j]["events"].add(go_event)
+
+        # Once we are done loading in the maze, we set up the per-tile details.
+        # Rather than keeping a dictionary for every tile, each layer of the map
+        # is stored as a (maze_height, maze_width) int16 label array that
+        # indexes into a table of names, where label 0 is always the empty
+        # string.
+        # e.g., self.arena_labels[9][58] == 3 and self.arena_names[3] ==
+        #   "bedroom 2"
+        # <self.collision> is a boolean array marking the collision blocks.
+        # Use access_tile to get the old-style tile details dictionary.
+        self.world = wb
+        self.sector_labels, self.sector_names = self._label_maze(
+            sector_maze_raw,
+            sb_dict,
+        )
+        self.arena_labels, self.arena_names = self._label_maze(
+            arena_maze_raw,
+            ab_dict,
+        )
+        self.game_object_labels, self.game_object_names = self._label_maze(
+            game_object_maze_raw,
+            gob_dict,
+        )
+        self.spawning_location_labels, self.spawning_location_names = self._label_maze(
+            spawning_location_maze_raw,
+            slb_dict,
+        )
+        self.collision = (
+            np.array(collision_maze_raw).reshape(self.maze_height, self.maze_width)
+            != "0"
+        )
+
+        # The string address of every tile at every level is interned: each
+        # distinct address is built once, and <self.tile_path_labels[level]>
+        # points every tile to its entry in <self.tile_path_names[level]>.
+        # e.g., self.tile_path_names["arena"][
+        #         self.tile_path_labels["arena"][9][58]]
+        #   == "double studio:double studio:bedroom 2"
+        self.tile_path_labels = dict()
+        self.tile_path_names = dict()
+        self.tile_path_labels["world"] = np.zeros(
+            (self.maze_height, self.maze_width),
+            dtype=np.int16,
+        )
+        self.tile_path_names["world"] = [self.world]
+        level_layers = [
+            (self.sector_labels, self.sector_names),
+            (self.arena_labels, self.arena_names),
+            (self.game_object_labels, self.game_object_names),
+        ]
+        for count, level in enumerate(["sector", "arena", "game_object"]):
+            labels, names = self._intern_tile_paths(level_layers[: count + 1])
+            self.tile_path_labels[level] = labels
+            self.tile_path_names[level] = names
 
         # Reverse tile access.
         # <self.address_tiles> -- given a string address, we return a set of all
         # tile coordinates belonging to that address (this is opposite of
-        # self.tiles that give you the string address given a coordinate). This is
-        # an optimization component for finding paths for the personas' movement.
+        # access_tile that give you the string address given a coordinate). This
+        # is an optimization component for finding paths for the personas'
+        # movement.
         # self.address_tiles['<spawn_loc>bedroom-2-a'] == {(58, 9)}
         # self.address_tiles['double studio:recreation:pool table']
         #   == {(29, 14), (31, 11), (30, 14), (32, 11), ...},
         self.address_tiles = dict()
-        for i in range(self.maze_height):
-            for j in range(self.maze_width):
-                addresses = []
-                if self.tiles[i][j]["sector"]:
-                    add = f"{self.tiles[i][j]['world']}:"
-                    add += f"{self.tiles[i][j]['sector']}"
-                    addresses += [add]
-                if self.tiles[i][j]["arena"]:
-                    add = f"{self.tiles[i][j]['world']}:"
-                    add += f"{self.tiles[i][j]['sector']}:"
-                    add += f"{self.tiles[i][j]['arena']}"
-                    addresses += [add]
-                if self.tiles[i][j]["game_object"]:
-                    add = f"{self.tiles[i][j]['world']}:"
-                    add += f"{self.tiles[i][j]['sector']}:"
-                    add += f"{self.tiles[i][j]['arena']}:"
-                    add += f"{self.tiles[i][j]['game_object']}"
-                    addresses += [add]
-                if self.tiles[i][j]["spawning_location"]:
-                    add = f"<spawn_loc>{self.tiles[i][j]['spawning_location']}"
-                    addresses += [add]
-
-                for add in addresses:
-                    if add in self.address_tiles:
-                        self.address_tiles[add].add((j, i))
-                    else:
-                        self.address_tiles[add] = set([(j, i)])
+        address_layers = [
+            ("sector", self.sector_labels),
+            ("arena", self.arena_labels),
+            ("game_object", self.game_object_labels),
+        ]
+        for level, layer_labels in address_layers:
+            path_labels = self.tile_path_labels[level]
+            for label in np.unique(path_labels[layer_labels > 0]):
+                add = self.tile_path_names[level][label]
+                ys, xs = np.nonzero((path_labels == label) & (layer_labels > 0))
+                self.address_tiles[add] = set(zip(xs.tolist(), ys.tolist()))
+        for label in np.unique(self.spawning_location_labels):
+            if label == 0:
+                continue
+            add = f"<spawn_loc>{self.spawning_location_names[label]}"
+            ys, xs = np.nonzero(self.spawning_location_labels == label)
+            self.address_tiles[add] = set(zip(xs.tolist(), ys.tolist()))
+
+        # <self.path_engine> holds the walkability grid and a precomputed
+        # distance field for every address in <self.address_tiles>. This is what
+        # the personas use to find their way to the target of their action.
+        self.path_engine = PathEngine(
+            self.collision_maze,
+            collision_block_id,
+            self.address_tiles,
+        )
+
+    def _get_matrix_hash(self):
+        """
+        Hashes every file in the <env_matrix> folder (except for the snapshots
+        themselves), together with the snapshot format version and the
+        collision block id.
+
+        INPUT
+          None
+        OUTPUT
+          A hex digest string.
+        """
+        h = hashlib.sha256()
+        h.update(f"{maze_snapshot_version}:{collision_block_id}".encode())
+        for root, dirs, files in os.walk(env_matrix):
+            dirs[:] = sorted(i for i in dirs if i != "maze_cache")
+            for file_name in sorted(files):
+                curr_file = f"{root}/{file_name}"
+                h.update(os.path.relpath(curr_file, env_matrix).encode())
+                with open(curr_file, "rb") as f:
+                    h.update(f.read())
+        return h.hexdigest()
+
+    def _save_snapshot(self, snapshot_folder):
+        """
+        Saves the parsed map as a folder of .npy arrays and a meta.json file.
+        The folder is written next to its final location and then renamed, so
+        a half written snapshot is never picked up. Failing to save (e.g., on a
+        read-only file system) is not an error; we just parse again next time.
+
+        INPUT
+          snapshot_folder: The folder the snapshot is saved to.
+        OUTPUT
+          None
+        """
+        if os.path.exists(snapshot_folder):
+            return
+        temp_folder = f"{snapshot_folder}.tmp{os.getpid()}"
+        try:
+            os.makedirs(temp_folder)
+            arrays = {
+                "collision_maze": np.array(self.collision_maze),
+                "sector_labels": self.sector_labels,
+                "arena_labels": self.arena_labels,
+                "game_object_labels": self.game_object_labels,
+                "spawning_location_labels": self.spawning_location_labels,
+                "sector_path_labels": self.tile_path_labels["sector"],
+                "arena_path_labels": self.tile_path_labels["arena"],
+                "game_object_path_labels": self.tile_path_labels["game_object"],
+            }
+            addresses = list(self.path_engine.address_fields.keys())
+            arrays["address_fields"] = np.stack(
+                [self.path_engine.address_fields[i] for i in addresses],
+            )
+            for name, array in arrays.items():
+                np.save(f"{temp_folder}/{name}.npy", array)
+
+            snapshot_meta = dict()
+            snapshot_meta["version"] = maze_snapshot_version
+            snapshot_meta["world"] = self.world
+            snapshot_meta["sector_names"] = self.sector_names
+            snapshot_meta["arena_names"] = self.arena_names
+            snapshot_meta["game_object_names"] = self.game_object_names
+            snapshot_meta["spawning_location_names"] = self.spawning_location_names
+            snapshot_meta["tile_path_names"] = self.tile_path_names
+            snapshot_meta["addresses"] = addresses
+            snapshot_meta["address_tiles"] = {
+                key: sorted(val) for key, val in self.address_tiles.items()
+            }
+            with open(f"{temp_folder}/meta.json", "w") as outfile:
+                json.dump(snapshot_meta, outfile)
+
+            os.replace(temp_folder, snapshot_folder)
+        except OSError:
+            print(f"Could not save the maze snapshot to {snapshot_folder}")
+            shutil.rmtree(temp_folder, ignore_errors=True)
+
+    def _load_snapshot(self, snapshot_folder):
+        """
+        Loads a snapshot saved by _save_snapshot. The arrays are memory-mapped
+        rather than read.
+
+        INPUT
+          snapshot_folder: The folder the snapshot was saved to.
+        OUTPUT
+          True if the snapshot was loaded, False if there is no usable
+          snapshot (in which case nothing is set).
+        """
+        try:
+            with open(f"{snapshot_folder}/meta.json") as json_file:
+                snapshot_meta = json.load(json_file)
+            if snapshot_meta["version"] != maze_snapshot_version:
+                return False
+
+            arrays = dict()
+            for name in [
+                "collision_maze",
+                "sector_labels",
+                "arena_labels",
+                "game_object_labels",
+                "spawning_location_labels",
+                "sector_path_labels",
+                "arena_path_labels",
+                "game_object_path_labels",
+                "address_fields",
+            ]:
+                arrays[name] = np.load(f"{snapshot_folder}/{name}.npy", mmap_mode="r")
+        except (OSError, ValueError, KeyError):
+            return False
+
+        self.collision_maze = arrays["collision_maze"].tolist()
+        self.collision = np.array(arrays["collision_maze"]) != "0"
+
+        self.world = snapshot_meta["world"]
+        self.sector_labels = arrays["sector_labels"]
+        self.sector_names = snapshot_meta["sector_names"]
+        self.arena_labels = arrays["arena_labels"]
+        self.arena_names = snapshot_meta["arena_names"]
+        self.game_object_labels = arrays["game_object_labels"]
+        self.game_object_names = snapshot_meta["game_object_names"]
+        self.spawning_location_labels = arrays["spawning_location_labels"]
+        self.spawning_location_names = snapshot_meta["spawning_location_names"]
+
+        self.tile_path_names = snapshot_meta["tile_path_names"]
+        self.tile_path_labels = dict()
+        self.tile_path_labels["world"] = np.zeros(
+            (self.maze_height, self.maze_width),
+            dtype=np.int16,
+        )
+        for level in ["sector", "arena", "game_object"]:
+            self.tile_path_labels[level] = arrays[f"{level}_path_labels"]
+
+        self.address_tiles = dict()
+        for key, val in snapshot_meta["address_tiles"].items():
+            self.address_tiles[key] = set((i[0], i[1]) for i in val)
+
+        address_fields = dict()
+        for count, address in enumerate(snapshot_meta["addresses"]):
+            address_fields[address] = arrays["address_fields"][count]
+        self.path_engine = PathEngine(
+            self.collision_maze,
+            collision_block_id,
+            self.address_tiles,
+            address_fields=address_fields,
+        )
+        return True
+
+    def _label_maze(self, maze_raw, block_dict):
+        """
+        Turns a raw (single row) maze of color block markers into a label array
+        and the table of names that the labels index into.
+
+        INPUT
+          maze_raw: The single row list of block markers read from the csv.
+          block_dict: A dictionary from block marker to its name.
+        OUTPUT
+          labels: A (maze_height, maze_width) int16 array.
+          names: A list of names, where names[0] == "".
+        """
+        names = [""]
+        name_to_label = {"": 0}
+        markers, inverse = np.unique(np.array(maze_raw), return_inverse=True)
+        marker_labels = []
+        for marker in markers.tolist():
+            name = block_dict.get(marker, "")
+            if name not in name_to_label:
+                name_to_label[name] = len(names)
+                names += [name]
+            marker_labels += [name_to_label[name]]
+        labels = np.array(marker_labels, dtype=np.int16)[inverse]
+        return labels.reshape(self.maze_height, self.maze_width), names
+
+    def _intern_tile_paths(self, layers):
+        """
+        Builds each distinct string address made up of the given layers once.
+
+        INPUT
+          layers: A list of (labels, names) pairs, from the sector level down.
+        OUTPUT
+          path_labels: A (maze_height, maze_width) int16 array.
+          path_names: A list of string addresses that path_labels index into.
+        """
+        key = np.zeros((self.maze_height, self.maze_width), dtype=np.int64)
+        for labels, names in layers:
+            key = key * len(names) + labels
+        _, first_index, inverse = np.unique(
+            key.ravel(),
+            return_index=True,
+            return_inverse=True,
+        )
+        path_names = []
+        for index in first_index.tolist():
+            i, j = divmod(index, self.maze_width)
+            path = self.world
+            for labels, names in layers:
+                path += f":{names[labels[i, j]]}"
+            path_names += [path]
+        path_labels = inverse.astype(np.int16)
+        return path_labels.reshape(self.maze_height, self.maze_width), path_names
 
     def turn_coordinate_to_tile(self, px_coordinate):
         """
@@ -231,8 +475,10 @@ class Maze:
 
     def access_tile(self, tile):
         """
-        Returns the tiles details dictionary that is stored in self.tiles of the
-        designated x, y location.
+        Returns the tiles details dictionary of the designated x, y location.
+        The dictionary is assembled from the label arrays on every call, so it
+        is a read-only view: changing its values does not change the maze
+        (use add_event_from_tile etc. to change the events of a tile).
 
         INPUT
           tile: The tile coordinate of our interest in (x, y) form.
@@ -240,7 +486,7 @@ class Maze:
           The tile detail dictionary for the designated tile.
         EXAMPLE OUTPUT
           Given (58, 9),
-          self.tiles[9][58] = {'world': 'double studio',
+          {'world': 'double studio',
                 'sector': 'double studio', 'arena': 'bedroom 2',
                 'game_object': 'bed', 'spawning_location': 'bedroom-2-a',
                 'collision': False,
@@ -249,7 +495,19 @@ class Maze:
         """
         x = tile[0]
         y = tile[1]
-        return self.tiles[y][x]
+        tile_details = dict()
+        tile_details["world"] = self.world
+        tile_details["sector"] = self.sector_names[self.sector_labels[y, x]]
+        tile_details["arena"] = self.arena_names[self.arena_labels[y, x]]
+        tile_details["game_object"] = self.game_object_names[
+            self.game_object_labels[y, x]
+        ]
+        tile_details["spawning_location"] = self.spawning_location_names[
+            self.spawning_location_labels[y, x]
+        ]
+        tile_details["collision"] = bool(self.collision[y, x])
+        tile_details["events"] = self.tile_events.get((x, y), set())
+        return tile_details
 
     def get_tile_path(self, tile, level):
         """
@@ -267,22 +525,35 @@ class Maze:
         """
         x = tile[0]
         y = tile[1]
-        tile = self.tiles[y][x]
+        if level not in ["world", "sector", "arena"]:
+            level = "game_object"
+        return self.tile_path_names[level][self.tile_path_labels[level][y, x]]
+
+    def get_nearby_window(self, tile, vision_r):
+        """
+        Returns the bounds of the square window that get_nearby_tiles looks at.
+        The right and bottom bounds are exclusive (and, as in the original
+        implementation, never reach the last column or row of the maze).
+
+        INPUT:
+          tile: The tile coordinate of our interest in (x, y) form.
+          vision_r: The radius of the persona's vision.
+        OUTPUT:
+          (left_end, right_end, top_end, bottom_end)
+        """
+        left_end = 0
+        left_end = max(tile[0] - vision_r, left_end)
 
-        path = f"{tile['world']}"
-        if level == "world":
-            return path
-        path += f":{tile['sector']}"
+        right_end = self.maze_width - 1
+        right_end = min(tile[0] + vision_r + 1, right_end)
 
-        if level == "sector":
-            return path
-        path += f":{tile['arena']}"
+        bottom_end = self.maze_height - 1
+        bottom_end = min(tile[1] + vision_r + 1, bottom_end)
 
-        if level == "arena":
-            return path
-        path += f":{tile['game_object']}"
+        top_end = 0
+        top_end = max(tile[1] - vision_r, top_end)
 
-        return path
+        return left_end, right_end, top_end, bottom_end
 
     def get_nearby_tiles(self, tile, vision_r):
         """
@@ -302,17 +573,10 @@ class Maze:
         OUTPUT:
           nearby_tiles: a list of tiles that are within the radius.
         """
-        left_end = 0
-        left_end = max(tile[0] - vision_r, left_end)
-
-        right_end = self.maze_width - 1
-        right_end = min(tile[0] + vision_r + 1, right_end)
-
-        bottom_end = self.maze_height - 1
-        bottom_end = min(tile[1] + vision_r + 1, bottom_end)
-
-        top_end = 0
-        top_end = max(tile[1] - vision_r, top_end)
+        left_end, right_end, top_end, bottom_end = self.get_nearby_window(
+            tile,
+            vision_r,
+        )
 
         nearby_tiles = []
         for i in range(left_end, right_end):
@@ -320,6 +584,139 @@ class Maze:
                 nearby_tiles += [(i, j)]
         return nearby_tiles
 
+    def update_collision_maze(self, collision_maze):
+        """
+        Replaces the collision maze (e.g., when a door gets locked), keeping the
+        tiles' collision flags and the path engine in sync with it. The shared
+        path cache is only invalidated if a tile's walkability changed. The
+        collision maze must only be changed through here, or the personas keep
+        walking the cached paths of the old one.
+
+        INPUT:
+          collision_maze: The new collision maze, in the same list of list form
+                          as self.collision_maze.
+        OUPUT:
+          True if the walkability of any tile changed, False otherwise.
+        """
+        self.collision_maze = collision_maze
+        self.collision = np.array(self.collision_maze) != "0"
+        return self.path_engine.sync(self.collision_maze)
+
+    def _index_event_tile(self, tile):
+        arena = self.get_tile_path(tile, "arena")
+        self.arena_event_tiles.setdefault(arena, set()).add(tile)
+        bucket = (
+            tile[0] // self.event_bucket_size,
+            tile[1] // self.event_bucket_size,
+        )
+        self.event_buckets.setdefault(bucket, set()).add(tile)
+
+    def _unindex_event_tile(self, tile):
+        arena = self.get_tile_path(tile, "arena")
+        self.arena_event_tiles[arena].discard(tile)
+        if not self.arena_event_tiles[arena]:
+            del self.arena_event_tiles[arena]
+        bucket = (
+            tile[0] // self.event_bucket_size,
+            tile[1] // self.event_bucket_size,
+        )
+        self.event_buckets[bucket].discard(tile)
+        if not self.event_buckets[bucket]:
+            del self.event_buckets[bucket]
+
+    def get_arena_mask(self, arena):
+        """
+        Returns a (maze_height, maze_width) boolean array that is True for all
+        tiles whose arena address is <arena>. The masks are cached.
+
+        INPUT:
+          arena: The arena string address.
+            e.g., "the Ville:Hobbs Cafe:cafe"
+        OUTPUT:
+          The boolean mask array.
+        """
+        if arena not in self.arena_masks:
+            names = self.tile_path_names["arena"]
+            if arena in names:
+                mask = self.tile_path_labels["arena"] == names.index(arena)
+            else:
+                mask = np.zeros((self.maze_height, self.maze_width), dtype=bool)
+            self.arena_masks[arena] = mask
+        return self.arena_masks[arena]
+
+    def get_distance_kernel(self, vision_r):
+        """
+        Returns a (2 * vision_r + 1) x (2 * vision_r + 1) nested list with the
+        euclidean distance of every tile in the vision window from the center.
+        The kernels are computed once per radius and cached.
+        e.g., kernel[dy + vision_r, dx + vision_r] == math.dist((0, 0), (dx, dy))
+
+        INPUT:
+          vision_r: The radius of the persona's vision.
+        OUTPUT:
+          The distance kernel.
+        """
+        if vision_r not in self.distance_kernels:
+            offsets = np.arange(-vision_r, vision_r + 1)
+            dy, dx = np.meshgrid(offsets, offsets, indexing="ij")
+            self.distance_kernels[vision_r] = np.sqrt(dx**2 + dy**2).tolist()
+        return self.distance_kernels[vision_r]
+
+    def get_nearby_event_tiles(self, tile, vision_r, arena=None):
+        """
+        Returns the tiles that carry events within the persona's vision radius
+        (the same square window as get_nearby_tiles), optionally only those in
+        the given arena, sorted by their distance from <tile>. Only tiles that
+        actually carry events are looked at.
+
+        INPUT:
+          tile: The tile coordinate of our interest in (x, y) form.
+          vision_r: The radius of the persona's vision.
+          arena: Optional arena string address.
+            e.g., "the Ville:Hobbs Cafe:cafe"
+        OUTPUT:
+          A list of [dist, tile] pairs sorted by the (euclidean) distance, with
+          ties ordered the same way as get_nearby_tiles orders the tiles.
+        """
+        left_end, right_end, top_end, bottom_end = self.get_nearby_window(
+            tile,
+            vision_r,
+        )
+
+        # We look through whichever is smaller: the arena's event tiles or the
+        # event tiles in the buckets that overlap the window.
+        bucket_tiles = []
+        for bx in range(
+            left_end // self.event_bucket_size,
+            (right_end - 1) // self.event_bucket_size + 1,
+        ):
+            for by in range(
+                top_end // self.event_bucket_size,
+                (bottom_end - 1) // self.event_bucket_size + 1,
+            ):
+                if (bx, by) in self.event_buckets:
+                    bucket_tiles += [self.event_buckets[(bx, by)]]
+        candidates = [i for bucket in bucket_tiles for i in bucket]
+        arena_mask = None
+        if arena is not None:
+            arena_tiles = self.arena_event_tiles.get(arena, set())
+            if len(arena_tiles) < len(candidates):
+                candidates = arena_tiles
+            else:
+                arena_mask = self.get_arena_mask(arena)
+
+        # The distances come from the cached kernel and the arena check from
+        # the cached arena mask, so neither is recomputed per call.
+        kernel = self.get_distance_kernel(vision_r)
+        nearby_event_tiles = []
+        for i in candidates:
+            if left_end <= i[0] < right_end and top_end <= i[1] < bottom_end:
+                if arena_mask is None or arena_mask[i[1], i[0]]:
+                    dist = kernel[i[1] - tile[1] + vision_r][i[0] - tile[0] + vision_r]
+                    nearby_event_tiles += [[dist, i]]
+        nearby_event_tiles.sort(key=lambda x: (x[0], x[1][0], x[1][1]))
+        return nearby_event_tiles
+
     def add_event_from_tile(self, curr_event, tile):
         """
         Add an event triple to a tile.
@@ -332,7 +729,11 @@ class Maze:
         OUPUT:
           None
         """
-        self.tiles[tile[1]][tile[0]]["events"].add(curr_event)
+        tile = (tile[0], tile[1])
+        if tile not in self.tile_events:
+            self.tile_events[tile] = set()
+            self._index_event_tile(tile)
+        self.tile_events[tile].add(curr_event)
 
     def remove_event_from_tile(self, curr_event, tile):
         """
@@ -346,18 +747,19 @@ class Maze:
         OUPUT:
           None
         """
-        curr_tile_ev_cp = self.tiles[tile[1]][tile[0]]["events"].copy()
-        for event in curr_tile_ev_cp:
-            if event == curr_event:
-                self.tiles[tile[1]][tile[0]]["events"].remove(event)
+        curr_tile_events = self.tile_events.get((tile[0], tile[1]))
+        if not curr_tile_events:
+            return
+        curr_tile_events.discard(curr_event)
+        if not curr_tile_events:
+            del self.tile_events[(tile[0], tile[1])]
+            self._unindex_event_tile((tile[0], tile[1]))
 
     def turn_event_from_tile_idle(self, curr_event, tile):
-        curr_tile_ev_cp = self.tiles[tile[1]][tile[0]]["events"].copy()
-        for event in curr_tile_ev_cp:
-            if event == curr_event:
-                self.tiles[tile[1]][tile[0]]["events"].remove(event)
-                new_event = (event[0], None, None, None)
-                self.tiles[tile[1]][tile[0]]["events"].add(new_event)
+        curr_tile_events = self.tile_events.get((tile[0], tile[1]))
+        if curr_tile_events and curr_event in curr_tile_events:
+            curr_tile_events.remove(curr_event)
+            curr_tile_events.add((curr_event[0], None, None, None))
 
     def remove_subject_events_from_tile(self, subject, tile):
         """
@@ -369,7 +771,12 @@ class Maze:
         OUPUT:
           None
         """
-        curr_tile_ev_cp = self.tiles[tile[1]][tile[0]]["events"].copy()
-        for event in curr_tile_ev_cp:
+        curr_tile_events = self.tile_events.get((tile[0], tile[1]))
+        if not curr_tile_events:
+            return
+        for event in curr_tile_events.copy():
             if event[0] == subject:
-                self.tiles[tile[1]][tile[0]]["events"].remove(event)
+                curr_tile_events.remove(event)
+        if not curr_tile_events:
+            del self.tile_events[(tile[0], tile[1])]
+            self._unindex_event_tile((tile[0], tile[1]))
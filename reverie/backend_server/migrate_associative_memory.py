@@ -0,0 +1,130 @@
+"""
+File: migrate_associative_memory.py
+Description: Converts the associative memories of saved simulations to the
+current format: the nodes in an append-only nodes.jsonl (instead of a
+nodes.json that is rewritten on every save), and the embeddings in the shared
+embedding store (see persona/memory_structures/embedding_store.py) instead of
+an embeddings.json. The old files are removed.
+
+Simulations that were not converted still load (and are converted the first
+time they are saved), so this only has to be run to free up the space, or to
+convert simulations that will only be forked from.
+
+With --export, it goes the other way for the simulations that were already
+converted: it writes the embeddings of each associative memory to an
+embeddings.json next to its nodes.jsonl, so that the simulation folder can be
+shared and loaded on a machine that does not have the embedding store. (The
+embeddings are moved into that machine's store when the simulation is
+loaded, and the embeddings.json is removed when it is saved.)
+
+Run it from this folder, e.g., with <storage> being
+../../environment/frontend_server/storage:
+  python migrate_associative_memory.py
+  python migrate_associative_memory.py <storage>/base_the_ville_n25
+  python migrate_associative_memory.py --export <storage>/my_simulation
+"""
+
+import argparse
+import os
+import sys
+
+from global_methods import *
+from persona.memory_structures.associative_memory import *
+
+
+def find_associative_memories(folder, nodes_file="nodes.json"):
+    """
+    Returns the associative_memory folders under <folder> that have a
+    <nodes_file>. By default, these are the ones still in the old format.
+    """
+    a_mem_folders = []
+    for root, dirs, files in os.walk(folder):
+        if os.path.basename(root) == "associative_memory":
+            if nodes_file in files:
+                a_mem_folders += [root]
+    return sorted(a_mem_folders)
+
+
+def folder_size(folder):
+    """
+    Returns the number of bytes of the files in <folder>.
+    """
+    return sum(os.path.getsize(f"{folder}/{i}") for i in os.listdir(folder))
+
+
+def migrate_associative_memory(a_mem_folder):
+    """
+    Converts the associative memory in <a_mem_folder> by loading it and
+    saving it back.
+
+    INPUT
+      a_mem_folder: The associative_memory folder.
+    OUTPUT
+      The number of bytes of the folder before and after.
+    """
+    size_before = folder_size(a_mem_folder)
+    AssociativeMemory(a_mem_folder).save(a_mem_folder)
+    return size_before, folder_size(a_mem_folder)
+
+
+def export_associative_memory(a_mem_folder):
+    """
+    Writes the embeddings of the associative memory in <a_mem_folder> to its
+    embeddings.json.
+
+    INPUT
+      a_mem_folder: The associative_memory folder.
+    OUTPUT
+      None
+    """
+    memory = AssociativeMemory(a_mem_folder)
+    memory.embeddings.export(f"{a_mem_folder}/embeddings.json")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument(
+        "folders",
+        nargs="*",
+        default=[fs_storage],
+        help="simulation folders (or folders of them) to migrate",
+    )
+    parser.add_argument(
+        "--export",
+        action="store_true",
+        help="write the embeddings of converted simulations to embeddings.json",
+    )
+    args = parser.parse_args()
+
+    if args.export:
+        for folder in args.folders:
+            for a_mem_folder in find_associative_memories(folder, "nodes.jsonl"):
+                export_associative_memory(a_mem_folder)
+                print("exported", a_mem_folder)
+        sys.exit(0)
+
+    store = get_embedding_store()
+    rows_before = len(store)
+    a_mem_folders = []
+    for folder in args.folders:
+        a_mem_folders += find_associative_memories(folder)
+
+    total_before = 0
+    total_after = 0
+    migrated_count = 0
+    for a_mem_folder in a_mem_folders:
+        # A memory that does not load (e.g., one whose embeddings.json is
+        # missing) is left as it is.
+        try:
+            size_before, size_after = migrate_associative_memory(a_mem_folder)
+        except (OSError, KeyError, ValueError) as e:
+            print("skipped", a_mem_folder, f"({e})")
+            continue
+        total_before += size_before
+        total_after += size_after
+        migrated_count += 1
+        print("migrated", a_mem_folder)
+
+    print(f"{migrated_count} of {len(a_mem_folders)} associative memories migrated")
+    print(f"{len(store) - rows_before} new embeddings in {store.folder}")
+    print(f"{total_before / 2**20:.1f} MB before, {total_after / 2**20:.1f} MB after")
@@ -6,6 +6,11 @@ Description: Implements various path finding functions for generative agents.
 Some of the functions are defunct.
 """
 
+import heapq
+import random
+import time
+from collections import OrderedDict, deque
+
 import numpy as np
 
 
@@ -163,13 +168,74 @@ def path_finder_v2(a, start, end, collision_block_char, verbose=False):
     return the_path
 
 
-def path_finder(maze, start, end, collision_block_char, verbose=False):
+def path_finder_astar(
+    a,
+    start,
+    end,
+    collision_block_char,
+    verbose=False,
+    path_engine=None,
+):
+    """
+    A* search with a Manhattan distance heuristic. Unlike path_finder_v2, this
+    does not flood the whole matrix layer by layer and it has no cap on the
+    length of the path. Like path_finder_v2, it takes and returns (row, col)
+    coordinates.
+
+    INPUT
+      a: The collision maze (a list of list of block strings).
+      start: The (row, col) tile we are starting from.
+      end: The (row, col) tile we want to get to.
+      collision_block_char: The block string that marks a collision.
+      path_engine: The <PathEngine> of the collision maze (e.g.,
+                   maze.path_engine), whose walkability grid is searched. If
+                   it is None, a grid is built from <a> for this search only.
+    OUTPUT
+      A list of (row, col) tiles from <start> to <end>. An empty list if <end>
+      cannot be reached.
+    """
+    if path_engine is None:
+        path_engine = PathEngine(a, collision_block_char)
+    path = path_engine.path_astar((start[1], start[0]), (end[1], end[0]))
+    return [(i[1], i[0]) for i in path]
+
+
+def path_finder(
+    maze,
+    start,
+    end,
+    collision_block_char,
+    verbose=False,
+    algorithm="astar",
+    path_engine=None,
+):
+    """
+    Returns the path from <start> to <end> as a list of (x, y) tiles that
+    starts with <start>.
+
+    <algorithm> is either "astar" (default) or "v2", the original flood fill
+    that gives up after 150 layers. A* searches the walkability grid of
+    <path_engine> (e.g., maze.path_engine) when it is given, instead of
+    building one from <maze> on every call.
+    """
     # EMERGENCY PATCH
     start = (start[1], start[0])
     end = (end[1], end[0])
     # END EMERGENCY PATCH
 
-    path = path_finder_v2(maze, start, end, collision_block_char, verbose)
+    if algorithm == "astar":
+        path = path_finder_astar(
+            maze,
+            start,
+            end,
+            collision_block_char,
+            verbose,
+            path_engine,
+        )
+    elif algorithm == "v2":
+        path = path_finder_v2(maze, start, end, collision_block_char, verbose)
+    else:
+        raise ValueError(f"Unknown path finding algorithm: {algorithm}")
 
     new_path = []
     for i in path:
@@ -245,6 +311,464 @@ def path_finder_3(maze, start, end, collision_block_char, verbose=False):
     return a_path, b_path
 
 
+class PathEngine:
+    """
+    Path finding engine that is built once per <Maze>. Instead of flooding the
+    collision maze every time a persona needs a path, we keep the walkability
+    grid as a NumPy array and precompute a BFS distance field for every address
+    in <maze.address_tiles>. Finding the path from a tile to the nearest tile
+    of an address then becomes a gradient descent over the cached field (see
+    paths_to_address, which execute uses).
+
+    Note that all tiles here are in the (x, y) form, like everywhere else
+    outside of this file.
+
+    Paths that go through find_path are also kept in an LRU cache that is
+    shared by all personas, since many of them walk the same routes every day
+    (e.g., home to Hobbs Cafe). The cache and the distance fields are only
+    thrown away when the collision maze actually changes (see sync).
+    """
+
+    def __init__(
+        self,
+        collision_maze,
+        collision_block_char,
+        address_tiles=None,
+        path_cache_size=4096,
+        address_fields=None,
+    ):
+        self.collision_block_char = collision_block_char
+        self.address_tiles = address_tiles or dict()
+
+        # <path_cache> maps (start, goal) to a path, where the goal is either a
+        # (x, y) tile or a string address. Most recently used entries are at
+        # the end.
+        self.path_cache = OrderedDict()
+        self.path_cache_size = path_cache_size
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+        self._build(self._walkable_from(collision_maze), address_fields)
+
+    def _walkable_from(self, collision_maze):
+        return np.array(
+            [[j != self.collision_block_char for j in row] for row in collision_maze],
+            dtype=bool,
+        )
+
+    def _build(self, walkable, address_fields=None):
+        # <walkable> is a (maze_height, maze_width) boolean array that is True
+        # for all tiles that the personas can step on.
+        self.walkable = walkable
+        self.maze_height, self.maze_width = self.walkable.shape
+        # Flat (row-major) copy of <walkable> as Python bools; the per-tile
+        # searches below index into this instead of the NumPy array.
+        self.walkable_flat = self.walkable.ravel().tolist()
+
+        # <address_fields> is a dictionary that takes a string address as its
+        # key and the distance field towards that address as its value. It can
+        # be handed in precomputed (e.g., from the Maze's binary snapshot).
+        # e.g., self.address_fields["the Ville:Hobbs Cafe:cafe"][y, x] == 12
+        #   means that the closest cafe tile is 12 steps away from (x, y).
+        if address_fields is None:
+            address_fields = dict()
+            for address, tiles in self.address_tiles.items():
+                address_fields[address] = self.distance_field(tiles)
+        self.address_fields = address_fields
+
+        self.path_cache.clear()
+
+    def sync(self, collision_maze):
+        """
+        Brings the engine up to date with <collision_maze>. If the walkability
+        of any tile changed, the distance fields are recomputed and the path
+        cache is emptied; otherwise nothing is touched.
+
+        INPUT
+          collision_maze: The current collision maze of the <Maze>.
+        OUTPUT
+          True if the collision maze changed, False otherwise.
+        """
+        walkable = self._walkable_from(collision_maze)
+        if np.array_equal(walkable, self.walkable):
+            return False
+        self._build(walkable)
+        return True
+
+    def cache_info(self):
+        """
+        Returns the hit/miss counters and the current size of the path cache.
+        e.g., {"hits": 120, "misses": 30, "size": 30, "max_size": 4096}
+        """
+        return {
+            "hits": self.cache_hits,
+            "misses": self.cache_misses,
+            "size": len(self.path_cache),
+            "max_size": self.path_cache_size,
+        }
+
+    def find_path(self, start, goal):
+        """
+        Returns the path from <start> to <goal>, going through the path cache.
+        A path from A to B is also served (reversed) for a request from B to A.
+
+        INPUT
+          start: The (x, y) tile we are starting from.
+          goal: Either a (x, y) tile, or a string address that is in
+                <maze.address_tiles> (in which case we go to its closest tile).
+        OUTPUT
+          A list of (x, y) tiles starting with <start>. An empty list if the
+          goal cannot be reached.
+        """
+        start = tuple(start)
+        if not isinstance(goal, str):
+            goal = tuple(goal)
+        key = (start, goal)
+
+        if key in self.path_cache:
+            self.cache_hits += 1
+            self.path_cache.move_to_end(key)
+            return list(self.path_cache[key])
+
+        if not isinstance(goal, str):
+            # Reversing only holds when both ends are walkable; otherwise one
+            # of the two directions is not a valid path.
+            reverse_key = (goal, start)
+            if reverse_key in self.path_cache and (
+                self.walkable[start[1], start[0]] and self.walkable[goal[1], goal[0]]
+            ):
+                self.cache_hits += 1
+                self.path_cache.move_to_end(reverse_key)
+                return list(reversed(self.path_cache[reverse_key]))
+
+        self.cache_misses += 1
+        if isinstance(goal, str):
+            path = self.path_to_address(start, goal)
+        else:
+            path = self.path_astar(start, goal)
+
+        self.path_cache[key] = tuple(path)
+        if len(self.path_cache) > self.path_cache_size:
+            self.path_cache.popitem(last=False)
+        return path
+
+    def distance_field(self, goal_tiles):
+        """
+        Runs a multi-source BFS from all goal tiles at once and returns the
+        number of steps it takes to reach the closest goal from every tile.
+        Each BFS layer is computed with whole-array operations.
+
+        INPUT
+          goal_tiles: An iterable of (x, y) tile coordinates.
+        OUTPUT
+          A (maze_height, maze_width) int16 array with the distances. Tiles that
+          cannot reach any of the goals are marked -1.
+        """
+        dist = np.full(self.walkable.shape, -1, dtype=np.int16)
+        frontier = np.zeros(self.walkable.shape, dtype=bool)
+        for x, y in goal_tiles:
+            if self.walkable[y, x]:
+                frontier[y, x] = True
+        dist[frontier] = 0
+
+        k = 0
+        while frontier.any():
+            k += 1
+            reached = np.zeros_like(frontier)
+            reached[1:, :] |= frontier[:-1, :]
+            reached[:-1, :] |= frontier[1:, :]
+            reached[:, 1:] |= frontier[:, :-1]
+            reached[:, :-1] |= frontier[:, 1:]
+            reached &= self.walkable
+            reached &= dist < 0
+            dist[reached] = k
+            frontier = reached
+        return dist
+
+    def _neighbors(self, tile):
+        x, y = tile
+        # Same order that path_finder_v2 uses when it traces the path back:
+        # up, left, down, right.
+        if y > 0:
+            yield (x, y - 1)
+        if x > 0:
+            yield (x - 1, y)
+        if y < self.maze_height - 1:
+            yield (x, y + 1)
+        if x < self.maze_width - 1:
+            yield (x + 1, y)
+
+    def descend(self, field, start):
+        """
+        Follows a distance field downhill from <start> until it reaches a goal
+        tile (a tile whose distance is 0).
+
+        INPUT
+          field: A distance field created by distance_field.
+          start: The (x, y) tile we are starting from.
+        OUTPUT
+          A list of (x, y) tiles starting with <start> and ending on the closest
+          goal tile. An empty list if no goal can be reached.
+        """
+        curr = tuple(start)
+        path = [curr]
+        k = int(field[curr[1], curr[0]])
+        if k < 0:
+            # The persona might be standing on a tile that is not walkable
+            # (e.g., it was spawned there). Step out of it first.
+            best = None
+            for n in self._neighbors(curr):
+                n_k = int(field[n[1], n[0]])
+                if n_k >= 0 and (best is None or n_k < best[0]):
+                    best = (n_k, n)
+            if best is None:
+                return []
+            k, curr = best
+            path += [curr]
+
+        while k > 0:
+            for n in self._neighbors(curr):
+                if field[n[1], n[0]] == k - 1:
+                    curr = n
+                    break
+            path += [curr]
+            k -= 1
+        return path
+
+    def path_to_nearest(self, start, goal_tiles):
+        """
+        Runs a single BFS from <start> that stops as soon as it reaches any of
+        the goal tiles, and returns the path to that (closest) goal.
+
+        INPUT
+          start: The (x, y) tile we are starting from.
+          goal_tiles: An iterable of (x, y) candidate target tiles.
+        OUTPUT
+          A list of (x, y) tiles starting with <start> and ending on the closest
+          goal tile. An empty list if none of the goals can be reached.
+        """
+        paths = self.paths_to_nearest(start, goal_tiles, 1)
+        if not paths:
+            return []
+        return paths[0]
+
+    def paths_to_nearest(self, start, goal_tiles, n):
+        """
+        Runs a single BFS from <start> that stops once it has reached <n> of
+        the goal tiles, and returns the paths to them, closest first.
+
+        INPUT
+          start: The (x, y) tile we are starting from.
+          goal_tiles: An iterable of (x, y) candidate target tiles.
+          n: The number of goal tiles to reach.
+        OUTPUT
+          A list of up to <n> paths (lists of (x, y) tiles starting with
+          <start>). Goals that cannot be reached are left out.
+        """
+        w = self.maze_width
+        walkable = self.walkable_flat
+        start_i = start[1] * w + start[0]
+        goals = set()
+        for x, y in goal_tiles:
+            goals.add(y * w + x)
+        if not goals or n <= 0:
+            return []
+
+        # <came_from> doubles as our visited set.
+        came_from = {start_i: None}
+        queue = deque([start_i])
+        end_is = []
+        if start_i in goals:
+            end_is += [start_i]
+        while queue and len(end_is) < n:
+            i = queue.popleft()
+            y, x = divmod(i, w)
+            for n_x, n_y in self._neighbors((x, y)):
+                j = n_y * w + n_x
+                if j in came_from or not walkable[j]:
+                    continue
+                came_from[j] = i
+                if j in goals:
+                    end_is += [j]
+                    if len(end_is) == n:
+                        break
+                queue.append(j)
+
+        paths = []
+        for end_i in end_is:
+            path = []
+            while end_i is not None:
+                y, x = divmod(end_i, w)
+                path += [(x, y)]
+                end_i = came_from[end_i]
+            path.reverse()
+            paths += [path]
+        return paths
+
+    def path_astar(self, start, end):
+        """
+        A* search from <start> to <end> over the flat walkability grid, using a
+        binary heap for the open set, an explicit closed set and the Manhattan
+        distance as the heuristic. Ties on the f score are broken in favor of
+        the tile that is further along, which keeps the search close to a
+        straight line on open ground.
+
+        INPUT
+          start: The (x, y) tile we are starting from.
+          end: The (x, y) tile we want to get to.
+        OUTPUT
+          A list of (x, y) tiles starting with <start> and ending on <end>. An
+          empty list if <end> cannot be reached.
+        """
+        w = self.maze_width
+        walkable = self.walkable_flat
+        start_i = start[1] * w + start[0]
+        end_i = end[1] * w + end[0]
+        end_x, end_y = end
+        if start_i == end_i:
+            return [tuple(start)]
+        if not walkable[end_i]:
+            return []
+
+        came_from = {start_i: None}
+        g_score = {start_i: 0}
+        closed = set()
+        h = abs(start[0] - end_x) + abs(start[1] - end_y)
+        # Heap entries are (f, -g, index).
+        heap = [(h, 0, start_i)]
+        while heap:
+            _, neg_g, i = heapq.heappop(heap)
+            if i == end_i:
+                break
+            if i in closed:
+                continue
+            closed.add(i)
+            n_g = 1 - neg_g
+            y, x = divmod(i, w)
+            for n_x, n_y in self._neighbors((x, y)):
+                n = n_y * w + n_x
+                if n in closed or not walkable[n]:
+                    continue
+                if n_g < g_score.get(n, n_g + 1):
+                    g_score[n] = n_g
+                    came_from[n] = i
+                    h = abs(n_x - end_x) + abs(n_y - end_y)
+                    heapq.heappush(heap, (n_g + h, -n_g, n))
+        else:
+            return []
+
+        path = []
+        i = end_i
+        while i is not None:
+            y, x = divmod(i, w)
+            path += [(x, y)]
+            i = came_from[i]
+        path.reverse()
+        return path
+
+    def path_to_address(self, start, address):
+        """
+        Returns the shortest path from <start> to the closest walkable tile of
+        <address>.
+
+        INPUT
+          start: The (x, y) tile we are starting from.
+          address: A string address that is in <maze.address_tiles>.
+            e.g., "the Ville:Hobbs Cafe:cafe:cafe customer seating"
+        OUTPUT
+          A list of (x, y) tiles starting with <start>. An empty list if the
+          address is unknown or cannot be reached.
+        """
+        if address not in self.address_fields:
+            return []
+        return self.descend(self.address_fields[address], start)
+
+    def paths_to_address(self, start, address, n, tile_free=None):
+        """
+        Returns paths from <start> to up to <n> tiles of <address>. The first
+        one goes to the closest tile of the address, down its distance field
+        (through the path cache). The others carry on from there to the tiles
+        of the address that are the closest to it, so that personas headed to
+        the same address can spread over it (e.g., the seats of a cafe).
+
+        INPUT
+          start: The (x, y) tile we are starting from.
+          address: A string address that is in <maze.address_tiles>.
+          n: The number of tiles of the address to return paths to.
+          tile_free: An optional function that takes a (x, y) tile and returns
+                     False if it is taken (e.g., by another persona). Taken
+                     tiles are left out, unless all of them are taken.
+        OUTPUT
+          A list of up to <n> paths (lists of (x, y) tiles starting with
+          <start>), closest first. An empty list if the address is unknown or
+          cannot be reached.
+        """
+        path = self.find_path(start, address)
+        if not path:
+            return []
+        # Only the tiles at distance 0 in the field are walkable goals; the
+        # search below would go through the whole maze looking for the others.
+        field = self.address_fields[address]
+        goal_tiles = [i for i in self.address_tiles[address] if field[i[1], i[0]] == 0]
+        if tile_free is not None:
+            goal_tiles = [i for i in goal_tiles if tile_free(i)] or goal_tiles
+        paths = self.paths_to_nearest(path[-1], goal_tiles, min(n, len(goal_tiles)))
+        if not paths:
+            return [path]
+        return [path + i[1:] for i in paths]
+
+
+def benchmark_path_finder(maze, collision_block_char, n_pairs=50, seed=0):
+    """
+    Times path_finder_v2 against A* on random pairs of walkable tiles of the
+    given collision maze (e.g., Maze("the_ville").collision_maze) and prints
+    the results. We only sample pairs that are connected to each other. Pairs
+    that v2 cannot solve within its 150 layer cap are counted as v2 failures.
+
+    INPUT
+      maze: The collision maze (a list of list of block strings).
+      collision_block_char: The block string that marks a collision.
+      n_pairs: The number of (start, end) pairs to time.
+      seed: Seed for sampling the pairs.
+    OUTPUT
+      A dictionary with the total seconds spent by each algorithm and the
+      number of pairs that v2 failed on.
+    """
+    engine = PathEngine(maze, collision_block_char)
+    walkable_tiles = [(int(i[1]), int(i[0])) for i in np.argwhere(engine.walkable)]
+    rng = random.Random(seed)
+
+    ret = {"v2": 0.0, "astar": 0.0, "astar_engine": 0.0, "v2_failures": 0}
+    for _ in range(n_pairs):
+        start = rng.choice(walkable_tiles)
+        reachable = np.argwhere(engine.distance_field([start]) > 0)
+        if len(reachable) == 0:
+            continue
+        end_y, end_x = rng.choice(reachable)
+        end = (int(end_x), int(end_y))
+
+        t = time.perf_counter()
+        v2_path = path_finder(maze, start, end, collision_block_char, algorithm="v2")
+        ret["v2"] += time.perf_counter() - t
+
+        t = time.perf_counter()
+        astar_path = path_finder(maze, start, end, collision_block_char)
+        ret["astar"] += time.perf_counter() - t
+
+        t = time.perf_counter()
+        path_finder(maze, start, end, collision_block_char, path_engine=engine)
+        ret["astar_engine"] += time.perf_counter() - t
+
+        if len(v2_path) != len(astar_path):
+            ret["v2_failures"] += 1
+
+    print(f"path_finder_v2:              {ret['v2']:.3f}s")
+    print(f"path_finder (astar):         {ret['astar']:.3f}s")
+    print(f"path_finder (astar, engine): {ret['astar_engine']:.3f}s")
+    print(f"v2 failures:                 {ret['v2_failures']} / {n_pairs}")
+    return ret
+
+
 if __name__ == "__main__":
     maze = [
         ["#", "#", "#", "#", "#", "#", "#", "#", "#", "#", "#", "#", "#"],
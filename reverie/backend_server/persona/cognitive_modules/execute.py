@@ -5,7 +5,6 @@ File: execute.py
 Description: This defines the "Act" module for generative agents.
 """
 
-import random
 import sys
 
 sys.path.append("../../")
@@ -14,6 +13,14 @@ from global_methods import *
 from path_finder import *
 from utils import *
 
+# <target_tile_sample_n> is the number of tiles of the target address that we
+# consider when picking where to go (e.g., a table may stretch many tiles). We
+# consider the tile of the address that is the closest to the persona and the
+# ones closest to it, and pick one of them at random so that personas headed to
+# the same address spread over it. Set this to None to consider every tile of
+# the address.
+target_tile_sample_n = 4
+
 
 def execute(persona, maze, personas, plan):
     """
@@ -44,6 +51,18 @@ def execute(persona, maze, personas, plan):
         # <target_tiles> is a list of tile coordinates where the persona may go
         # to execute the current action. The goal is to pick one of them.
         target_tiles = None
+        # <path> is set right away when we pick the target tile of an address.
+        path = None
+        persona_name_set = set(personas.keys())
+
+        # If possible, we want personas to occupy different tiles when they
+        # are headed to the same location on the maze. It is ok if they end
+        # up on the same time, but we try to lower that probability.
+        def tile_occupied(tile):
+            for j in maze.tile_events.get(tuple(tile), ()):
+                if j[0] in persona_name_set:
+                    return True
+            return False
 
         print("aldhfoaf/????")
         print(plan)
@@ -53,31 +72,20 @@ def execute(persona, maze, personas, plan):
             target_p_tile = personas[
                 plan.split("<persona>")[-1].strip()
             ].scratch.curr_tile
-            potential_path = path_finder(
-                maze.collision_maze,
+            potential_path = maze.path_engine.find_path(
                 persona.scratch.curr_tile,
                 target_p_tile,
-                collision_block_id,
             )
-            if len(potential_path) <= 2:
+            if not potential_path:
+                target_tiles = [persona.scratch.curr_tile]
+            elif len(potential_path) <= 2:
                 target_tiles = [potential_path[0]]
             else:
-                potential_1 = path_finder(
-                    maze.collision_maze,
-                    persona.scratch.curr_tile,
-                    potential_path[int(len(potential_path) / 2)],
-                    collision_block_id,
-                )
-                potential_2 = path_finder(
-                    maze.collision_maze,
-                    persona.scratch.curr_tile,
-                    potential_path[int(len(potential_path) / 2) + 1],
-                    collision_block_id,
-                )
-                if len(potential_1) <= len(potential_2):
-                    target_tiles = [potential_path[int(len(potential_path) / 2)]]
-                else:
-                    target_tiles = [potential_path[int(len(potential_path) / 2 + 1)]]
+                # We meet the other persona halfway. Of the two middle tiles of
+                # the path, the first is the closer one to us: the path is a
+                # shortest path, so the way to each of its tiles is the part of
+                # it that leads there.
+                target_tiles = [potential_path[int(len(potential_path) / 2)]]
 
         elif "<waiting>" in plan:
             # Executing interaction where the persona has decided to wait before
@@ -90,7 +98,7 @@ def execute(persona, maze, personas, plan):
             # Executing a random location action.
             plan = ":".join(plan.split(":")[:-1])
             target_tiles = maze.address_tiles[plan]
-            target_tiles = random.sample(list(target_tiles), 1)
+            target_tiles = persona.rng.sample(list(target_tiles), 1)
 
         # This is our default execution. We simply take the persona to the
         # location where the current action is taking place.
@@ -101,52 +109,36 @@ def execute(persona, maze, personas, plan):
             maze.address_tiles["Johnson Park:park:park garden"]  # ERRORRRRRRR
         else:
             target_tiles = maze.address_tiles[plan]
-
-        # There are sometimes more than one tile returned from this (e.g., a tabe
-        # may stretch many coordinates). So, we sample a few here. And from that
-        # random sample, we will take the closest ones.
-        if len(target_tiles) < 4:
-            target_tiles = random.sample(list(target_tiles), len(target_tiles))
-        else:
-            target_tiles = random.sample(list(target_tiles), 4)
-        # If possible, we want personas to occupy different tiles when they are
-        # headed to the same location on the maze. It is ok if they end up on the
-        # same time, but we try to lower that probability.
-        # We take care of that overlap here.
-        persona_name_set = set(personas.keys())
-        new_target_tiles = []
-        for i in target_tiles:
-            curr_event_set = maze.access_tile(i)["events"]
-            pass_curr_tile = False
-            for j in curr_event_set:
-                if j[0] in persona_name_set:
-                    pass_curr_tile = True
-            if not pass_curr_tile:
-                new_target_tiles += [i]
-        if len(new_target_tiles) == 0:
-            new_target_tiles = target_tiles
-        target_tiles = new_target_tiles
-
-        # Now that we've identified the target tile, we find the shortest path to
-        # one of the target tiles.
-        curr_tile = persona.scratch.curr_tile
-        collision_maze = maze.collision_maze
-        closest_target_tile = None
-        path = None
-        for i in target_tiles:
-            # path_finder takes a collision_mze and the curr_tile coordinate as
-            # an input, and returns a list of coordinate tuples that becomes the
-            # path.
-            # e.g., [(0, 1), (1, 1), (1, 2), (1, 3), (1, 4)...]
-            curr_path = path_finder(
-                maze.collision_maze,
-                curr_tile,
-                i,
-                collision_block_id,
+            # There are sometimes more than one tile returned from this (e.g., a
+            # tabe may stretch many coordinates). The path engine takes us down
+            # the address's distance field to its closest tile, and on to the
+            # <target_tile_sample_n> tiles closest to that one that are not
+            # occupied. We go to one of those at random.
+            sample_n = target_tile_sample_n
+            if sample_n is None:
+                sample_n = len(target_tiles)
+            candidate_paths = maze.path_engine.paths_to_address(
+                persona.scratch.curr_tile,
+                plan,
+                sample_n,
+                lambda i: not tile_occupied(i),
             )
-            if not closest_target_tile or len(curr_path) < len(path):
-                closest_target_tile = i
-                path = curr_path
+            path = []
+            if candidate_paths:
+                path = persona.rng.choice(candidate_paths)
+
+        if path is None:
+            # The other actions have a single target tile (or none, if the
+            # other persona cannot be reached). find_path returns a list of
+            # coordinate tuples that becomes the path, from the path cache that
+            # all personas share if someone walked it before.
+            # e.g., [(0, 1), (1, 1), (1, 2), (1, 3), (1, 4)...]
+            path = []
+            if target_tiles:
+                path = maze.path_engine.find_path(
+                    persona.scratch.curr_tile,
+                    target_tiles[0],
+                )
 
         # Actually setting the <planned_path> and <act_path_set>. We cut the
         # first element in the planned_path because it includes the curr_tile.
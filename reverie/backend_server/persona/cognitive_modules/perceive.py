@@ -9,6 +9,7 @@ import sys
 
 sys.path.append("../../")
 
+import heapq
 from operator import itemgetter
 
 from global_methods import *
@@ -28,6 +29,39 @@ def generate_poig_score(persona, event_type, description):
         ]
 
 
+def normalize_event(persona, event):
+    """
+    Turns an event from the maze into what perceive stores: its (s, p, o)
+    triple, its description, the text its embedding is made from, and, if the
+    event is the persona's own chat, the text of the chat's embedding.
+
+    INPUT:
+      persona: An instance of <Persona> that represents the current persona.
+      event: An (s, p, o, desc) event from the tiles of the maze.
+    OUTPUT:
+      spo: The (s, p, o) triple, with an idle event for an empty object.
+      desc: The description. e.g., "bed is idle"
+      embedding_text: The text the event is embedded as.
+      chat_text: The description of the persona's chat, or None.
+    """
+    s, p, o, desc = event
+    if not p:
+        # If the object is not present, then we default the event to "idle".
+        p = "is"
+        o = "idle"
+        desc = "idle"
+    desc = f"{s.split(':')[-1]} is {desc}"
+
+    embedding_text = desc
+    if "(" in desc:
+        embedding_text = desc.split("(")[1].split(")")[0].strip()
+
+    chat_text = None
+    if s == f"{persona.name}" and p == "chat with":
+        chat_text = persona.scratch.act_description
+    return (s, p, o), desc, embedding_text, chat_text
+
+
 def perceive(persona, maze):
     """
     Perceives events around the persona and saves it to the memory, both events
@@ -47,35 +81,16 @@ def perceive(persona, maze):
       ret_events: a list of <ConceptNode> that are perceived and new.
     """
     # PERCEIVE SPACE
-    # We get the nearby tiles given our current tile and the persona's vision
-    # radius.
-    nearby_tiles = maze.get_nearby_tiles(
+    # We store the space the persona sees, as determined by its current tile
+    # and vision radius. Note that the s_mem of the persona is in the form of a
+    # tree constructed using dictionaries. The s_mem keeps track of the tiles
+    # that it has already absorbed, so only newly visible tiles are added.
+    persona.s_mem.learn_nearby_tiles(
+        maze,
         persona.scratch.curr_tile,
         persona.scratch.vision_r,
     )
 
-    # We then store the perceived space. Note that the s_mem of the persona is
-    # in the form of a tree constructed using dictionaries.
-    for i in nearby_tiles:
-        i = maze.access_tile(i)
-        if i["world"]:
-            if i["world"] not in persona.s_mem.tree:
-                persona.s_mem.tree[i["world"]] = {}
-        if i["sector"]:
-            if i["sector"] not in persona.s_mem.tree[i["world"]]:
-                persona.s_mem.tree[i["world"]][i["sector"]] = {}
-        if i["arena"]:
-            if i["arena"] not in persona.s_mem.tree[i["world"]][i["sector"]]:
-                persona.s_mem.tree[i["world"]][i["sector"]][i["arena"]] = []
-        if i["game_object"]:
-            if (
-                i["game_object"]
-                not in persona.s_mem.tree[i["world"]][i["sector"]][i["arena"]]
-            ):
-                persona.s_mem.tree[i["world"]][i["sector"]][i["arena"]] += [
-                    i["game_object"],
-                ]
-
     # PERCEIVE EVENTS.
     # We will perceive events that take place in the same arena as the
     # persona's current arena.
@@ -86,53 +101,61 @@ def perceive(persona, maze):
     # We will order our percept based on the distance, with the closest ones
     # getting priorities.
     percept_events_list = []
-    # First, we put all events that are occuring in the nearby tiles into the
-    # percept_events_list
-    for tile in nearby_tiles:
-        tile_details = maze.access_tile(tile)
-        if tile_details["events"]:
-            if maze.get_tile_path(tile, "arena") == curr_arena_path:
-                # This calculates the distance between the persona's current tile,
-                # and the target tile.
-                dist = math.dist(
-                    [tile[0], tile[1]],
-                    [persona.scratch.curr_tile[0], persona.scratch.curr_tile[1]],
-                )
-                # Add any relevant events to our temp set/list with the distant info.
-                for event in tile_details["events"]:
-                    if event not in percept_events_set:
-                        percept_events_list += [[dist, event]]
-                        percept_events_set.add(event)
-
-    # We sort, and perceive only persona.scratch.att_bandwidth of the closest
-    # events. If the bandwidth is larger, then it means the persona can perceive
-    # more elements within a small area.
-    percept_events_list = sorted(percept_events_list, key=itemgetter(0))
+    # First, we put all events that are occuring in the nearby tiles of our
+    # arena into the percept_events_list. The maze's event index gives us only
+    # the tiles that carry events, together with their distance from the
+    # persona's current tile.
+    for dist, tile in maze.get_nearby_event_tiles(
+        persona.scratch.curr_tile,
+        persona.scratch.vision_r,
+        curr_arena_path,
+    ):
+        # Add any relevant events to our temp set/list with the distant info.
+        for event in maze.access_tile(tile)["events"]:
+            if event not in percept_events_set:
+                percept_events_list += [[dist, event]]
+                percept_events_set.add(event)
+
+    # We perceive only persona.scratch.att_bandwidth of the closest events. If
+    # the bandwidth is larger, then it means the persona can perceive more
+    # elements within a small area. heapq.nsmallest only keeps the closest
+    # att_bandwidth events around instead of sorting the whole list (ties keep
+    # their order, just like the sorting did).
     perceived_events = []
-    for dist, event in percept_events_list[: persona.scratch.att_bandwidth]:
+    for dist, event in heapq.nsmallest(
+        persona.scratch.att_bandwidth,
+        percept_events_list,
+        key=itemgetter(0),
+    ):
         perceived_events += [event]
 
+    # We embed the descriptions of all of the new events (and of the persona's
+    # own chat) that are not in the memory yet with a single request, so that
+    # the loop below finds them in the shared embedding store.
+    embedding_texts = []
+    for event in perceived_events:
+        spo, desc, embedding_text, chat_text = normalize_event(persona, event)
+        if persona.a_mem.is_latest_event(spo, persona.scratch.retention):
+            continue
+        embedding_texts += [embedding_text]
+        if chat_text is not None:
+            embedding_texts += [chat_text]
+    embedding_texts = [i for i in embedding_texts if i not in persona.a_mem.embeddings]
+    if embedding_texts:
+        get_embeddings(embedding_texts)
+
     # Storing events.
     # <ret_events> is a list of <ConceptNode> instances from the persona's
     # associative memory.
     ret_events = []
-    for p_event in perceived_events:
-        s, p, o, desc = p_event
-        if not p:
-            # If the object is not present, then we default the event to "idle".
-            p = "is"
-            o = "idle"
-            desc = "idle"
-        desc = f"{s.split(':')[-1]} is {desc}"
-        p_event = (s, p, o)
-
-        # We retrieve the latest persona.scratch.retention events. If there is
-        # something new that is happening (that is, p_event not in latest_events),
+    for event in perceived_events:
+        p_event, desc, desc_embedding_in, chat_text = normalize_event(persona, event)
+        s, p, o = p_event
+
+        # We check the latest persona.scratch.retention events. If there is
+        # something new that is happening (that is, p_event is not one of them),
         # then we add that event to the a_mem and return it.
-        latest_events = persona.a_mem.get_summarized_latest_events(
-            persona.scratch.retention,
-        )
-        if p_event not in latest_events:
+        if not persona.a_mem.is_latest_event(p_event, persona.scratch.retention):
             # We start by managing keywords.
             keywords = set()
             sub = p_event[0]
@@ -144,11 +167,6 @@ def perceive(persona, maze):
             keywords.update([sub, obj])
 
             # Get event embedding
-            desc_embedding_in = desc
-            if "(" in desc:
-                desc_embedding_in = (
-                    desc_embedding_in.split("(")[1].split(")")[0].strip()
-                )
             if desc_embedding_in in persona.a_mem.embeddings:
                 event_embedding = persona.a_mem.embeddings[desc_embedding_in]
             else:
@@ -161,27 +179,21 @@ def perceive(persona, maze):
             # If we observe the persona's self chat, we include that in the memory
             # of the persona here.
             chat_node_ids = []
-            if p_event[0] == f"{persona.name}" and p_event[1] == "chat with":
+            if chat_text is not None:
                 curr_event = persona.scratch.act_event
-                if persona.scratch.act_description in persona.a_mem.embeddings:
-                    chat_embedding = persona.a_mem.embeddings[
-                        persona.scratch.act_description
-                    ]
+                if chat_text in persona.a_mem.embeddings:
+                    chat_embedding = persona.a_mem.embeddings[chat_text]
                 else:
-                    chat_embedding = get_embedding(persona.scratch.act_description)
-                chat_embedding_pair = (persona.scratch.act_description, chat_embedding)
-                chat_poignancy = generate_poig_score(
-                    persona,
-                    "chat",
-                    persona.scratch.act_description,
-                )
+                    chat_embedding = get_embedding(chat_text)
+                chat_embedding_pair = (chat_text, chat_embedding)
+                chat_poignancy = generate_poig_score(persona, "chat", chat_text)
                 chat_node = persona.a_mem.add_chat(
                     persona.scratch.curr_time,
                     None,
                     curr_event[0],
                     curr_event[1],
                     curr_event[2],
-                    persona.scratch.act_description,
+                    chat_text,
                     keywords,
                     chat_poignancy,
                     chat_embedding_pair,
@@ -7,7 +7,6 @@ Description: This defines the "Plan" module for generative agents.
 
 import datetime
 import math
-import random
 import sys
 
 sys.path.append("../../")
@@ -769,7 +768,7 @@ def _choose_retrieved(persona, retrieved):
         if ":" not in curr_event.subject and curr_event.subject != persona.name:
             priority += [rel_ctx]
     if priority:
-        return random.choice(priority)
+        return persona.rng.choice(priority)
 
     # Skip idle.
     for event_desc, rel_ctx in retrieved.items():
@@ -777,7 +776,7 @@ def _choose_retrieved(persona, retrieved):
         if "is idle" not in event_desc:
             priority += [rel_ctx]
     if priority:
-        return random.choice(priority)
+        return persona.rng.choice(priority)
     return None
 
 
@@ -1051,6 +1050,46 @@ def _chat_react(maze, persona, focused_event, reaction_mode, personas):
         )
 
 
+def commit_chat_requests(maze, chat_requests, personas, executor=None):
+    """
+    Starts the conversations that the personas asked for during a parallel
+    step (see plan's <chat_requests>). The requests are granted in the order
+    they are given, and a persona takes part in at most one conversation per
+    step: a request is dropped if either of its personas is already in a
+    granted conversation. e.g., if Maria asks to chat with Klaus and Klaus asks
+    to chat with Maria, only Maria's request is granted (if it comes first).
+
+    INPUT
+      maze: Current <Maze> instance of the world.
+      chat_requests: A list of (persona, focused_event, reaction_mode) tuples.
+      personas: A dictionary that contains all persona names as keys, and the
+                <Persona> instance as values.
+      executor: Optional concurrent.futures executor. Granted conversations
+                never share a persona, so they can be generated concurrently.
+    OUTPUT
+      The list of granted (persona, focused_event, reaction_mode) tuples.
+    """
+    granted = []
+    engaged_names = set()
+    for persona, focused_event, reaction_mode in chat_requests:
+        target_name = reaction_mode[9:].strip()
+        if persona.name in engaged_names or target_name in engaged_names:
+            continue
+        engaged_names.update([persona.name, target_name])
+        granted += [(persona, focused_event, reaction_mode)]
+
+    def start_chat(request):
+        persona, focused_event, reaction_mode = request
+        _chat_react(maze, persona, focused_event, reaction_mode, personas)
+
+    if executor:
+        list(executor.map(start_chat, granted))
+    else:
+        for request in granted:
+            start_chat(request)
+    return granted
+
+
 def _wait_react(persona, reaction_mode):
     p = persona
 
@@ -1098,7 +1137,7 @@ def _wait_react(persona, reaction_mode):
     )
 
 
-def plan(persona, maze, personas, new_day, retrieved):
+def plan(persona, maze, personas, new_day, retrieved, chat_requests=None):
     """
     Main cognitive function of the chain. It takes the retrieved memory and
     perception, as well as the maze and the first day state to conduct both
@@ -1117,6 +1156,9 @@ def plan(persona, maze, personas, new_day, retrieved):
       retrieved: dictionary of dictionary. The first layer specifies an event,
                  while the latter layer specifies the "curr_event", "events",
                  and "thoughts" that are relevant.
+      chat_requests: If a list is given, a conversation the persona wants to
+                     start is added to it (to be started by
+                     commit_chat_requests) instead of being started here.
     OUTPUT
       The target action address of the persona (persona.scratch.act_address).
     """
@@ -1152,7 +1194,10 @@ def plan(persona, maze, personas, new_day, retrieved):
         if reaction_mode:
             # If we do want to chat, then we generate conversation
             if reaction_mode[:9] == "chat with":
-                _chat_react(maze, persona, focused_event, reaction_mode, personas)
+                if chat_requests is None:
+                    _chat_react(maze, persona, focused_event, reaction_mode, personas)
+                else:
+                    chat_requests += [(persona, focused_event, reaction_mode)]
             elif reaction_mode[:4] == "wait":
                 _wait_react(persona, reaction_mode)
             # elif reaction_mode == "do other things":
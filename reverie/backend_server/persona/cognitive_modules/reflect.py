@@ -124,6 +124,7 @@ def run_reflect(persona):
             print(xxx)
 
         thoughts = generate_insights_and_evidence(persona, nodes, 5)
+        get_embeddings(list(thoughts.keys()))
         for thought, evidence in thoughts.items():
             created = persona.scratch.curr_time
             expiration = persona.scratch.curr_time + datetime.timedelta(days=30)
@@ -9,9 +9,14 @@ import sys
 
 sys.path.append("../../")
 
+import bisect
+
+import numpy as np
 from global_methods import *
 from numpy import dot
 from numpy.linalg import norm
+from persona.memory_structures.ann_index import *
+from persona.memory_structures.associative_memory import *
 from persona.prompt_template.gpt_structure import *
 
 
@@ -113,6 +118,37 @@ def normalize_dict_floats(d, target_min, target_max):
     return d
 
 
+def normalize_floats(values, target_min, target_max):
+    """
+    Same as normalize_dict_floats, for the values of a numpy array. A 2-D array
+    is normalized column by column. Returns a new array.
+    """
+    min_val = values.min(axis=0)
+    range_val = values.max(axis=0) - min_val
+
+    # The ranges of 0 are replaced so that we do not divide by zero; those
+    # values are all set to the middle of the target range.
+    divisor = np.where(range_val == 0, 1, range_val)
+    scaled = (values - min_val) * (target_max - target_min) / divisor + target_min
+    return np.where(range_val == 0, (target_max - target_min) / 2, scaled)
+
+
+def top_highest_x_indices(values, x):
+    """
+    Same as top_highest_x_values, for the values of a 1-D numpy array: returns
+    the indices of the highest x values, from highest to lowest (equal values
+    keep their order). Only the top x are sorted.
+    """
+    if x <= 0:
+        return np.zeros(0, dtype=int)
+    if values.size > x:
+        top = np.argpartition(-values, x - 1)[:x]
+        top.sort()
+    else:
+        top = np.arange(values.size)
+    return top[np.argsort(-values[top], kind="stable")]
+
+
 def top_highest_x_values(d, x):
     """
     This function takes a dictionary 'd' and an integer 'x' as input, and
@@ -202,6 +238,76 @@ def extract_relevance(persona, nodes, focal_pt):
     return relevance_out
 
 
+class AccessOrder:
+    """
+    The order of the retrievable nodes of a memory by the time they were last
+    accessed, as new_retrieve sorts them, kept up to date while new_retrieve
+    accesses nodes without sorting all of them again. The nodes are given as
+    indices into <rows> (see new_retrieve).
+    """
+
+    def __init__(self, a_mem, rows, curr_time):
+        self.rows = rows
+        self.is_thought = a_mem.node_is_thought[rows]
+        last_accessed = a_mem.node_last_accessed[rows]
+        # Ties are broken the way a stable sort of seq_event + seq_thought
+        # would: events first, newest first.
+        self.order = np.lexsort((-rows, self.is_thought, last_accessed))
+        self.position = np.empty(rows.size, dtype=int)
+        self.position[self.order] = np.arange(rows.size)
+
+        # <tail> has the nodes that were last accessed at <curr_time>, which
+        # are at the end of the order, and <moved> has the (sorted) positions
+        # the nodes that were accessed since then were at before.
+        start = np.searchsorted(
+            last_accessed[self.order],
+            to_epoch_seconds(curr_time),
+        )
+        self.tail = set(self.order[start:].tolist())
+        self.moved = []
+
+    def access(self, indices):
+        """
+        Moves the nodes <indices> to the end of the order, as they were just
+        accessed (see AssociativeMemory.set_last_accessed).
+        """
+        for i in indices.tolist():
+            if i not in self.tail:
+                self.tail.add(i)
+                bisect.insort(self.moved, int(self.position[i]))
+
+    def sorted_tail(self):
+        """
+        Returns the nodes of the tail in their order.
+        """
+        return sorted(self.tail, key=lambda i: (self.is_thought[i], -self.rows[i]))
+
+    def positions(self, indices):
+        """
+        Returns the positions of the nodes <indices> in the order.
+        """
+        positions = self.position[indices]
+        positions = positions - np.searchsorted(self.moved, positions)
+        tail = self.sorted_tail()
+        tail_start = self.rows.size - len(tail)
+        tail_positions = {i: tail_start + count for count, i in enumerate(tail)}
+        for count, i in enumerate(indices.tolist()):
+            if i in tail_positions:
+                positions[count] = tail_positions[i]
+        return positions
+
+    def first(self, k):
+        """
+        Returns the first <k> nodes of the order.
+        """
+        first = [
+            i for i in self.order[: k + len(self.moved)].tolist() if i not in self.tail
+        ][:k]
+        if len(first) < k:
+            first += self.sorted_tail()[: k - len(first)]
+        return np.array(first, dtype=int)
+
+
 def new_retrieve(persona, focal_points, n_count=30):
     """
     Given the current persona and focal points (focal points are events or
@@ -223,61 +329,116 @@ def new_retrieve(persona, focal_points, n_count=30):
     """
     # <retrieved> is the main dictionary that we are returning
     retrieved = dict()
-    for focal_pt in focal_points:
-        # Getting all nodes from the agent's memory (both thoughts and events) and
-        # sorting them by the datetime of creation.
-        # You could also imagine getting the raw conversation, but for now.
-        nodes = [
-            [i.last_accessed, i]
-            for i in persona.a_mem.seq_event + persona.a_mem.seq_thought
-            if "idle" not in i.embedding_key
-        ]
-        nodes = sorted(nodes, key=lambda x: x[0])
-        nodes = [i for created, i in nodes]
-
-        # Calculating the component dictionaries and normalizing them.
-        recency_out = extract_recency(persona, nodes)
-        recency_out = normalize_dict_floats(recency_out, 0, 1)
-        importance_out = extract_importance(persona, nodes)
-        importance_out = normalize_dict_floats(importance_out, 0, 1)
-        relevance_out = extract_relevance(persona, nodes, focal_pt)
-        relevance_out = normalize_dict_floats(relevance_out, 0, 1)
 
-        # Computing the final scores that combines the component values.
-        # Note to self: test out different weights. [1, 1, 1] tends to work
-        # decently, but in the future, these weights should likely be learned,
-        # perhaps through an RL-like process.
-        # gw = [1, 1, 1]
-        # gw = [1, 2, 1]
-        gw = [0.5, 3, 2]
-        master_out = dict()
-        for key in recency_out.keys():
-            master_out[key] = (
-                persona.scratch.recency_w * recency_out[key] * gw[0]
-                + persona.scratch.relevance_w * relevance_out[key] * gw[1]
-                + persona.scratch.importance_w * importance_out[key] * gw[2]
+    # Getting all nodes from the agent's memory (both thoughts and events).
+    # <rows> are the nodes' rows in the associative memory's columns (see
+    # AssociativeMemory._add_node_columns), in the order of their IDs.
+    a_mem = persona.a_mem
+    n_nodes = len(a_mem.nodes)
+    rows = np.flatnonzero(a_mem.node_retrievable[:n_nodes])
+    if not focal_points:
+        return retrieved
+    if not rows.size:
+        for focal_pt in focal_points:
+            retrieved[focal_pt] = []
+        return retrieved
+
+    # Only the recency depends on the order in which the nodes were last
+    # accessed, which changes with every focal point. The importance and the
+    # relevance to all of the focal points (one column each, from a single
+    # matrix product) are calculated once, and normalized. With an approximate
+    # nearest neighbour index (see AssociativeMemory.get_ann_index), the
+    # relevance is only calculated for the candidates of each focal point.
+    importance = a_mem.node_poignancy[rows].astype(np.float64)
+    importance = normalize_floats(importance, 0, 1)
+    focal_embeddings = np.asarray(get_embeddings(focal_points), dtype=np.float32)
+    focal_embeddings /= np.linalg.norm(focal_embeddings, axis=1, keepdims=True)
+    ann_index = a_mem.get_ann_index()
+    if ann_index is None:
+        relevance = (a_mem.node_embeddings[:n_nodes] @ focal_embeddings.T)[rows]
+        relevance = normalize_floats(relevance.astype(np.float64), 0, 1)
+    else:
+        # The nodes are sorted by the time they were last accessed once, and
+        # the nodes with the highest importance scores are candidates for all
+        # of the focal points.
+        access_order = AccessOrder(a_mem, rows, persona.scratch.curr_time)
+        important = top_highest_x_indices(importance, ann_candidates)
+    # <recency> is the normalized recency score of each position in the order.
+    recency = persona.scratch.recency_decay ** np.arange(1, rows.size + 1)
+    recency = normalize_floats(recency, 0, 1)
+
+    # Note to self: test out different weights. [1, 1, 1] tends to work
+    # decently, but in the future, these weights should likely be learned,
+    # perhaps through an RL-like process.
+    # gw = [1, 1, 1]
+    # gw = [1, 2, 1]
+    gw = [0.5, 3, 2]
+
+    for count, focal_pt in enumerate(focal_points):
+        # <candidates> are the nodes (indices into <rows>, in the order of the
+        # time they were last accessed) that we compute the final scores of.
+        if ann_index is None:
+            # Sorting the nodes by the time they were last accessed. Ties are
+            # broken the way a stable sort of seq_event + seq_thought would:
+            # events first, newest first.
+            candidates = np.lexsort(
+                (
+                    -rows,
+                    a_mem.node_is_thought[rows],
+                    a_mem.node_last_accessed[rows],
+                ),
             )
-
-        master_out = top_highest_x_values(master_out, len(master_out.keys()))
-        for key, val in master_out.items():
-            print(persona.a_mem.id_to_node[key].embedding_key, val)
-            print(
-                persona.scratch.recency_w * recency_out[key] * 1,
-                persona.scratch.relevance_w * relevance_out[key] * 1,
-                persona.scratch.importance_w * importance_out[key] * 1,
+            candidate_recency = recency
+            candidate_relevance = relevance[candidates, count]
+        else:
+            # The candidates are the most relevant nodes according to the
+            # index, and the nodes with the highest recency or importance
+            # scores. Only their scores are computed.
+            ann_rows = ann_index.search(
+                a_mem.node_embeddings,
+                focal_embeddings[count],
+                ann_candidates,
             )
+            candidates = np.union1d(
+                np.searchsorted(rows, ann_rows),
+                np.union1d(access_order.first(ann_candidates), important),
+            )
+            position = access_order.positions(candidates)
+            by_position = np.argsort(position)
+            candidates = candidates[by_position]
+            candidate_recency = recency[position[by_position]]
+            candidate_relevance = (
+                a_mem.node_embeddings[rows[candidates]] @ focal_embeddings[count]
+            )
+            candidate_relevance = normalize_floats(
+                candidate_relevance.astype(np.float64),
+                0,
+                1,
+            )
+
+        # Computing the final scores that combines the component values.
+        master_out = (
+            persona.scratch.recency_w * candidate_recency * gw[0]
+            + persona.scratch.relevance_w * candidate_relevance * gw[1]
+            + persona.scratch.importance_w * importance[candidates] * gw[2]
+        )
 
         # Extracting the highest x values.
-        # <master_out> has the key of node.id and value of float. Once we get the
-        # highest x values, we want to translate the node.id into nodes and return
-        # the list of nodes.
-        master_out = top_highest_x_values(master_out, n_count)
-        master_nodes = [
-            persona.a_mem.id_to_node[key] for key in list(master_out.keys())
-        ]
-
-        for n in master_nodes:
-            n.last_accessed = persona.scratch.curr_time
+        top = top_highest_x_indices(master_out, n_count)
+        master_nodes = [a_mem.nodes[rows[candidates[i]]] for i in top]
+
+        if debug:
+            for i, node in zip(top, master_nodes):
+                print(node.embedding_key, master_out[i])
+                print(
+                    persona.scratch.recency_w * candidate_recency[i],
+                    persona.scratch.relevance_w * candidate_relevance[i],
+                    persona.scratch.importance_w * importance[candidates[i]],
+                )
+
+        a_mem.set_last_accessed(master_nodes, persona.scratch.curr_time)
+        if ann_index is not None:
+            access_order.access(candidates[top])
 
         retrieved[focal_pt] = master_nodes
 
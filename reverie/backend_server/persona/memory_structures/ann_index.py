@@ -0,0 +1,112 @@
+"""
+File: ann_index.py
+Description: An approximate nearest neighbour index for the embeddings of an
+associative memory, so that new_retrieve does not have to compute the
+relevance of every node once a persona has tens of thousands of them.
+
+<IVFIndex> is an inverted file index: the (unit length) embeddings are
+clustered with k-means, and a query only looks at the nodes of the <nprobe>
+clusters whose centroids are the most similar to it. It is pure numpy.
+
+The index is off by default. To turn it on, add to utils.py:
+  ann_index_type = "ivf"
+It is then built once a memory has <ann_min_nodes> retrievable nodes, and
+kept up to date as nodes are added. benchmark_retrieval.py compares the
+retrieval with the index to the exact one.
+"""
+
+import numpy as np
+from settings import *
+
+# <ann_index_type> is None (no index) or "ivf".
+ann_index_type = get_setting("ann_index_type", None)
+# <ann_min_nodes> is how many retrievable nodes a memory needs before it gets
+# an index, and <ann_candidates> is how many of the most relevant nodes the
+# index hands to new_retrieve for each focal point.
+ann_min_nodes = get_setting("ann_min_nodes", 5000)
+ann_candidates = get_setting("ann_candidates", 300)
+# <ann_nprobe> is how many clusters a query looks at.
+ann_nprobe = get_setting("ann_nprobe", 16)
+
+
+class IVFIndex:
+    def __init__(self, nprobe=16, n_iter=8, max_train=20000, seed=0):
+        self.nprobe = nprobe
+        self.n_iter = n_iter
+        # <max_train> is the most vectors k-means is run on; the rest are only
+        # assigned to the clusters.
+        self.max_train = max_train
+        self.seed = seed
+
+        # <centroids> has the unit length centroid of each cluster, and
+        # <lists> has the rows in each cluster (the inverted lists), as lists
+        # of ints. <trained_count> is the number of rows the index was trained
+        # with.
+        self.centroids = None
+        self.lists = []
+        self.trained_count = 0
+
+    def train(self, vectors, rows):
+        """
+        Clusters the <vectors> (unit length, one per row in <rows>) and puts
+        all of them in the index. Any rows that were in it before are dropped.
+
+        INPUT
+          vectors: A 2-D float32 array of unit length vectors.
+          rows: A 1-D int array with the row of each vector.
+        OUTPUT
+          None
+        """
+        rng = np.random.default_rng(self.seed)
+        n_lists = max(1, int(np.sqrt(len(rows))))
+        sample = vectors
+        if len(rows) > self.max_train:
+            sample = vectors[rng.choice(len(rows), self.max_train, replace=False)]
+
+        # Spherical k-means: the centroids are kept at unit length, so the
+        # closest one is the one with the highest dot product.
+        centroids = sample[rng.choice(len(sample), n_lists, replace=False)]
+        for _ in range(self.n_iter):
+            labels = np.argmax(sample @ centroids.T, axis=1)
+            sums = np.zeros((n_lists, sample.shape[1]), dtype=np.float32)
+            np.add.at(sums, labels, sample)
+            norms = np.linalg.norm(sums, axis=1, keepdims=True)
+            # A cluster that lost all of its vectors keeps its old centroid.
+            centroids = np.where(norms > 0, sums / np.maximum(norms, 1e-12), centroids)
+        self.centroids = centroids.astype(np.float32)
+
+        labels = np.argmax(vectors @ self.centroids.T, axis=1)
+        self.lists = [[] for _ in range(n_lists)]
+        for row, label in zip(rows.tolist(), labels.tolist()):
+            self.lists[label].append(row)
+        self.trained_count = len(rows)
+
+    def add(self, row, vector):
+        """
+        Puts the unit length <vector> of <row> in the closest cluster.
+        """
+        self.lists[int(np.argmax(self.centroids @ vector))].append(row)
+
+    def search(self, vectors, query, k):
+        """
+        Returns the rows of (about) the <k> vectors with the highest dot
+        product with <query>, in no particular order. Only the rows in the
+        <nprobe> closest clusters are looked at.
+
+        INPUT
+          vectors: The 2-D array that the rows index into (the memory's
+                   node_embeddings).
+          query: The unit length query vector.
+          k: The number of rows to return.
+        OUTPUT
+          A 1-D int array of rows.
+        """
+        nprobe = min(self.nprobe, self.centroids.shape[0])
+        probed = np.argpartition(-(self.centroids @ query), nprobe - 1)[:nprobe]
+        rows = np.concatenate(
+            [np.array(self.lists[label], dtype=np.int64) for label in probed],
+        )
+        if rows.size > k:
+            scores = vectors[rows] @ query
+            rows = rows[np.argpartition(-scores, k - 1)[:k]]
+        return rows
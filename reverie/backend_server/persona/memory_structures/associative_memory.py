@@ -12,22 +12,115 @@ import sys
 
 sys.path.append("../../")
 
+import copy
 import datetime
 import json
+import os
 
+import numpy as np
 from global_methods import *
+from persona.memory_structures.ann_index import *
+from persona.memory_structures.embedding_store import *
+
+# <no_time> stands for a missing time (e.g., a node that does not expire) in
+# the time columns of an associative memory.
+no_time = np.iinfo(np.int64).min
+
+
+def to_epoch_seconds(dt):
+    """
+    Returns the datetime <dt> as whole seconds since 1970-01-01 (without
+    converting between time zones), so that times can be kept in int arrays.
+    None becomes <no_time>.
+    """
+    if dt is None:
+        return no_time
+    return int((dt - datetime.datetime(1970, 1, 1)).total_seconds())
+
+
+def from_epoch_seconds(seconds):
+    """
+    The reverse of to_epoch_seconds.
+    """
+    if seconds == no_time:
+        return None
+    return datetime.datetime(1970, 1, 1) + datetime.timedelta(seconds=int(seconds))
+
+
+class SymbolTable:
+    """
+    Interns the strs of the nodes of a memory that repeat: their types, their
+    subjects, predicates and objects, and their keywords. The nodes that have
+    the same ones (e.g., all the "is idle" events of a bed) share a single
+    str instead of holding a copy each. Each memory has its own table, which
+    goes away with it.
+
+    Keywords are kept as int IDs: a node holds the (interned) tuple of the IDs
+    of its keywords instead of a set of strs.
+    """
+
+    def __init__(self):
+        self.symbols = dict()
+        # <keyword_ids> maps each keyword to its ID, which is its index in
+        # <keywords>.
+        self.keyword_ids = dict()
+        self.keywords = []
+
+    def intern(self, value):
+        if value is None:
+            return None
+        return self.symbols.setdefault(value, value)
+
+    def intern_keywords(self, keywords):
+        """
+        Returns the interned tuple of the IDs of the <keywords> (a set of strs).
+        """
+        ids = []
+        for keyword in keywords:
+            if keyword not in self.keyword_ids:
+                # The keyword is added before its ID, so that a snapshot that
+                # is read from another thread never sees an ID without it.
+                self.keywords.append(keyword)
+                self.keyword_ids[keyword] = len(self.keywords) - 1
+            ids.append(self.keyword_ids[keyword])
+        return self.intern(tuple(sorted(ids)))
+
+    def get_keywords(self, ids):
+        """
+        Returns the set of the keywords whose IDs are <ids>.
+        """
+        return {self.keywords[i] for i in ids}
 
 
 class ConceptNode:
+    # A memory can hold hundreds of thousands of nodes, so they are slotted
+    # and their type, (s, p, o) and keywords are interned (see SymbolTable).
+    # Their times are kept in the time columns of their <memory> (see
+    # AssociativeMemory._add_node_columns), and <node_id> is derived from the
+    # int <node_count>.
+    __slots__ = (
+        "depth",
+        "description",
+        "embedding_key",
+        "filling",
+        "keyword_ids",
+        "memory",
+        "node_count",
+        "object",
+        "poignancy",
+        "predicate",
+        "subject",
+        "type",
+        "type_count",
+    )
+
     def __init__(
         self,
-        node_id,
+        memory,
         node_count,
         type_count,
         node_type,
         depth,
-        created,
-        expiration,
         s,
         p,
         o,
@@ -37,37 +130,221 @@ class ConceptNode:
         keywords,
         filling,
     ):
-        self.node_id = node_id
+        self.memory = memory
         self.node_count = node_count
         self.type_count = type_count
-        self.type = node_type  # thought / event / chat
+        self.type = memory.symbols.intern(node_type)  # thought / event / chat
         self.depth = depth
 
-        self.created = created
-        self.expiration = expiration
-        self.last_accessed = self.created
-
-        self.subject = s
-        self.predicate = p
-        self.object = o
+        self.subject = memory.symbols.intern(s)
+        self.predicate = memory.symbols.intern(p)
+        self.object = memory.symbols.intern(o)
 
         self.description = description
         self.embedding_key = embedding_key
         self.poignancy = poignancy
-        self.keywords = keywords
+        self.keyword_ids = memory.symbols.intern_keywords(keywords)
         self.filling = filling
 
+    @property
+    def node_id(self):
+        return f"node_{self.node_count!s}"
+
+    @property
+    def keywords(self):
+        return self.memory.symbols.get_keywords(self.keyword_ids)
+
+    @property
+    def created(self):
+        return from_epoch_seconds(self.memory.node_created[self.node_count - 1])
+
+    @property
+    def expiration(self):
+        return from_epoch_seconds(self.memory.node_expiration[self.node_count - 1])
+
+    @property
+    def last_accessed(self):
+        return from_epoch_seconds(self.memory.node_last_accessed[self.node_count - 1])
+
+    @last_accessed.setter
+    def last_accessed(self, last_accessed):
+        self.memory.set_last_accessed([self], last_accessed)
+
     def spo_summary(self):
         return (self.subject, self.predicate, self.object)
 
 
+def node_row(node_id):
+    """
+    Returns the row of the node with the ID <node_id> (e.g., 0 for "node_1"),
+    or None if <node_id> is not a node ID.
+    """
+    if isinstance(node_id, str) and node_id.startswith("node_"):
+        try:
+            row = int(node_id[5:]) - 1
+        except ValueError:
+            return None
+        if row >= 0:
+            return row
+    return None
+
+
+class NodeIdMap:
+    """
+    A read only dict from the node IDs (e.g., "node_1") to the nodes of a
+    memory, which are kept in a list by their row. No str keys are stored.
+    """
+
+    def __init__(self, nodes):
+        self.nodes = nodes
+
+    def __getitem__(self, node_id):
+        row = node_row(node_id)
+        if row is None or row >= len(self.nodes):
+            raise KeyError(node_id)
+        return self.nodes[row]
+
+    def __contains__(self, node_id):
+        row = node_row(node_id)
+        return row is not None and row < len(self.nodes)
+
+    def __len__(self):
+        return len(self.nodes)
+
+    def __iter__(self):
+        return self.keys()
+
+    def get(self, node_id, default=None):
+        if node_id in self:
+            return self[node_id]
+        return default
+
+    def keys(self):
+        return (node.node_id for node in self.nodes)
+
+    def values(self):
+        return iter(self.nodes)
+
+    def items(self):
+        return ((node.node_id, node) for node in self.nodes)
+
+
+class NodeSequence:
+    """
+    A sequence of nodes that reads newest first (e.g., seq[0] is the latest
+    node and seq[:retention] are the <retention> latest ones), but is stored
+    oldest first, so that adding a node is an append instead of an insert at
+    the front of a list.
+    """
+
+    def __init__(self, nodes=None):
+        # <nodes> is the list of nodes, oldest first.
+        self.nodes = list(nodes) if nodes else []
+
+    def append(self, node):
+        """
+        Adds <node> as the newest node of the sequence.
+        """
+        self.nodes.append(node)
+
+    def up_to(self, node_count):
+        """
+        Returns a new NodeSequence with the nodes of this one that were among
+        the first <node_count> nodes of their memory.
+        """
+        end = len(self.nodes)
+        while end and self.nodes[end - 1].node_count > node_count:
+            end -= 1
+        return NodeSequence(self.nodes[:end])
+
+    def __len__(self):
+        return len(self.nodes)
+
+    def __iter__(self):
+        return reversed(self.nodes)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            # Only the nodes in the slice are read, e.g., seq[:retention] does
+            # not depend on the length of the sequence.
+            last = len(self.nodes) - 1
+            return [self.nodes[last - i] for i in range(len(self.nodes))[index]]
+        if index < 0:
+            index += len(self.nodes)
+        if not 0 <= index < len(self.nodes):
+            raise IndexError("NodeSequence index out of range")
+        return self.nodes[len(self.nodes) - 1 - index]
+
+    def __add__(self, other):
+        return list(self) + list(other)
+
+    def __radd__(self, other):
+        return list(other) + list(self)
+
+    def __eq__(self, other):
+        if isinstance(other, (list, NodeSequence)):
+            return list(self) == list(other)
+        return NotImplemented
+
+    # A NodeSequence changes as nodes are added, so it is not hashable.
+    __hash__ = None
+
+    def __repr__(self):
+        return f"NodeSequence({list(self)!r})"
+
+
+class FrozenKeywords:
+    """
+    A read only view of a keyword dict of a memory (e.g., kw_to_event) as it
+    was when the memory had <node_count> nodes. See AssociativeMemory.snapshot.
+    """
+
+    def __init__(self, kw_to_nodes, node_count):
+        self.kw_to_nodes = dict(kw_to_nodes)
+        self.node_count = node_count
+
+    def __getitem__(self, keyword):
+        return self.kw_to_nodes[keyword].up_to(self.node_count)
+
+    def __contains__(self, keyword):
+        return keyword in self.kw_to_nodes
+
+    def __len__(self):
+        return len(self.kw_to_nodes)
+
+    def __iter__(self):
+        return iter(self.kw_to_nodes)
+
+    def get(self, keyword, default=None):
+        if keyword in self.kw_to_nodes:
+            return self[keyword]
+        return default
+
+    def keys(self):
+        return self.kw_to_nodes.keys()
+
+    def values(self):
+        return (self[keyword] for keyword in self.kw_to_nodes)
+
+    def items(self):
+        return ((keyword, self[keyword]) for keyword in self.kw_to_nodes)
+
+
 class AssociativeMemory:
     def __init__(self, f_saved):
-        self.id_to_node = dict()
+        # <symbols> interns the types, the (s, p, o) and the keywords of the
+        # nodes (see SymbolTable).
+        self.symbols = SymbolTable()
+
+        # <nodes> has the nodes in the order of their IDs, and <id_to_node>
+        # looks them up by ID.
+        self.nodes = []
+        self.id_to_node = NodeIdMap(self.nodes)
 
-        self.seq_event = []
-        self.seq_thought = []
-        self.seq_chat = []
+        # The node sequences (and the keyword lists below) are newest first.
+        self.seq_event = NodeSequence()
+        self.seq_thought = NodeSequence()
+        self.seq_chat = NodeSequence()
 
         self.kw_to_event = dict()
         self.kw_to_thought = dict()
@@ -76,17 +353,87 @@ class AssociativeMemory:
         self.kw_strength_event = dict()
         self.kw_strength_thought = dict()
 
-        self.embeddings = json.load(open(f_saved + "/embeddings.json"))
-
-        nodes_load = json.load(open(f_saved + "/nodes.json"))
-        for count in range(len(nodes_load.keys())):
-            node_id = f"node_{count + 1!s}"
-            node_details = nodes_load[node_id]
-
-            node_count = node_details["node_count"]
-            type_count = node_details["type_count"]
+        # <latest_event_spos> counts the (subject, predicate, object) triples of
+        # the <latest_event_window> latest events, so that perceive can check
+        # whether an event is new without going through them (see
+        # is_latest_event). It is kept up to date by add_event once a window is
+        # set.
+        self.latest_event_window = None
+        self.latest_event_spos = dict()
+
+        # Columns of the nodes, e.g., for the vectorized retrieval. Row i
+        # belongs to node_{i+1}; only the first len(self.nodes) rows are in use
+        # (the arrays grow by doubling).
+        # <node_embeddings> has the embeddings normalized to unit length, so
+        # that a dot product is the cosine similarity.
+        # <node_created>, <node_expiration> and <node_last_accessed> are the
+        # times of the nodes in seconds (see to_epoch_seconds).
+        # <node_retrievable> is True for the events and thoughts that are not
+        # idle, which are the nodes new_retrieve looks at.
+        self.node_embeddings = np.zeros((0, 0), dtype=np.float32)
+        self.node_poignancy = np.zeros(0, dtype=np.float32)
+        self.node_created = np.zeros(0, dtype=np.int64)
+        self.node_expiration = np.zeros(0, dtype=np.int64)
+        self.node_last_accessed = np.zeros(0, dtype=np.int64)
+        self.node_is_thought = np.zeros(0, dtype=bool)
+        self.node_retrievable = np.zeros(0, dtype=bool)
+        # <ann_index> is the approximate nearest neighbour index of the
+        # retrievable nodes (see get_ann_index), or None.
+        self.ann_index = None
+
+        # <embeddings> maps the embedding keys of the nodes to their embeddings,
+        # which are kept in the embedding store that all personas share.
+        self.embeddings = EmbeddingRefs(get_embedding_store())
+
+        # <saved_folder> is the folder whose nodes.jsonl has the first
+        # <saved_count> nodes (in its first <saved_offset> bytes), so that save
+        # only has to append the nodes that were added since.
+        self.saved_folder = None
+        self.saved_count = 0
+        self.saved_offset = 0
+
+        if check_if_file_exists(f_saved + "/nodes.jsonl"):
+            nodes_load = []
+            with open(f_saved + "/nodes.jsonl", "rb") as log_file:
+                for line in log_file:
+                    # A save that was interrupted can leave a partial last
+                    # line, which the next save overwrites.
+                    if not line.endswith(b"\n"):
+                        break
+                    nodes_load += [json.loads(line)]
+                    self.saved_offset += len(line)
+            # A memory that was exported (see migrate_associative_memory.py)
+            # brings its embeddings along, for a machine without the store.
+            if check_if_file_exists(f_saved + "/embeddings.json"):
+                for key, embedding in json.load(
+                    open(f_saved + "/embeddings.json"),
+                ).items():
+                    self.embeddings.store.add(key, embedding)
+            self.embeddings.load_texts(
+                [i["embedding_key"] for i in nodes_load],
+                f_saved + "/nodes.jsonl",
+            )
+            self.saved_folder = os.path.realpath(f_saved)
+            self.saved_count = len(nodes_load)
+        else:
+            # Memories that were saved before nodes.jsonl have a nodes.json,
+            # and their embeddings in embedding_ids.json or (before the
+            # embedding store) embeddings.json, which we move to the store.
+            # The next save writes them in the new format.
+            if check_if_file_exists(f_saved + "/embedding_ids.json"):
+                self.embeddings.load(f_saved + "/embedding_ids.json")
+            else:
+                for key, embedding in json.load(
+                    open(f_saved + "/embeddings.json"),
+                ).items():
+                    self.embeddings[key] = embedding
+            nodes_json = json.load(open(f_saved + "/nodes.json"))
+            nodes_load = [
+                nodes_json[f"node_{count + 1!s}"] for count in range(len(nodes_json))
+            ]
+
+        for node_details in nodes_load:
             node_type = node_details["type"]
-            depth = node_details["depth"]
 
             created = datetime.datetime.strptime(
                 node_details["created"],
@@ -158,35 +505,86 @@ class AssociativeMemory:
         if kw_strength_load["kw_strength_thought"]:
             self.kw_strength_thought = kw_strength_load["kw_strength_thought"]
 
+    def snapshot(self):
+        """
+        Returns a read only copy of the memory as it is right now, which does
+        not change when nodes are added to the memory afterwards. The nodes
+        themselves are shared, and the keyword lists are only cut down to the
+        current nodes when they are read.
+
+        INPUT:
+          None
+        OUTPUT:
+          A shallow copy of the <AssociativeMemory> instance.
+        """
+        node_count = len(self.nodes)
+        memory_snapshot = copy.copy(self)
+        memory_snapshot.nodes = list(self.nodes)
+        memory_snapshot.id_to_node = NodeIdMap(memory_snapshot.nodes)
+        memory_snapshot.seq_event = NodeSequence(self.seq_event.nodes)
+        memory_snapshot.seq_thought = NodeSequence(self.seq_thought.nodes)
+        memory_snapshot.seq_chat = NodeSequence(self.seq_chat.nodes)
+        memory_snapshot.kw_to_event = FrozenKeywords(self.kw_to_event, node_count)
+        memory_snapshot.kw_to_thought = FrozenKeywords(self.kw_to_thought, node_count)
+        memory_snapshot.kw_to_chat = FrozenKeywords(self.kw_to_chat, node_count)
+        memory_snapshot.kw_strength_event = dict(self.kw_strength_event)
+        memory_snapshot.kw_strength_thought = dict(self.kw_strength_thought)
+        memory_snapshot.latest_event_spos = dict(self.latest_event_spos)
+        return memory_snapshot
+
     def save(self, out_json):
-        r = dict()
-        for count in range(len(self.id_to_node.keys()), 0, -1):
-            node_id = f"node_{count!s}"
-            node = self.id_to_node[node_id]
-
-            r[node_id] = dict()
-            r[node_id]["node_count"] = node.node_count
-            r[node_id]["type_count"] = node.type_count
-            r[node_id]["type"] = node.type
-            r[node_id]["depth"] = node.depth
-
-            r[node_id]["created"] = node.created.strftime("%Y-%m-%d %H:%M:%S")
-            r[node_id]["expiration"] = None
-            if node.expiration:
-                r[node_id]["expiration"] = node.expiration.strftime("%Y-%m-%d %H:%M:%S")
-
-            r[node_id]["subject"] = node.subject
-            r[node_id]["predicate"] = node.predicate
-            r[node_id]["object"] = node.object
-
-            r[node_id]["description"] = node.description
-            r[node_id]["embedding_key"] = node.embedding_key
-            r[node_id]["poignancy"] = node.poignancy
-            r[node_id]["keywords"] = list(node.keywords)
-            r[node_id]["filling"] = node.filling
-
-        with open(out_json + "/nodes.json", "w") as outfile:
-            json.dump(r, outfile)
+        """
+        Saves the memory to the folder <out_json>. The nodes are saved in
+        nodes.jsonl, one json line per node in the order of their IDs. Nodes
+        do not change once they are added, so if the memory was loaded from
+        (or last saved to) the same folder, only the nodes that were added
+        since are appended. Their embeddings are in the embedding store.
+        """
+        # The embeddings are flushed first, so that nodes.jsonl never refers
+        # to embeddings that are not in the store.
+        self.embeddings.store.flush()
+
+        f_nodes = out_json + "/nodes.jsonl"
+        start = 0
+        offset = 0
+        if (
+            os.path.realpath(out_json) == self.saved_folder
+            and os.path.exists(f_nodes)
+            and os.path.getsize(f_nodes) >= self.saved_offset
+        ):
+            start = self.saved_count
+            offset = self.saved_offset
+
+        with open(f_nodes, "r+b" if offset else "wb") as log_file:
+            log_file.seek(offset)
+            log_file.truncate()
+            for node in self.nodes[start:]:
+                node_details = dict()
+                node_details["node_count"] = node.node_count
+                node_details["type_count"] = node.type_count
+                node_details["type"] = node.type
+                node_details["depth"] = node.depth
+
+                node_details["created"] = node.created.strftime("%Y-%m-%d %H:%M:%S")
+                node_details["expiration"] = None
+                if node.expiration:
+                    node_details["expiration"] = node.expiration.strftime(
+                        "%Y-%m-%d %H:%M:%S",
+                    )
+
+                node_details["subject"] = node.subject
+                node_details["predicate"] = node.predicate
+                node_details["object"] = node.object
+
+                node_details["description"] = node.description
+                node_details["embedding_key"] = node.embedding_key
+                node_details["poignancy"] = node.poignancy
+                node_details["keywords"] = list(node.keywords)
+                node_details["filling"] = node.filling
+                log_file.write((json.dumps(node_details) + "\n").encode())
+            self.saved_offset = log_file.tell()
+        self.saved_folder = os.path.realpath(out_json)
+        self.saved_count = len(self.nodes)
 
         r = dict()
         r["kw_strength_event"] = self.kw_strength_event
@@ -194,8 +592,12 @@ class AssociativeMemory:
         with open(out_json + "/kw_strength.json", "w") as outfile:
             json.dump(r, outfile)
 
-        with open(out_json + "/embeddings.json", "w") as outfile:
-            json.dump(self.embeddings, outfile)
+        # A memory that was forked from one saved in the older formats (or
+        # from an exported one) still has their files, which nodes.jsonl and
+        # the embedding store replace.
+        for f_old in ["nodes.json", "embedding_ids.json", "embeddings.json"]:
+            if os.path.exists(out_json + "/" + f_old):
+                os.remove(out_json + "/" + f_old)
 
     def add_event(
         self,
@@ -211,10 +613,9 @@ class AssociativeMemory:
         filling,
     ):
         # Setting up the node ID and counts.
-        node_count = len(self.id_to_node.keys()) + 1
+        node_count = len(self.nodes) + 1
         type_count = len(self.seq_event) + 1
         node_type = "event"
-        node_id = f"node_{node_count!s}"
         depth = 0
 
         # Node type specific clean up.
@@ -227,13 +628,11 @@ class AssociativeMemory:
 
         # Creating the <ConceptNode> object.
         node = ConceptNode(
-            node_id,
+            self,
             node_count,
             type_count,
             node_type,
             depth,
-            created,
-            expiration,
             s,
             p,
             o,
@@ -245,14 +644,18 @@ class AssociativeMemory:
         )
 
         # Creating various dictionary cache for fast access.
-        self.seq_event[0:0] = [node]
+        self.seq_event.append(node)
+        if self.latest_event_window is not None:
+            self._add_latest_event_spo(node.spo_summary(), 1)
+            if len(self.seq_event) > self.latest_event_window:
+                dropped = self.seq_event[self.latest_event_window]
+                self._add_latest_event_spo(dropped.spo_summary(), -1)
         keywords = [i.lower() for i in keywords]
         for kw in keywords:
-            if kw in self.kw_to_event:
-                self.kw_to_event[kw][0:0] = [node]
-            else:
-                self.kw_to_event[kw] = [node]
-        self.id_to_node[node_id] = node
+            if kw not in self.kw_to_event:
+                self.kw_to_event[kw] = NodeSequence()
+            self.kw_to_event[kw].append(node)
+        self.nodes.append(node)
 
         # Adding in the kw_strength
         if f"{p} {o}" != "is idle":
@@ -263,6 +666,7 @@ class AssociativeMemory:
                     self.kw_strength_event[kw] = 1
 
         self.embeddings[embedding_pair[0]] = embedding_pair[1]
+        self._add_node_columns(node, created, expiration, embedding_pair[1])
 
         return node
 
@@ -280,10 +684,9 @@ class AssociativeMemory:
         filling,
     ):
         # Setting up the node ID and counts.
-        node_count = len(self.id_to_node.keys()) + 1
+        node_count = len(self.nodes) + 1
         type_count = len(self.seq_thought) + 1
         node_type = "thought"
-        node_id = f"node_{node_count!s}"
         depth = 1
         try:
             if filling:
@@ -293,13 +696,11 @@ class AssociativeMemory:
 
         # Creating the <ConceptNode> object.
         node = ConceptNode(
-            node_id,
+            self,
             node_count,
             type_count,
             node_type,
             depth,
-            created,
-            expiration,
             s,
             p,
             o,
@@ -311,14 +712,13 @@ class AssociativeMemory:
         )
 
         # Creating various dictionary cache for fast access.
-        self.seq_thought[0:0] = [node]
+        self.seq_thought.append(node)
         keywords = [i.lower() for i in keywords]
         for kw in keywords:
-            if kw in self.kw_to_thought:
-                self.kw_to_thought[kw][0:0] = [node]
-            else:
-                self.kw_to_thought[kw] = [node]
-        self.id_to_node[node_id] = node
+            if kw not in self.kw_to_thought:
+                self.kw_to_thought[kw] = NodeSequence()
+            self.kw_to_thought[kw].append(node)
+        self.nodes.append(node)
 
         # Adding in the kw_strength
         if f"{p} {o}" != "is idle":
@@ -329,6 +729,7 @@ class AssociativeMemory:
                     self.kw_strength_thought[kw] = 1
 
         self.embeddings[embedding_pair[0]] = embedding_pair[1]
+        self._add_node_columns(node, created, expiration, embedding_pair[1])
 
         return node
 
@@ -346,21 +747,18 @@ class AssociativeMemory:
         filling,
     ):
         # Setting up the node ID and counts.
-        node_count = len(self.id_to_node.keys()) + 1
+        node_count = len(self.nodes) + 1
         type_count = len(self.seq_chat) + 1
         node_type = "chat"
-        node_id = f"node_{node_count!s}"
         depth = 0
 
         # Creating the <ConceptNode> object.
         node = ConceptNode(
-            node_id,
+            self,
             node_count,
             type_count,
             node_type,
             depth,
-            created,
-            expiration,
             s,
             p,
             o,
@@ -372,19 +770,106 @@ class AssociativeMemory:
         )
 
         # Creating various dictionary cache for fast access.
-        self.seq_chat[0:0] = [node]
+        self.seq_chat.append(node)
         keywords = [i.lower() for i in keywords]
         for kw in keywords:
-            if kw in self.kw_to_chat:
-                self.kw_to_chat[kw][0:0] = [node]
-            else:
-                self.kw_to_chat[kw] = [node]
-        self.id_to_node[node_id] = node
+            if kw not in self.kw_to_chat:
+                self.kw_to_chat[kw] = NodeSequence()
+            self.kw_to_chat[kw].append(node)
+        self.nodes.append(node)
 
         self.embeddings[embedding_pair[0]] = embedding_pair[1]
+        self._add_node_columns(node, created, expiration, embedding_pair[1])
 
         return node
 
+    def _add_node_columns(self, node, created, expiration, embedding):
+        row = node.node_count - 1
+        embedding = np.asarray(embedding, dtype=np.float32)
+        if row >= self.node_poignancy.shape[0]:
+            capacity = max(2 * self.node_poignancy.shape[0], 256)
+            node_embeddings = np.zeros(
+                (capacity, embedding.shape[0]),
+                dtype=np.float32,
+            )
+            if row:
+                node_embeddings[:row] = self.node_embeddings[:row]
+            self.node_embeddings = node_embeddings
+            for name in [
+                "node_poignancy",
+                "node_created",
+                "node_expiration",
+                "node_last_accessed",
+                "node_is_thought",
+                "node_retrievable",
+            ]:
+                column = getattr(self, name)
+                new_column = np.zeros(capacity, dtype=column.dtype)
+                new_column[:row] = column[:row]
+                setattr(self, name, new_column)
+
+        embedding_norm = np.linalg.norm(embedding)
+        if embedding_norm:
+            embedding = embedding / embedding_norm
+        self.node_embeddings[row] = embedding
+        self.node_poignancy[row] = node.poignancy
+        self.node_created[row] = to_epoch_seconds(created)
+        self.node_expiration[row] = to_epoch_seconds(expiration)
+        self.node_last_accessed[row] = self.node_created[row]
+        self.node_is_thought[row] = node.type == "thought"
+        self.node_retrievable[row] = (
+            node.type in ["event", "thought"] and "idle" not in node.embedding_key
+        )
+        if self.ann_index is not None and self.node_retrievable[row]:
+            self.ann_index.add(row, self.node_embeddings[row])
+
+    def get_ann_index(self):
+        """
+        Returns the approximate nearest neighbour index of the retrievable
+        nodes, or None if the memory does not use one (see ann_index.py). The
+        index is built once there are <ann_min_nodes> retrievable nodes, and
+        built again whenever their number has grown four times since.
+        """
+        if ann_index_type is None:
+            return None
+        if ann_index_type != "ivf":
+            raise ValueError(f"Unknown ann_index_type: {ann_index_type}")
+
+        rows = np.flatnonzero(self.node_retrievable[: len(self.nodes)])
+        if rows.size < ann_min_nodes:
+            return None
+        if self.ann_index is None:
+            self.ann_index = IVFIndex(ann_nprobe)
+        if rows.size >= 4 * self.ann_index.trained_count:
+            self.ann_index.train(self.node_embeddings[rows], rows)
+        return self.ann_index
+
+    def set_last_accessed(self, nodes, curr_time):
+        """
+        Sets the last accessed time of the <nodes> to <curr_time>.
+        """
+        curr_time = to_epoch_seconds(curr_time)
+        for node in nodes:
+            self.node_last_accessed[node.node_count - 1] = curr_time
+
+    def _add_latest_event_spo(self, spo, count):
+        self.latest_event_spos[spo] = self.latest_event_spos.get(spo, 0) + count
+        if not self.latest_event_spos[spo]:
+            del self.latest_event_spos[spo]
+
+    def is_latest_event(self, spo, retention):
+        """
+        Returns True if one of the <retention> latest events has the
+        (subject, predicate, object) triple <spo>; the same as
+        spo in get_summarized_latest_events(retention), without building the set.
+        """
+        if retention != self.latest_event_window:
+            self.latest_event_window = retention
+            self.latest_event_spos = dict()
+            for e_node in self.seq_event[:retention]:
+                self._add_latest_event_spo(e_node.spo_summary(), 1)
+        return spo in self.latest_event_spos
+
     def get_summarized_latest_events(self, retention):
         ret_set = set()
         for e_node in self.seq_event[:retention]:
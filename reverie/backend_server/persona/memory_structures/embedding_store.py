@@ -0,0 +1,283 @@
+"""
+File: embedding_store.py
+Description: A content-addressed store of embeddings that all the personas
+(and all the simulations on the machine) share. Strings like "bed is idle"
+are perceived by every persona of every simulation, and used to be saved as
+1536 floats of JSON in each persona's embeddings.json, in every fork.
+
+Each string is stored once, under its ID (the sha256 of the string). There
+is one store per embedding model (a subfolder named after the model), so
+switching <llm_embedding_model> never mixes the embeddings of two models. A
+store is a folder with:
+  vectors.f32: The embeddings, one row of float32 values per string. It is
+               memory-mapped, so only the rows that are used are read.
+  index.jsonl: One [ID, string] line per row of vectors.f32.
+  meta.json: The dimension of the embeddings.
+Both files are only ever appended to, so several simulations can share a
+store (flush takes a file lock while it appends).
+
+A persona's associative memory keeps an <EmbeddingRefs>, which maps its
+strings to their IDs in the store. The IDs are not saved: they are the sha256
+of the embedding keys of the saved nodes. migrate_associative_memory.py moves
+the embeddings.json (or embedding_ids.json) of existing simulations into the
+store, and can export them to embeddings.json again so that a simulation can
+be loaded on a machine that does not have the store.
+"""
+
+import hashlib
+import json
+import os
+import re
+import threading
+
+import numpy as np
+from settings import *
+from utils import *
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# <embedding_store_path> is the folder of the stores (None means a folder named
+# embedding_store next to fs_storage, so that forks share it).
+embedding_store_path = get_setting("embedding_store_path", None)
+# <llm_embedding_model> is the model the embeddings are made with. Each model
+# has its own store.
+llm_embedding_model = get_setting("llm_embedding_model", "text-embedding-ada-002")
+
+
+def embedding_id(text):
+    """
+    Returns the ID of <text> in the store: the sha256 hex digest of the str.
+    e.g., embedding_id("bed is idle") -> "9b1f04..."
+    """
+    return hashlib.sha256(text.encode()).hexdigest()
+
+
+class EmbeddingStore:
+    def __init__(self, folder):
+        self.folder = folder
+        self.f_vectors = f"{folder}/vectors.f32"
+        self.f_index = f"{folder}/index.jsonl"
+        self.f_meta = f"{folder}/meta.json"
+        os.makedirs(folder, exist_ok=True)
+
+        # <dim> is the dimension of the embeddings (None until the first one).
+        self.dim = None
+        if os.path.exists(self.f_meta):
+            with open(self.f_meta) as json_file:
+                self.dim = json.load(json_file)["dim"]
+
+        # <id_to_row> maps the ID of each string on disk to its row in
+        # <vectors>, and <pending> has the embeddings that were added since
+        # the last flush (by ID, as (text, float32 array) pairs).
+        self.id_to_row = dict()
+        self.n_rows = 0
+        # <index_offset> is how far (in bytes) we have read index.jsonl.
+        self.index_offset = 0
+        self.vectors = None
+        self.pending = dict()
+        self.lock = threading.Lock()
+        self._load_index()
+
+    def _load_index(self):
+        """
+        Reads the rows of index.jsonl that we do not know of yet (e.g., the
+        ones that another simulation appended), and maps vectors.f32 again.
+        """
+        if not os.path.exists(self.f_index):
+            return
+        with open(self.f_index, "rb") as index_file:
+            index_file.seek(self.index_offset)
+            for line in index_file:
+                if not line.endswith(b"\n"):
+                    # The line is still being written by someone else.
+                    break
+                self.id_to_row.setdefault(json.loads(line)[0], self.n_rows)
+                self.n_rows += 1
+                self.index_offset += len(line)
+        if self.n_rows:
+            self.vectors = np.memmap(
+                self.f_vectors,
+                dtype=np.float32,
+                mode="r",
+                shape=(self.n_rows, self.dim),
+            )
+
+    def __len__(self):
+        return len(self.id_to_row) + len(self.pending)
+
+    def __contains__(self, text):
+        return self.has_id(embedding_id(text))
+
+    def has_id(self, emb_id):
+        with self.lock:
+            return emb_id in self.id_to_row or emb_id in self.pending
+
+    def add(self, text, embedding):
+        """
+        Adds the embedding of <text> to the store (if it is not there yet) and
+        returns its ID.
+
+        INPUT
+          text: The embedded str.
+          embedding: The embedding, a list of floats or an array.
+        OUTPUT
+          The str ID of the text.
+        """
+        emb_id = embedding_id(text)
+        if self.has_id(emb_id):
+            return emb_id
+        embedding = np.asarray(embedding, dtype=np.float32)
+        with self.lock:
+            if self.dim is None:
+                self.dim = embedding.shape[0]
+            if embedding.shape[0] != self.dim:
+                raise ValueError(
+                    f"Embedding of {text!r} has dimension {embedding.shape[0]}, "
+                    f"but the store at {self.folder} has dimension {self.dim}",
+                )
+            self.pending.setdefault(emb_id, (text, embedding))
+        return emb_id
+
+    def get(self, emb_id):
+        """
+        Returns the embedding with the ID <emb_id> as a float32 array. The
+        array is read-only (it may be a row of the memory-mapped file).
+        """
+        with self.lock:
+            if emb_id in self.pending:
+                return self.pending[emb_id][1]
+            return self.vectors[self.id_to_row[emb_id]]
+
+    def get_vector(self, text):
+        """
+        Returns the embedding of <text> as a float32 array.
+        """
+        return self.get(embedding_id(text))
+
+    def flush(self):
+        """
+        Appends the embeddings that were added since the last flush to the
+        files. Those that another simulation already appended are skipped.
+        """
+        with self.lock:
+            if not self.pending:
+                return
+            with open(self.f_index, "a") as index_file:
+                if fcntl:
+                    fcntl.flock(index_file, fcntl.LOCK_EX)
+                try:
+                    self._load_index()
+                    new_rows = [
+                        (emb_id, text, embedding)
+                        for emb_id, (text, embedding) in self.pending.items()
+                        if emb_id not in self.id_to_row
+                    ]
+                    if not os.path.exists(self.f_meta):
+                        with open(self.f_meta, "w") as outfile:
+                            json.dump({"dim": self.dim}, outfile)
+                    # The vectors go first, so that an index line is never on
+                    # disk without its row.
+                    with open(self.f_vectors, "ab") as vectors_file:
+                        # Anything past the rows in the index was left by a
+                        # flush that did not finish.
+                        vectors_file.truncate(self.n_rows * self.dim * 4)
+                        for _, _, embedding in new_rows:
+                            vectors_file.write(embedding.tobytes())
+                    for emb_id, text, _ in new_rows:
+                        index_file.write(json.dumps([emb_id, text]) + "\n")
+                    index_file.flush()
+                finally:
+                    if fcntl:
+                        fcntl.flock(index_file, fcntl.LOCK_UN)
+            self._load_index()
+            self.pending = dict()
+
+
+class EmbeddingRefs:
+    """
+    A persona's view of the store: a dictionary-like object that maps the
+    strings in the persona's memory to their embeddings, keeping only the IDs.
+    e.g., a_mem.embeddings["bed is idle"] -> array([0.0012, -0.0231, ...])
+    """
+
+    def __init__(self, store):
+        self.store = store
+        # <ids> maps each str to its ID in the store.
+        # e.g., self.ids["bed is idle"] = "6e1f2a..."
+        self.ids = dict()
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __contains__(self, text):
+        return text in self.ids
+
+    def __getitem__(self, text):
+        return self.store.get(self.ids[text])
+
+    def __setitem__(self, text, embedding):
+        self.ids[text] = self.store.add(text, embedding)
+
+    def keys(self):
+        return self.ids.keys()
+
+    def items(self):
+        for text, emb_id in self.ids.items():
+            yield text, self.store.get(emb_id)
+
+    def load(self, f_saved):
+        """
+        Loads the strings of the json file <f_saved> (which maps them to their
+        IDs). All of them have to be in the store.
+        """
+        with open(f_saved) as json_file:
+            self.load_texts(list(json.load(json_file)), f_saved)
+
+    def load_texts(self, texts, f_saved):
+        """
+        Refers to the embeddings of the <texts> (e.g., the embedding keys of
+        the nodes saved in the file <f_saved>). All of them have to be in the
+        store.
+        """
+        ids = {text: embedding_id(text) for text in texts}
+        missing = [i for i in ids.values() if not self.store.has_id(i)]
+        if missing:
+            raise KeyError(
+                f"{len(missing)} embeddings of {f_saved} are not in the "
+                f"embedding store at {self.store.folder}",
+            )
+        self.ids.update(ids)
+
+    def export(self, f_out):
+        """
+        Writes all of the embeddings to the json file <f_out>, in the format of
+        embeddings.json (str -> list of floats), which loads without the store.
+        """
+        embeddings = dict()
+        for text, embedding in self.items():
+            embeddings[text] = embedding.tolist()
+        with open(f_out, "w") as outfile:
+            json.dump(embeddings, outfile)
+
+
+def _create_embedding_store():
+    path = embedding_store_path
+    if path is None:
+        path = f"{fs_storage}/../embedding_store"
+    # e.g., "text-embedding-ada-002", or "BAAI_bge-small-en" for "BAAI/bge-small-en"
+    model_folder = re.sub(r"[^\w.-]", "_", llm_embedding_model)
+    return EmbeddingStore(f"{path}/{model_folder}")
+
+
+_embedding_store = Shared(_create_embedding_store)
+
+
+def get_embedding_store():
+    """
+    Returns the shared <EmbeddingStore> of <llm_embedding_model>, opening it
+    in <embedding_store_path> on first use.
+    """
+    return _embedding_store.get()
@@ -9,6 +9,8 @@ memory that aids in grounding their behavior in the game world.
 import json
 import sys
 
+import numpy as np
+
 sys.path.append("../../")
 
 from global_methods import *
@@ -20,6 +22,12 @@ class MemoryTree:
         self.tree = {}
         if check_if_file_exists(f_saved):
             self.tree = json.load(open(f_saved))
+        # <absorbed_tiles> is a boolean array over the maze tiles (indexed
+        # [y][x]) that marks the tiles whose world, sector, arena and game
+        # object are already in <self.tree>. It is created on the first call to
+        # learn_nearby_tiles and is not saved, so after a reload the persona
+        # simply re-absorbs the tiles it sees once.
+        self.absorbed_tiles = None
 
     def print_tree(self):
         def _print_tree(tree, depth):
@@ -40,6 +48,64 @@ class MemoryTree:
         with open(out_json, "w") as outfile:
             json.dump(self.tree, outfile)
 
+    def learn_nearby_tiles(self, maze, tile, vision_r):
+        """
+        Adds the addresses of the tiles the persona sees (the same window as
+        maze.get_nearby_tiles) to the tree. Tiles that were absorbed before are
+        skipped, since the maze's addresses do not change, so this is nearly
+        free for a persona that has not moved to a new area.
+
+        INPUT
+          maze: An instance of <Maze>.
+          tile: The persona's current tile in (x, y) form.
+          vision_r: The radius of the persona's vision.
+        OUTPUT
+          A list of the tiles that were newly absorbed, in the same order as
+          get_nearby_tiles lists them.
+        """
+        if self.absorbed_tiles is None or self.absorbed_tiles.shape != (
+            maze.maze_height,
+            maze.maze_width,
+        ):
+            self.absorbed_tiles = np.zeros(
+                (maze.maze_height, maze.maze_width),
+                dtype=bool,
+            )
+
+        left_end, right_end, top_end, bottom_end = maze.get_nearby_window(
+            tile,
+            vision_r,
+        )
+        window = self.absorbed_tiles[top_end:bottom_end, left_end:right_end]
+        if window.all():
+            return []
+        # Transposing the window gives us the x-major order of get_nearby_tiles.
+        new_xs, new_ys = np.nonzero(~window.T)
+        window[:] = True
+
+        new_tiles = []
+        for x, y in zip(new_xs.tolist(), new_ys.tolist()):
+            new_tiles += [(x + left_end, y + top_end)]
+            i = maze.access_tile(new_tiles[-1])
+            if i["world"]:
+                if i["world"] not in self.tree:
+                    self.tree[i["world"]] = {}
+            if i["sector"]:
+                if i["sector"] not in self.tree[i["world"]]:
+                    self.tree[i["world"]][i["sector"]] = {}
+            if i["arena"]:
+                if i["arena"] not in self.tree[i["world"]][i["sector"]]:
+                    self.tree[i["world"]][i["sector"]][i["arena"]] = []
+            if i["game_object"]:
+                if (
+                    i["game_object"]
+                    not in self.tree[i["world"]][i["sector"]][i["arena"]]
+                ):
+                    self.tree[i["world"]][i["sector"]][i["arena"]] += [
+                        i["game_object"],
+                    ]
+        return new_tiles
+
     def get_str_accessible_sectors(self, curr_world):
         """
         Returns a summary string of all the arenas that the persona can access
@@ -9,6 +9,8 @@ the term we used internally back in 2022, taking from our Social Simulacra
 paper.
 """
 
+import copy
+import random
 import sys
 
 sys.path.append("../")
@@ -45,6 +47,11 @@ class Persona:
         scratch_saved = f"{folder_mem_saved}/bootstrap_memory/scratch.json"
         self.scratch = Scratch(scratch_saved)
 
+        # <rng> is the persona's own random number generator, so that what one
+        # persona picks at random does not depend on the other personas. The
+        # server seeds it at the start of each step.
+        self.rng = random.Random()
+
     def save(self, save_folder):
         """
         Save persona's current state (i.e., memory).
@@ -117,7 +124,7 @@ class Persona:
         """
         return retrieve(self, perceived)
 
-    def plan(self, maze, personas, new_day, retrieved):
+    def plan(self, maze, personas, new_day, retrieved, chat_requests=None):
         """
         Main cognitive function of the chain. It takes the retrieved memory and
         perception, as well as the maze and the first day state to conduct both
@@ -136,10 +143,13 @@ class Persona:
           retrieved: dictionary of dictionary. The first layer specifies an event,
                      while the latter layer specifies the "curr_event", "events",
                      and "thoughts" that are relevant.
+          chat_requests: If a list is given, a conversation the persona wants to
+                         start is added to it instead of being started right
+                         away. See commit_chat_requests.
         OUTPUT
           The target action address of the persona (persona.scratch.act_address).
         """
-        return plan(self, maze, personas, new_day, retrieved)
+        return plan(self, maze, personas, new_day, retrieved, chat_requests)
 
     def execute(self, maze, personas, plan):
         """
@@ -173,24 +183,17 @@ class Persona:
         """
         reflect(self)
 
-    def move(self, maze, personas, curr_tile, curr_time):
+    def start_step(self, curr_tile, curr_time):
         """
-        This is the main cognitive function where our main sequence is called.
+        Updates the persona's scratch memory with the tile and time of the step
+        that is starting.
 
         INPUT:
-          maze: The Maze class of the current world.
-          personas: A dictionary that contains all persona names as keys, and the
-                    Persona instance as values.
           curr_tile: A tuple that designates the persona's current tile location
-                     in (row, col) form. e.g., (58, 39)
+                     in (x, y) form. e.g., (58, 39)
           curr_time: datetime instance that indicates the game's current time.
         OUTPUT:
-          execution: A triple set that contains the following components:
-            <next_tile> is a x,y coordinate. e.g., (58, 9)
-            <pronunciatio> is an emoji.
-            <description> is a string description of the movement. e.g.,
-            writing her next novel (editing her novel)
-            @ double studio:double studio:common room:sofa
+          new_day: False, "First day" or "New day" (see plan).
         """
         # Updating persona's scratch memory with <curr_tile>.
         self.scratch.curr_tile = curr_tile
@@ -207,6 +210,67 @@ class Persona:
         ):
             new_day = "New day"
         self.scratch.curr_time = curr_time
+        return new_day
+
+    def snapshot(self):
+        """
+        Returns a copy of the persona as it is right now, for other personas to
+        look at while this one is thinking in a parallel step. The scratch is
+        copied so that the snapshot keeps its current action, chat and path,
+        and the associative memory does not show the nodes this persona adds
+        during the step. The spatial memory is shared, since only the persona
+        itself reads it.
+
+        INPUT:
+          None
+        OUTPUT:
+          A shallow copy of the <Persona> instance.
+        """
+        persona_snapshot = copy.copy(self)
+        persona_snapshot.scratch = copy.copy(self.scratch)
+        persona_snapshot.a_mem = self.a_mem.snapshot()
+        return persona_snapshot
+
+    def think(self, maze, personas, new_day, chat_requests):
+        """
+        The first half of move for a parallel step: perceive, retrieve and
+        plan. Everything the persona does here only changes its own state. A
+        conversation it wants to start is only added to <chat_requests>, since
+        that also changes the other persona's state.
+
+        INPUT:
+          maze: The Maze class of the current world.
+          personas: A dictionary that contains all persona names as keys, and
+                    snapshots of the Persona instances as values.
+          new_day: What start_step returned.
+          chat_requests: A list that the chat request (if any) is added to.
+        OUTPUT:
+          The target action address of the persona (persona.scratch.act_address).
+        """
+        perceived = self.perceive(maze)
+        retrieved = self.retrieve(perceived)
+        return self.plan(maze, personas, new_day, retrieved, chat_requests)
+
+    def move(self, maze, personas, curr_tile, curr_time):
+        """
+        This is the main cognitive function where our main sequence is called.
+
+        INPUT:
+          maze: The Maze class of the current world.
+          personas: A dictionary that contains all persona names as keys, and the
+                    Persona instance as values.
+          curr_tile: A tuple that designates the persona's current tile location
+                     in (row, col) form. e.g., (58, 39)
+          curr_time: datetime instance that indicates the game's current time.
+        OUTPUT:
+          execution: A triple set that contains the following components:
+            <next_tile> is a x,y coordinate. e.g., (58, 9)
+            <pronunciatio> is an emoji.
+            <description> is a string description of the movement. e.g.,
+            writing her next novel (editing her novel)
+            @ double studio:double studio:common room:sofa
+        """
+        new_day = self.start_step(curr_tile, curr_time)
 
         # Main cognitive sequence begins here.
         perceived = self.perceive(maze)
@@ -9,6 +9,10 @@ import json
 import time
 
 import openai
+from persona.prompt_template.llm_batcher import *
+from persona.prompt_template.llm_cache import *
+from persona.prompt_template.llm_client import *
+from persona.prompt_template.llm_embeddings import *
 from utils import *
 
 openai.api_key = openai_api_key
@@ -19,13 +23,14 @@ def temp_sleep(seconds=0.1):
 
 
 def ChatGPT_single_request(prompt):
-    temp_sleep()
+    cached_response = get_llm_cache().get("gpt-3.5-turbo", prompt)
+    if cached_response is not None:
+        return cached_response
 
-    completion = openai.ChatCompletion.create(
-        model="gpt-3.5-turbo",
-        messages=[{"role": "user", "content": prompt}],
-    )
-    return completion["choices"][0]["message"]["content"]
+    llm_client = get_llm_client()
+    response = llm_client.run(llm_client.chat(prompt, "gpt-3.5-turbo"))
+    get_llm_cache().put("gpt-3.5-turbo", prompt, None, response)
+    return response
 
 
 # ============================================================================
@@ -45,17 +50,19 @@ def GPT4_request(prompt):
     RETURNS:
       a str of GPT-3's response.
     """
-    temp_sleep()
+    cached_response = get_llm_cache().get("gpt-4", prompt)
+    if cached_response is not None:
+        return cached_response
 
+    # The rate limiting and the retries are done by the LLM client.
+    llm_client = get_llm_client()
     try:
-        completion = openai.ChatCompletion.create(
-            model="gpt-4",
-            messages=[{"role": "user", "content": prompt}],
-        )
-        return completion["choices"][0]["message"]["content"]
-
-    except:
-        print("ChatGPT ERROR")
+        response = llm_client.run(llm_client.chat(prompt, "gpt-4"))
+        get_llm_cache().put("gpt-4", prompt, None, response)
+        return response
+
+    except openai.error.OpenAIError as error:
+        print("ChatGPT ERROR", error)
         return "ChatGPT ERROR"
 
 
@@ -71,19 +78,84 @@ def ChatGPT_request(prompt):
     RETURNS:
       a str of GPT-3's response.
     """
-    # temp_sleep()
+    cached_response = get_llm_cache().get("gpt-3.5-turbo", prompt)
+    if cached_response is not None:
+        return cached_response
+
+    # The rate limiting and the retries are done by the LLM client.
+    llm_client = get_llm_client()
     try:
-        completion = openai.ChatCompletion.create(
-            model="gpt-3.5-turbo",
-            messages=[{"role": "user", "content": prompt}],
-        )
-        return completion["choices"][0]["message"]["content"]
-
-    except:
-        print("ChatGPT ERROR")
+        response = llm_client.run(llm_client.chat(prompt, "gpt-3.5-turbo"))
+        get_llm_cache().put("gpt-3.5-turbo", prompt, None, response)
+        return response
+
+    except openai.error.OpenAIError as error:
+        print("ChatGPT ERROR", error)
         return "ChatGPT ERROR"
 
 
+def ChatGPT_batch_request(prompts):
+    """
+    Sends several ChatGPT prompts as one request, and returns the responses
+    to each of them, in order. The prompts are the ones put together by
+    ChatGPT_safe_generate_response, which each ask for a json response. We
+    number the prompts and ask for a json array of {"index": ..., "output":
+    ...} objects, so that each response is matched to its prompt by its
+    index rather than by where it is in the array.
+    ARGS:
+      prompts: a list of str prompts
+    RETURNS:
+      a list of str responses (one json object each), with None for the
+      prompts that were not answered.
+    """
+    llm_client = get_llm_client()
+    if len(prompts) == 1:
+        return [llm_client.run(llm_client.chat(prompts[0], "gpt-3.5-turbo"))]
+
+    numbered_prompts = [
+        {"index": count, "prompt": prompt} for count, prompt in enumerate(prompts)
+    ]
+    batch_prompt = f"Below is a json array of {len(prompts)} separate prompts, "
+    batch_prompt += "each with its index. Answer each of them on its own, as if "
+    batch_prompt += "it were the only one.\n"
+    batch_prompt += json.dumps(numbered_prompts, indent=2) + "\n"
+    batch_prompt += "Output a json array with one element per prompt, where "
+    batch_prompt += 'each element is {"index": <the index of the prompt>, '
+    batch_prompt += '"output": <the json output for the prompt>}, and nothing '
+    batch_prompt += "else."
+    response = llm_client.run(llm_client.chat(batch_prompt, "gpt-3.5-turbo"))
+    response = response[response.find("[") : response.rfind("]") + 1]
+
+    responses = [None] * len(prompts)
+    for i in json.loads(response):
+        if not isinstance(i, dict) or "output" not in i:
+            continue
+        index = i.get("index")
+        if isinstance(index, int) and 0 <= index < len(prompts):
+            responses[index] = json.dumps(i["output"])
+    return responses
+
+
+def ChatGPT_batched_request(prompt, batch_key):
+    """
+    Same as ChatGPT_request, except that the prompt is sent together with the
+    prompts of the same <batch_key> that other personas send at the same time.
+    """
+    cached_response = get_llm_cache().get("gpt-3.5-turbo", prompt)
+    if cached_response is not None:
+        return cached_response
+
+    response = get_prompt_batcher().submit(
+        ("chat", batch_key),
+        prompt,
+        ChatGPT_batch_request,
+    )
+    if response is None:
+        return ChatGPT_request(prompt)
+    get_llm_cache().put("gpt-3.5-turbo", prompt, None, response)
+    return response
+
+
 def GPT4_safe_generate_response(
     prompt,
     example_output,
@@ -120,8 +192,14 @@ def GPT4_safe_generate_response(
                 print(curr_gpt_response)
                 print("~~~~")
 
+        except LLMCacheMissError:
+            # A replay that asks for something it did not record has diverged.
+            raise
         except:
             pass
+        # A response that did not work out is not kept in the cache, so that
+        # the next repeat asks again.
+        get_llm_cache().invalidate("gpt-4", prompt)
 
     return False
 
@@ -135,6 +213,7 @@ def ChatGPT_safe_generate_response(
     func_validate=None,
     func_clean_up=None,
     verbose=False,
+    batch_key=None,
 ):
     # prompt = 'GPT-3 Prompt:\n"""\n' + prompt + '\n"""\n'
     prompt = '"""\n' + prompt + '\n"""\n'
@@ -150,7 +229,13 @@ def ChatGPT_safe_generate_response(
 
     for i in range(repeat):
         try:
-            curr_gpt_response = ChatGPT_request(prompt).strip()
+            if i == 0 and batch_key and llm_batching:
+                # Only the first try is batched; a response that does not
+                # work out is asked again on its own.
+                curr_gpt_response = ChatGPT_batched_request(prompt, batch_key)
+            else:
+                curr_gpt_response = ChatGPT_request(prompt)
+            curr_gpt_response = curr_gpt_response.strip()
             end_index = curr_gpt_response.rfind("}") + 1
             curr_gpt_response = curr_gpt_response[:end_index]
             curr_gpt_response = json.loads(curr_gpt_response)["output"]
@@ -167,8 +252,14 @@ def ChatGPT_safe_generate_response(
                 print(curr_gpt_response)
                 print("~~~~")
 
+        except LLMCacheMissError:
+            # A replay that asks for something it did not record has diverged.
+            raise
         except:
             pass
+        # A response that did not work out is not kept in the cache, so that
+        # the next repeat asks again.
+        get_llm_cache().invalidate("gpt-3.5-turbo", prompt)
 
     return False
 
@@ -195,8 +286,12 @@ def ChatGPT_safe_generate_response_OLD(
                 print(curr_gpt_response)
                 print("~~~~")
 
+        except LLMCacheMissError:
+            # A replay that asks for something it did not record has diverged.
+            raise
         except:
             pass
+        get_llm_cache().invalidate("gpt-3.5-turbo", prompt)
     print("FAIL SAFE TRIGGERED")
     return fail_safe_response
 
@@ -218,25 +313,66 @@ def GPT_request(prompt, gpt_parameter):
     RETURNS:
       a str of GPT-3's response.
     """
-    temp_sleep()
+    cached_response = get_llm_cache().get(
+        gpt_parameter["engine"],
+        prompt,
+        gpt_parameter,
+    )
+    if cached_response is not None:
+        return cached_response
+
+    # The rate limiting and the retries are done by the LLM client.
+    llm_client = get_llm_client()
     try:
-        response = openai.Completion.create(
-            model=gpt_parameter["engine"],
-            prompt=prompt,
-            temperature=gpt_parameter["temperature"],
-            max_tokens=gpt_parameter["max_tokens"],
-            top_p=gpt_parameter["top_p"],
-            frequency_penalty=gpt_parameter["frequency_penalty"],
-            presence_penalty=gpt_parameter["presence_penalty"],
-            stream=gpt_parameter["stream"],
-            stop=gpt_parameter["stop"],
-        )
-        return response.choices[0].text
-    except:
-        print("TOKEN LIMIT EXCEEDED")
+        response = llm_client.run(llm_client.completion(prompt, gpt_parameter))
+        get_llm_cache().put(gpt_parameter["engine"], prompt, gpt_parameter, response)
+        return response
+    except openai.error.OpenAIError as error:
+        print("TOKEN LIMIT EXCEEDED", error)
         return "TOKEN LIMIT EXCEEDED"
 
 
+def GPT_batch_request(requests):
+    """
+    Sends several GPT-3 prompts with the same parameters as one request, and
+    returns the responses to each of them, in order.
+    ARGS:
+      requests: a list of (prompt, gpt_parameter) tuples
+    RETURNS:
+      a list of str responses.
+    """
+    gpt_parameter = requests[0][1]
+    llm_client = get_llm_client()
+    return llm_client.run(
+        llm_client.completions([prompt for prompt, _ in requests], gpt_parameter),
+    )
+
+
+def GPT_batched_request(prompt, gpt_parameter, batch_key):
+    """
+    Same as GPT_request, except that the prompt is sent together with the
+    prompts of the same <batch_key> (and parameters) that other personas send
+    at the same time.
+    """
+    cached_response = get_llm_cache().get(
+        gpt_parameter["engine"],
+        prompt,
+        gpt_parameter,
+    )
+    if cached_response is not None:
+        return cached_response
+
+    response = get_prompt_batcher().submit(
+        ("completion", batch_key, json.dumps(gpt_parameter, sort_keys=True)),
+        (prompt, gpt_parameter),
+        GPT_batch_request,
+    )
+    if response is None:
+        return GPT_request(prompt, gpt_parameter)
+    get_llm_cache().put(gpt_parameter["engine"], prompt, gpt_parameter, response)
+    return response
+
+
 def generate_prompt(curr_input, prompt_lib_file):
     """
     Takes in the current input (e.g. comment that you want to classifiy) and
@@ -273,26 +409,40 @@ def safe_generate_response(
     func_validate=None,
     func_clean_up=None,
     verbose=False,
+    batch_key=None,
 ):
     if verbose:
         print(prompt)
 
     for i in range(repeat):
-        curr_gpt_response = GPT_request(prompt, gpt_parameter)
+        if i == 0 and batch_key and llm_batching:
+            # Only the first try is batched; a response that does not work
+            # out is asked again on its own.
+            curr_gpt_response = GPT_batched_request(prompt, gpt_parameter, batch_key)
+        else:
+            curr_gpt_response = GPT_request(prompt, gpt_parameter)
         if func_validate(curr_gpt_response, prompt=prompt):
             return func_clean_up(curr_gpt_response, prompt=prompt)
         if verbose:
             print("---- repeat count: ", i, curr_gpt_response)
             print(curr_gpt_response)
             print("~~~~")
+        get_llm_cache().invalidate(gpt_parameter["engine"], prompt, gpt_parameter)
     return fail_safe_response
 
 
-def get_embedding(text, model="text-embedding-ada-002"):
-    text = text.replace("\n", " ")
-    if not text:
-        text = "this is blank"
-    return openai.Embedding.create(input=[text], model=model)["data"][0]["embedding"]
+def get_embedding(text):
+    return get_embedding_service().get_embeddings([text])[0]
+
+
+def get_embeddings(texts):
+    """
+    Returns the embeddings of all of the <texts> (a list of str), in order.
+    The ones that were embedded before are taken from the shared store, and
+    the rest are embedded with a single request. The model is set with
+    <llm_embedding_model> in utils.py.
+    """
+    return get_embedding_service().get_embeddings(texts)
 
 
 if __name__ == "__main__":
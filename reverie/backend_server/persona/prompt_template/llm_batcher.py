@@ -0,0 +1,120 @@
+"""
+File: llm_batcher.py
+Description: Groups prompts of the same kind from different personas into one
+request. At the start of a day every persona asks for its wake up hour, its
+daily plan and its hourly schedule, and in every step the personas ask for the
+poignancy of the events they perceived. When the personas think at the same
+time (see <persona_workers> in reverie.py), those prompts arrive within a few
+milliseconds of each other and can go out as a single request.
+
+A prompt is submitted with a batch key (e.g., the name of its template). The
+first prompt of a key waits up to <llm_batch_window> seconds for others with
+the same key (or until there are <llm_batch_max_items> of them), and then
+sends all of them at once and hands each caller its own response. Callers
+validate their response as usual and fall back to a single request if it does
+not pass.
+
+Batching is off by default, since with one persona thinking at a time the
+wait would only add latency. To turn it on, add to utils.py:
+  llm_batching = True
+"""
+
+import json
+import threading
+
+import openai
+from settings import *
+
+llm_batching = get_setting("llm_batching", False)
+# <llm_batch_window> is how long (in seconds) the first prompt of a batch waits
+# for others, and <llm_batch_max_items> is the most prompts a batch holds.
+llm_batch_window = get_setting("llm_batch_window", 0.2)
+llm_batch_max_items = get_setting("llm_batch_max_items", 10)
+
+
+class PromptBatcher:
+    def __init__(self, window=0.2, max_items=10):
+        self.window = window
+        self.max_items = max_items
+
+        # <pending> has the batch that is still open for each batch key. A
+        # batch is a list of items, each a dictionary with the caller's
+        # request, its response and an event that is set once it is there.
+        # e.g., self.pending[("completion", "daily_plan", ...)] = [{...}, ...]
+        self.pending = dict()
+        self.cond = threading.Condition()
+
+        self.batch_count = 0
+        self.item_count = 0
+
+    def submit(self, batch_key, request, send_batch):
+        """
+        Adds <request> to the open batch of <batch_key> and waits for its
+        response. The caller whose request opened the batch sends it, with
+        <send_batch>, once the window is over or the batch is full.
+
+        INPUT
+          batch_key: A hashable key. Only requests with the same key are sent
+                     together, so it should also cover anything (e.g., the
+                     model parameters) that has to be the same for all of them.
+          request: Whatever <send_batch> takes for one item, e.g., a prompt.
+          send_batch: A function that takes the list of requests of a batch
+                      and returns the list of their responses, in order (None
+                      for a request it has no response to).
+        OUTPUT
+          The response to <request>, or None if the batch failed (the caller
+          should then send the request on its own).
+        """
+        item = {"request": request, "response": None, "done": threading.Event()}
+        with self.cond:
+            batch = self.pending.setdefault(batch_key, [])
+            batch.append(item)
+            opened = len(batch) == 1
+            if len(batch) >= self.max_items:
+                # The batch is closed; the next request opens a new one.
+                del self.pending[batch_key]
+                self.cond.notify_all()
+            elif opened:
+                self.cond.wait_for(
+                    lambda: len(batch) >= self.max_items,
+                    self.window,
+                )
+                if self.pending.get(batch_key) is batch:
+                    del self.pending[batch_key]
+
+        if opened:
+            self._send(batch, send_batch)
+        else:
+            item["done"].wait()
+        return item["response"]
+
+    def _send(self, batch, send_batch):
+        responses = []
+        try:
+            responses = send_batch([item["request"] for item in batch])
+            self.batch_count += 1
+            self.item_count += len(batch)
+        except (openai.error.OpenAIError, json.JSONDecodeError, ValueError) as error:
+            print("LLM BATCH ERROR", error)
+        finally:
+            # The other callers are woken up whatever happened; the ones
+            # without a response send their request on their own.
+            for count, item in enumerate(batch):
+                if count < len(responses):
+                    item["response"] = responses[count]
+                item["done"].set()
+
+
+def _create_prompt_batcher():
+    return PromptBatcher(llm_batch_window, llm_batch_max_items)
+
+
+_prompt_batcher = Shared(_create_prompt_batcher)
+
+
+def get_prompt_batcher():
+    """
+    Returns the shared <PromptBatcher>, creating it with the settings from
+    utils.py on first use.
+    """
+    return _prompt_batcher.get()
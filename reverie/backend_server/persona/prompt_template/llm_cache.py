@@ -0,0 +1,209 @@
+"""
+File: llm_cache.py
+Description: A persistent cache of LLM responses, stored in SQLite and keyed
+by the hash of the model, the prompt and the request parameters. The
+run_gpt_prompt_* functions often send the exact same prompt again (e.g., the
+wake up hour or the pronunciatio of a recurring action), and a re-run or a
+fork of a simulation sends the same prompts as the original run. With the
+cache on, those cost no tokens.
+
+The cache has three modes (set with <llm_cache_mode> in utils.py):
+  "off": Nothing is cached (the default).
+  "read_write": Cached responses are used, and new responses are cached.
+  "replay": Only cached responses are used, and a prompt that is not in the
+            cache raises an <LLMCacheMissError>. This replays a recorded run
+            deterministically without sending any requests.
+"""
+
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+
+from settings import *
+from utils import *
+
+llm_cache_mode = get_setting("llm_cache_mode", "off")
+# <llm_cache_path> is the SQLite file (None means temp_storage/llm_cache.sqlite3).
+llm_cache_path = get_setting("llm_cache_path", None)
+# <llm_cache_ttl> is how long (in seconds) a response stays in the cache, and
+# <llm_cache_max_entries> is how many responses are kept (the least recently
+# used go first). None means no limit.
+llm_cache_ttl = get_setting("llm_cache_ttl", None)
+llm_cache_max_entries = get_setting("llm_cache_max_entries", 200000)
+
+
+class LLMCacheMissError(Exception):
+    pass
+
+
+class LLMCache:
+    def __init__(self, path, mode="read_write", ttl=None, max_entries=None):
+        self.path = path
+        self.mode = mode
+        self.ttl = ttl
+        self.max_entries = max_entries
+
+        self.hits = 0
+        self.misses = 0
+        # We evict every <evict_every> new responses, besides when opening.
+        self.evict_every = 1000
+        self.puts_since_evict = 0
+
+        self.lock = threading.Lock()
+        self.conn = None
+        if self.mode != "off":
+            self.conn = sqlite3.connect(path, check_same_thread=False)
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                "key TEXT PRIMARY KEY, model TEXT, prompt TEXT, params TEXT, "
+                "response TEXT, created REAL, last_used REAL, hits INTEGER)",
+            )
+            self.conn.execute(
+                "CREATE INDEX IF NOT EXISTS responses_last_used "
+                "ON responses (last_used)",
+            )
+            self.conn.commit()
+            self.evict()
+
+    def key(self, model, prompt, params=None):
+        """
+        Returns the cache key (a sha256 hex digest) of a request.
+
+        INPUT
+          model: The model name. e.g., "gpt-3.5-turbo"
+          prompt: The str prompt.
+          params: Optional dictionary of the other request parameters.
+        OUTPUT
+          The key str.
+        """
+        content = json.dumps([model, prompt, params], sort_keys=True)
+        return hashlib.sha256(content.encode()).hexdigest()
+
+    def get(self, model, prompt, params=None):
+        """
+        Returns the cached response of a request, or None if it is not cached.
+        In "replay" mode, a request that is not cached raises an
+        <LLMCacheMissError> instead.
+        """
+        if self.mode == "off":
+            return None
+
+        key = self.key(model, prompt, params)
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT response, created FROM responses WHERE key = ?",
+                (key,),
+            ).fetchone()
+            if row and self.ttl is not None and row[1] < time.time() - self.ttl:
+                row = None
+            if row:
+                self.hits += 1
+                self.conn.execute(
+                    "UPDATE responses SET last_used = ?, hits = hits + 1 WHERE key = ?",
+                    (time.time(), key),
+                )
+                self.conn.commit()
+                return row[0]
+            self.misses += 1
+
+        if self.mode == "replay":
+            raise LLMCacheMissError(f"No cached response for {model} prompt:\n{prompt}")
+        return None
+
+    def put(self, model, prompt, params, response):
+        """
+        Caches the response of a request (only in "read_write" mode).
+        """
+        if self.mode != "read_write":
+            return
+
+        key = self.key(model, prompt, params)
+        now = time.time()
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?, 0)",
+                (key, model, prompt, json.dumps(params), response, now, now),
+            )
+            self.conn.commit()
+            self.puts_since_evict += 1
+        if self.puts_since_evict >= self.evict_every:
+            self.evict()
+
+    def invalidate(self, model, prompt, params=None):
+        """
+        Removes the response of a request from the cache, e.g., because it did
+        not pass validation and should be requested again.
+        """
+        if self.mode != "read_write":
+            return
+
+        with self.lock:
+            self.conn.execute(
+                "DELETE FROM responses WHERE key = ?",
+                (self.key(model, prompt, params),),
+            )
+            self.conn.commit()
+
+    def evict(self):
+        """
+        Removes the responses that are older than the TTL, and then the least
+        recently used ones beyond <max_entries>.
+        """
+        if self.mode != "read_write":
+            return
+
+        with self.lock:
+            if self.ttl is not None:
+                self.conn.execute(
+                    "DELETE FROM responses WHERE created < ?",
+                    (time.time() - self.ttl,),
+                )
+            if self.max_entries is not None:
+                self.conn.execute(
+                    "DELETE FROM responses WHERE key IN (SELECT key FROM "
+                    "responses ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+                    (self.max_entries,),
+                )
+            self.conn.commit()
+            self.puts_since_evict = 0
+
+    def stats(self):
+        """
+        Returns the hit and miss counts of this session, the hit rate and the
+        number of cached responses.
+        """
+        entries = 0
+        if self.conn:
+            with self.lock:
+                entries = self.conn.execute(
+                    "SELECT COUNT(*) FROM responses",
+                ).fetchone()[0]
+        total = self.hits + self.misses
+        return {
+            "mode": self.mode,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "entries": entries,
+        }
+
+
+def _create_llm_cache():
+    path = llm_cache_path
+    if path is None:
+        path = f"{fs_temp_storage}/llm_cache.sqlite3"
+    return LLMCache(path, llm_cache_mode, llm_cache_ttl, llm_cache_max_entries)
+
+
+_llm_cache = Shared(_create_llm_cache)
+
+
+def get_llm_cache():
+    """
+    Returns the shared <LLMCache>, opening it with the settings from utils.py
+    on first use.
+    """
+    return _llm_cache.get()
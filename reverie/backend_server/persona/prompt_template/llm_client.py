@@ -0,0 +1,279 @@
+"""
+File: llm_client.py
+Description: An asynchronous client for the OpenAI API calls in
+gpt_structure.py. All requests go through one event loop running in its own
+thread, which bounds how many requests are in flight at once, rate limits them
+(requests and tokens per minute), shares one connection pool, and retries
+rate-limited or failed (5xx) requests with jittered exponential backoff.
+
+The synchronous functions in gpt_structure.py submit their requests here and
+wait for the result, so they can be called from any thread (e.g., the personas
+of a parallel step). Async code can await the client's coroutines directly by
+running them on the client's loop.
+
+The settings can be overridden in utils.py. e.g., to run against a local mock
+server that speaks the OpenAI API:
+  openai_api_base = "http://127.0.0.1:8080/v1"
+"""
+
+import asyncio
+import random
+import threading
+import time
+
+import aiohttp
+import openai
+from settings import *
+
+# <openai_api_base> is the base URL of the API (None means OpenAI's).
+openai_api_base = get_setting("openai_api_base", None)
+# <llm_max_concurrency> is the number of requests that can be in flight at once.
+llm_max_concurrency = get_setting("llm_max_concurrency", 8)
+# <llm_requests_per_minute> and <llm_tokens_per_minute> are the rate limits.
+llm_requests_per_minute = get_setting("llm_requests_per_minute", 3500)
+llm_tokens_per_minute = get_setting("llm_tokens_per_minute", 90000)
+# <llm_max_retries> is how many times a rate-limited or failed request is
+# retried before the error is raised.
+llm_max_retries = get_setting("llm_max_retries", 5)
+
+
+class TokenBucket:
+    """
+    A token bucket that holds up to <per_minute> tokens and refills at
+    <per_minute> tokens per minute. It is only used from the client's loop.
+    """
+
+    def __init__(self, per_minute):
+        self.capacity = per_minute
+        self.rate = per_minute / 60.0
+        self.tokens = per_minute
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(
+            self.capacity,
+            self.tokens + (now - self.updated) * self.rate,
+        )
+        self.updated = now
+
+    async def acquire(self, amount):
+        """
+        Waits until <amount> tokens are available and takes them.
+        """
+        amount = min(amount, self.capacity)
+        while True:
+            self._refill()
+            if self.tokens >= amount:
+                self.tokens -= amount
+                return
+            await asyncio.sleep((amount - self.tokens) / self.rate)
+
+    def consume(self, amount):
+        """
+        Takes <amount> tokens without waiting (the bucket may go below zero).
+        This is used to correct an estimate once the actual usage is known.
+        """
+        self._refill()
+        self.tokens -= amount
+
+
+def is_retryable(error):
+    """
+    Returns True if the OpenAI <error> is worth retrying: rate limits,
+    timeouts, connection problems and server-side (5xx) errors.
+    """
+    if isinstance(
+        error,
+        (
+            openai.error.RateLimitError,
+            openai.error.ServiceUnavailableError,
+            openai.error.Timeout,
+            openai.error.APIConnectionError,
+        ),
+    ):
+        return True
+    if isinstance(error, openai.error.APIError):
+        return error.http_status is None or error.http_status >= 500
+    return False
+
+
+def estimate_tokens(text):
+    """
+    A rough estimate of the number of tokens in <text> (about 4 characters per
+    token for English), used for rate limiting before a request is sent.
+    """
+    return len(text) // 4 + 1
+
+
+class LLMClient:
+    def __init__(
+        self,
+        max_concurrency=8,
+        requests_per_minute=3500,
+        tokens_per_minute=90000,
+        max_retries=5,
+        api_base=None,
+        backoff_base=1.0,
+        backoff_max=60.0,
+    ):
+        self.max_concurrency = max_concurrency
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.max_retries = max_retries
+        self.api_base = api_base
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+
+        # <retry_count> and <error_count> are for keeping an eye on how often
+        # we hit the limits or errors.
+        self.request_count = 0
+        self.retry_count = 0
+        self.error_count = 0
+
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self.thread.start()
+        self.run(self._setup())
+
+    async def _setup(self):
+        # These have to be created on the client's loop.
+        self.semaphore = asyncio.Semaphore(self.max_concurrency)
+        self.request_bucket = TokenBucket(self.requests_per_minute)
+        self.token_bucket = TokenBucket(self.tokens_per_minute)
+        self.session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=self.max_concurrency),
+        )
+
+    def run(self, coroutine):
+        """
+        Runs <coroutine> on the client's loop and waits for its result. This can
+        be called from any thread other than the client's own.
+        """
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop).result()
+
+    def close(self):
+        self.run(self.session.close())
+        self.loop.call_soon_threadsafe(self.loop.stop)
+
+    def _backoff(self, attempt):
+        # "Full jitter": a random wait between 0 and the exponential backoff.
+        return random.uniform(
+            0,
+            min(self.backoff_max, self.backoff_base * 2**attempt),
+        )
+
+    async def _request(self, create, n_tokens, **params):
+        """
+        Sends a request with <create> (e.g., openai.ChatCompletion.acreate),
+        waiting for a free slot and for the rate limits first, and retrying it
+        if it is rate-limited or fails on the server's side.
+        """
+        for attempt in range(self.max_retries + 1):
+            async with self.semaphore:
+                await self.request_bucket.acquire(1)
+                await self.token_bucket.acquire(n_tokens)
+                openai.aiosession.set(self.session)
+                self.request_count += 1
+                try:
+                    response = await create(api_base=self.api_base, **params)
+                except openai.error.OpenAIError as error:
+                    if not is_retryable(error) or attempt == self.max_retries:
+                        self.error_count += 1
+                        raise
+                else:
+                    usage = response.get("usage")
+                    if usage:
+                        self.token_bucket.consume(usage["total_tokens"] - n_tokens)
+                    return response
+            self.retry_count += 1
+            await asyncio.sleep(self._backoff(attempt))
+
+    async def chat(self, prompt, model="gpt-3.5-turbo", **params):
+        """
+        Returns the chat model's response to <prompt> as a str.
+        """
+        response = await self._request(
+            openai.ChatCompletion.acreate,
+            estimate_tokens(prompt) + params.get("max_tokens", 256),
+            model=model,
+            messages=[{"role": "user", "content": prompt}],
+            **params,
+        )
+        return response["choices"][0]["message"]["content"]
+
+    async def completion(self, prompt, gpt_parameter):
+        """
+        Returns the completion model's response to <prompt> as a str. See
+        gpt_structure.GPT_request for <gpt_parameter>.
+        """
+        response = await self._request(
+            openai.Completion.acreate,
+            estimate_tokens(prompt) + gpt_parameter["max_tokens"],
+            model=gpt_parameter["engine"],
+            prompt=prompt,
+            temperature=gpt_parameter["temperature"],
+            max_tokens=gpt_parameter["max_tokens"],
+            top_p=gpt_parameter["top_p"],
+            frequency_penalty=gpt_parameter["frequency_penalty"],
+            presence_penalty=gpt_parameter["presence_penalty"],
+            stream=gpt_parameter["stream"],
+            stop=gpt_parameter["stop"],
+        )
+        return response.choices[0].text
+
+    async def completions(self, prompts, gpt_parameter):
+        """
+        Returns the completion model's responses to all of the <prompts> (a
+        list of str), in order, using a single request.
+        """
+        response = await self._request(
+            openai.Completion.acreate,
+            sum(estimate_tokens(prompt) for prompt in prompts)
+            + gpt_parameter["max_tokens"] * len(prompts),
+            model=gpt_parameter["engine"],
+            prompt=prompts,
+            temperature=gpt_parameter["temperature"],
+            max_tokens=gpt_parameter["max_tokens"],
+            top_p=gpt_parameter["top_p"],
+            frequency_penalty=gpt_parameter["frequency_penalty"],
+            presence_penalty=gpt_parameter["presence_penalty"],
+            stream=gpt_parameter["stream"],
+            stop=gpt_parameter["stop"],
+        )
+        choices = sorted(response.choices, key=lambda i: i["index"])
+        return [i.text for i in choices]
+
+    async def embed(self, texts, model="text-embedding-ada-002"):
+        """
+        Returns the embeddings of the <texts> (a list of str), in order.
+        """
+        response = await self._request(
+            openai.Embedding.acreate,
+            sum(estimate_tokens(text) for text in texts),
+            input=texts,
+            model=model,
+        )
+        data = sorted(response["data"], key=lambda i: i["index"])
+        return [i["embedding"] for i in data]
+
+
+def _create_llm_client():
+    return LLMClient(
+        llm_max_concurrency,
+        llm_requests_per_minute,
+        llm_tokens_per_minute,
+        llm_max_retries,
+        openai_api_base,
+    )
+
+
+_llm_client = Shared(_create_llm_client)
+
+
+def get_llm_client():
+    """
+    Returns the shared <LLMClient>, creating it with the settings from utils.py
+    on first use.
+    """
+    return _llm_client.get()
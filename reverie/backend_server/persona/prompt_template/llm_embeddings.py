@@ -0,0 +1,134 @@
+"""
+File: llm_embeddings.py
+Description: The embedding service behind gpt_structure.get_embedding. It
+keeps every embedding in the embedding store that all the personas share (see
+embedding_store.py), so a string that was embedded once (e.g., for Isabella)
+is never embedded again (e.g., for Klaus). The strings that are not in the
+store yet are deduplicated and embedded with a single request (input=[...]).
+With <llm_batching> on (see llm_batcher.py), the strings that different
+personas ask for at the same time go out in the same request.
+
+The callers that need several embeddings (e.g., perceive with all the new
+events of a step) should ask for them together with get_embeddings.
+"""
+
+import threading
+
+from persona.memory_structures.embedding_store import *
+from persona.prompt_template.llm_batcher import *
+from persona.prompt_template.llm_client import *
+from settings import *
+
+# <llm_embedding_max_batch> is the most strings that are sent in one request.
+# The model (<llm_embedding_model>) is set in embedding_store.py, since each
+# model has its own store.
+llm_embedding_max_batch = get_setting("llm_embedding_max_batch", 512)
+
+
+def prepare_embedding_text(text):
+    """
+    Returns the str that is actually embedded for <text>: new lines are
+    replaced with spaces, and an empty str becomes "this is blank".
+    """
+    text = text.replace("\n", " ")
+    if not text:
+        text = "this is blank"
+    return text
+
+
+class EmbeddingService:
+    def __init__(self, store, model="text-embedding-ada-002", max_batch=512):
+        # <store> is the <EmbeddingStore> with the embedded strs (as prepared by
+        # prepare_embedding_text).
+        self.store = store
+        self.model = model
+        self.max_batch = max_batch
+        self.lock = threading.Lock()
+
+        self.request_count = 0
+        self.embedded_count = 0
+        self.hit_count = 0
+
+    def get_embeddings(self, texts):
+        """
+        Returns the embeddings of the <texts>, in order. Only the ones that are
+        not in the store are requested, each of them once.
+
+        INPUT
+          texts: A list of str.
+        OUTPUT
+          A list of embeddings (float32 arrays).
+        """
+        texts = [prepare_embedding_text(text) for text in texts]
+        with self.lock:
+            missing = list(dict.fromkeys(i for i in texts if i not in self.store))
+            self.hit_count += len(texts) - len(missing)
+
+        if missing:
+            embeddings = None
+            if llm_batching:
+                embeddings = get_prompt_batcher().submit(
+                    ("embedding", self.model),
+                    missing,
+                    self._embed_batch,
+                )
+            if embeddings is None:
+                embeddings = self._embed(missing)
+            for text, embedding in zip(missing, embeddings):
+                self.store.add(text, embedding)
+
+        return [self.store.get_vector(text) for text in texts]
+
+    def _embed(self, texts):
+        """
+        Requests the embeddings of the <texts>, <max_batch> at a time.
+        """
+        llm_client = get_llm_client()
+        embeddings = []
+        for i in range(0, len(texts), self.max_batch):
+            chunk = texts[i : i + self.max_batch]
+            embeddings += llm_client.run(llm_client.embed(chunk, self.model))
+            self.request_count += 1
+            self.embedded_count += len(chunk)
+        return embeddings
+
+    def _embed_batch(self, requests):
+        """
+        Requests the embeddings of the text lists of several callers together.
+        The texts that more than one caller asks for are requested once.
+        """
+        texts = list(dict.fromkeys(text for request in requests for text in request))
+        embeddings = dict(zip(texts, self._embed(texts)))
+        return [[embeddings[text] for text in request] for request in requests]
+
+    def stats(self):
+        """
+        Returns the number of requests sent, the number of strings embedded,
+        the number of strings that were found in the store and the size of
+        the store.
+        """
+        return {
+            "requests": self.request_count,
+            "embedded": self.embedded_count,
+            "hits": self.hit_count,
+            "entries": len(self.store),
+        }
+
+
+def _create_embedding_service():
+    return EmbeddingService(
+        get_embedding_store(),
+        llm_embedding_model,
+        llm_embedding_max_batch,
+    )
+
+
+_embedding_service = Shared(_create_embedding_service)
+
+
+def get_embedding_service():
+    """
+    Returns the shared <EmbeddingService>, creating it with the settings from
+    utils.py on first use.
+    """
+    return _embedding_service.get()
@@ -18,7 +18,7 @@ from persona.prompt_template.gpt_structure import *
 from persona.prompt_template.print_prompt import *
 
 
-def get_random_alphanumeric(i=6, j=6):
+def get_random_alphanumeric(i=6, j=6, rng=random):
     """
     Returns a random alpha numeric strength that has the length of somewhere
     between i and j.
@@ -26,14 +26,41 @@ def get_random_alphanumeric(i=6, j=6):
     INPUT:
       i: min_range for the length
       j: max_range for the length
+      rng: The random number generator to use, e.g., persona.rng
     OUTPUT:
       an alpha numeric str with the length of somewhere between i and j.
     """
-    k = random.randint(i, j)
-    x = "".join(random.choices(string.ascii_letters + string.digits, k=k))
+    k = rng.randint(i, j)
+    x = "".join(rng.choices(string.ascii_letters + string.digits, k=k))
     return x
 
 
+# <action_memo> keeps the generations that only depend on the action (and the
+# game object), not on which persona is doing it, for the rest of the run. It
+# is shared by all personas, so "sleeping" or "brushing teeth" only have their
+# pronunciatio, event triple and object state generated once. The keys are
+# (kind, normalized action description[, game object]) tuples.
+# e.g., action_memo[("pronunciatio", "sleeping")] = "😴"
+action_memo = dict()
+
+
+def normalize_action_description(action_description):
+    """
+    Returns the part of an action description that the memoized generations
+    depend on: the inner description (if there is one in parentheses),
+    lowercased, without extra whitespace or a trailing period.
+    e.g., "sleeping (getting ready for bed)" -> "getting ready for bed"
+
+    INPUT:
+      action_description: The str action description.
+    OUTPUT:
+      The normalized str action description.
+    """
+    if "(" in action_description:
+        action_description = action_description.split("(")[-1].split(")")[0]
+    return " ".join(action_description.lower().split()).rstrip(".")
+
+
 ##############################################################################
 # CHAPTER 1: Run GPT Prompt
 ##############################################################################
@@ -97,6 +124,7 @@ def run_gpt_prompt_wake_up_hour(persona, test_input=None, verbose=False):
         fail_safe,
         __func_validate,
         __func_clean_up,
+        batch_key="wake_up_hour",
     )
 
     if debug or verbose:
@@ -188,6 +216,7 @@ def run_gpt_prompt_daily_plan(persona, wake_up_hour, test_input=None, verbose=Fa
         fail_safe,
         __func_validate,
         __func_clean_up,
+        batch_key="daily_plan",
     )
     output = [
         f"wake up and complete the morning routine at {wake_up_hour}:00 am",
@@ -241,13 +270,13 @@ def run_gpt_prompt_generate_hourly_schedule(
         if p_f_ds_hourly_org:
             prior_schedule = "\n"
             for count, i in enumerate(p_f_ds_hourly_org):
-                prior_schedule += f"[(ID:{get_random_alphanumeric()})"
+                prior_schedule += f"[(ID:{get_random_alphanumeric(rng=persona.rng)})"
                 prior_schedule += f" {persona.scratch.get_str_curr_date_str()} --"
                 prior_schedule += f" {hour_str[count]}] Activity:"
                 prior_schedule += f" {persona.scratch.get_str_firstname()}"
                 prior_schedule += f" is {i}\n"
 
-        prompt_ending = f"[(ID:{get_random_alphanumeric()})"
+        prompt_ending = f"[(ID:{get_random_alphanumeric(rng=persona.rng)})"
         prompt_ending += f" {persona.scratch.get_str_curr_date_str()}"
         prompt_ending += f" -- {curr_hour_str}] Activity:"
         prompt_ending += f" {persona.scratch.get_str_firstname()} is"
@@ -348,6 +377,7 @@ def run_gpt_prompt_generate_hourly_schedule(
         fail_safe,
         __func_validate,
         __func_clean_up,
+        batch_key="generate_hourly_schedule",
     )
 
     if debug or verbose:
@@ -916,7 +946,7 @@ def run_gpt_prompt_action_game_object(
         ).split(",")
     ]
     if output not in x:
-        output = random.choice(x)
+        output = persona.rng.choice(x)
 
     if debug or verbose:
         print_run_prompts(
@@ -932,6 +962,12 @@ def run_gpt_prompt_action_game_object(
 
 
 def run_gpt_prompt_pronunciatio(action_description, persona, verbose=False):
+    # The emoji only depends on the action, so all personas share it.
+    memo_key = ("pronunciatio", normalize_action_description(action_description))
+    if memo_key in action_memo:
+        output = action_memo[memo_key]
+        return output, [output, None, None, None, None]
+
     def create_prompt_input(action_description):
         if "(" in action_description:
             action_description = action_description.split("(")[-1].split(")")[0]
@@ -1006,6 +1042,7 @@ def run_gpt_prompt_pronunciatio(action_description, persona, verbose=False):
         True,
     )
     if output != False:
+        action_memo[memo_key] = output
         return output, [output, prompt, gpt_param, prompt_input, fail_safe]
     # ChatGPT Plugin ===========================================================
 
@@ -1029,6 +1066,13 @@ def run_gpt_prompt_pronunciatio(action_description, persona, verbose=False):
 
 
 def run_gpt_prompt_event_triple(action_description, persona, verbose=False):
+    # Only the subject of the triple depends on the persona, so all personas
+    # share the predicate and object of an action.
+    memo_key = ("event_triple", normalize_action_description(action_description))
+    if memo_key in action_memo:
+        output = (persona.name,) + action_memo[memo_key]
+        return output, [output, None, None, None, None]
+
     def create_prompt_input(action_description, persona):
         if "(" in action_description:
             action_description = action_description.split("(")[-1].split(")")[0]
@@ -1105,6 +1149,8 @@ def run_gpt_prompt_event_triple(action_description, persona, verbose=False):
         __func_validate,
         __func_clean_up,
     )
+    if output is not fail_safe:
+        action_memo[memo_key] = (output[0], output[1])
     output = (persona.name, output[0], output[1])
 
     if debug or verbose:
@@ -1121,6 +1167,13 @@ def run_gpt_prompt_event_triple(action_description, persona, verbose=False):
 
 
 def run_gpt_prompt_act_obj_desc(act_game_object, act_desp, persona, verbose=False):
+    # The object's state depends on the object and the action, not on who is
+    # using it, so all personas share it.
+    memo_key = ("act_obj_desc", normalize_action_description(act_desp), act_game_object)
+    if memo_key in action_memo:
+        output = action_memo[memo_key]
+        return output, [output, None, None, None, None]
+
     def create_prompt_input(act_game_object, act_desp, persona):
         prompt_input = [
             act_game_object,
@@ -1192,6 +1245,7 @@ def run_gpt_prompt_act_obj_desc(act_game_object, act_desp, persona, verbose=Fals
         True,
     )
     if output != False:
+        action_memo[memo_key] = output
         return output, [output, prompt, gpt_param, prompt_input, fail_safe]
     # ChatGPT Plugin ===========================================================
 
@@ -1218,6 +1272,15 @@ def run_gpt_prompt_act_obj_event_triple(
     persona,
     verbose=False,
 ):
+    memo_key = (
+        "act_obj_event_triple",
+        normalize_action_description(act_obj_desc),
+        act_game_object,
+    )
+    if memo_key in action_memo:
+        output = (act_game_object,) + action_memo[memo_key]
+        return output, [output, None, None, None, None]
+
     def create_prompt_input(act_game_object, act_obj_desc):
         prompt_input = [act_game_object, act_obj_desc, act_game_object]
         return prompt_input
@@ -1262,6 +1325,8 @@ def run_gpt_prompt_act_obj_event_triple(
         __func_validate,
         __func_clean_up,
     )
+    if output is not fail_safe:
+        action_memo[memo_key] = (output[0], output[1])
     output = (act_game_object, output[0], output[1])
 
     if debug or verbose:
@@ -2282,6 +2347,7 @@ def run_gpt_prompt_event_poignancy(
         __chat_func_validate,
         __chat_func_clean_up,
         True,
+        batch_key="event_poignancy",
     )
     if output != False:
         return output, [output, prompt, gpt_param, prompt_input, fail_safe]
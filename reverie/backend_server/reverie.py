@@ -26,12 +26,19 @@ import os
 import shutil
 import time
 import traceback
+from concurrent.futures import ThreadPoolExecutor
 
 from global_methods import *
 from maze import *
 from persona.persona import *
+from settings import *
+from transport import *
 from utils import *
 
+# <persona_workers> is how many personas think at the same time in a step. With
+# 1, the personas move one after the other. See move_personas_parallel.
+persona_workers = get_setting("persona_workers", 1)
+
 ##############################################################################
 #                                  REVERIE                                   #
 ##############################################################################
@@ -91,6 +98,10 @@ class ReverieServer:
         # literally translates to the number of moves our personas made in terms
         # of the number of tiles.
         self.step = reverie_meta["step"]
+        # <seed> is what the personas' random number generators are seeded
+        # from (together with the step), so that a simulation makes the same
+        # random picks when it is run again.
+        self.seed = reverie_meta.get("seed", 0)
 
         # SETTING UP PERSONAS IN REVERIE
         # <personas> is a dictionary that takes the persona's full name as its
@@ -128,14 +139,21 @@ class ReverieServer:
 
             self.personas[persona_name] = curr_persona
             self.personas_tile[persona_name] = (p_x, p_y)
-            self.maze.tiles[p_y][p_x]["events"].add(
+            self.maze.add_event_from_tile(
                 curr_persona.scratch.get_curr_event_and_desc(),
+                (p_x, p_y),
             )
 
         # REVERIE SETTINGS PARAMETERS:
         # <server_sleep> denotes the amount of time that our while loop rests each
         # cycle; this is to not kill our machine.
         self.server_sleep = 0.1
+        # <transport> is how we exchange each step with the frontend server. By
+        # default this is the original file handshake; see transport.py.
+        self.transport = create_transport(self.sim_code, self.server_sleep)
+        # <persona_workers> is how many personas think at the same time in a
+        # step (1 means one after the other).
+        self.persona_workers = persona_workers
 
         # SIGNALING THE FRONTEND SERVER:
         # curr_sim_code.json contains the current simulation code, and
@@ -176,6 +194,7 @@ class ReverieServer:
         reverie_meta["maze_name"] = self.maze.maze_name
         reverie_meta["persona_names"] = list(self.personas.keys())
         reverie_meta["step"] = self.step
+        reverie_meta["seed"] = self.seed
         reverie_meta_f = f"{sim_folder}/reverie/meta.json"
         with open(reverie_meta_f, "w") as outfile:
             outfile.write(json.dumps(reverie_meta, indent=2))
@@ -286,19 +305,16 @@ class ReverieServer:
     def start_server(self, int_counter):
         """
         The main backend server of Reverie.
-        This function retrieves the environment file from the frontend to
-        understand the state of the world, calls on each personas to make
-        decisions based on the world state, and saves their moves at certain step
-        intervals.
+        This function retrieves the environment from the frontend (through
+        <self.transport>) to understand the state of the world, calls on each
+        personas to make decisions based on the world state, and saves their
+        moves at certain step intervals.
         INPUT
           int_counter: Integer value for the number of steps left for us to take
                        in this iteration.
         OUTPUT
           None
         """
-        # <sim_folder> points to the current simulation folder.
-        sim_folder = f"{fs_storage}/{self.sim_code}"
-
         # When a persona arrives at a game object, we give a unique event
         # to that object.
         # e.g., ('double studio[...]:bed', 'is', 'unmade', 'unmade')
@@ -315,128 +331,227 @@ class ReverieServer:
             if int_counter == 0:
                 break
 
-            # <curr_env_file> file is the file that our frontend outputs. When the
-            # frontend has done its job and moved the personas, then it will put a
-            # new environment file that matches our step count. That's when we run
-            # the content of this for loop. Otherwise, we just wait.
-            curr_env_file = f"{sim_folder}/environment/{self.step}.json"
-            if check_if_file_exists(curr_env_file):
-                # If we have an environment file, it means we have a new perception
-                # input to our personas. So we first retrieve it.
-                try:
-                    # Try and save block for robustness of the while loop.
-                    with open(curr_env_file) as json_file:
-                        new_env = json.load(json_file)
-                        env_retrieved = True
-                except:
-                    pass
-
-                if env_retrieved:
-                    # This is where we go through <game_obj_cleanup> to clean up all
-                    # object actions that were used in this cylce.
-                    for key, val in game_obj_cleanup.items():
-                        # We turn all object actions to their blank form (with None).
-                        self.maze.turn_event_from_tile_idle(key, val)
-                    # Then we initialize game_obj_cleanup for this cycle.
-                    game_obj_cleanup = dict()
-
-                    # We first move our personas in the backend environment to match
-                    # the frontend environment.
-                    for persona_name, persona in self.personas.items():
-                        # <curr_tile> is the tile that the persona was at previously.
-                        curr_tile = self.personas_tile[persona_name]
-                        # <new_tile> is the tile that the persona will move to right now,
-                        # during this cycle.
-                        new_tile = (
-                            new_env[persona_name]["x"],
-                            new_env[persona_name]["y"],
-                        )
+            # <new_env> is what our frontend sends through the transport. When the
+            # frontend has done its job and moved the personas, then it will send
+            # a new environment that matches our step count. That's when we run
+            # the content of this if block. Otherwise, the transport waits a bit
+            # and we ask again.
+            new_env = self.transport.get_environment(self.step)
+            if new_env is not None:
+                # This is where we go through <game_obj_cleanup> to clean up all
+                # object actions that were used in this cylce.
+                for key, val in game_obj_cleanup.items():
+                    # We turn all object actions to their blank form (with None).
+                    self.maze.turn_event_from_tile_idle(key, val)
+                # Then we initialize game_obj_cleanup for this cycle.
+                game_obj_cleanup = dict()
+
+                # We first move our personas in the backend environment to match
+                # the frontend environment.
+                for persona_name, persona in self.personas.items():
+                    # <curr_tile> is the tile that the persona was at previously.
+                    curr_tile = self.personas_tile[persona_name]
+                    # <new_tile> is the tile that the persona will move to right now,
+                    # during this cycle.
+                    new_tile = (
+                        new_env[persona_name]["x"],
+                        new_env[persona_name]["y"],
+                    )
 
-                        # We actually move the persona on the backend tile map here.
-                        self.personas_tile[persona_name] = new_tile
-                        self.maze.remove_subject_events_from_tile(
-                            persona.name,
-                            curr_tile,
-                        )
+                    # We actually move the persona on the backend tile map here.
+                    self.personas_tile[persona_name] = new_tile
+                    self.maze.remove_subject_events_from_tile(
+                        persona.name,
+                        curr_tile,
+                    )
+                    self.maze.add_event_from_tile(
+                        persona.scratch.get_curr_event_and_desc(),
+                        new_tile,
+                    )
+
+                    # Now, the persona will travel to get to their destination. *Once*
+                    # the persona gets there, we activate the object action.
+                    if not persona.scratch.planned_path:
+                        # We add that new object action event to the backend tile map.
+                        # At its creation, it is stored in the persona's backend.
+                        game_obj_cleanup[
+                            persona.scratch.get_curr_obj_event_and_desc()
+                        ] = new_tile
                         self.maze.add_event_from_tile(
-                            persona.scratch.get_curr_event_and_desc(),
+                            persona.scratch.get_curr_obj_event_and_desc(),
                             new_tile,
                         )
-
-                        # Now, the persona will travel to get to their destination. *Once*
-                        # the persona gets there, we activate the object action.
-                        if not persona.scratch.planned_path:
-                            # We add that new object action event to the backend tile map.
-                            # At its creation, it is stored in the persona's backend.
-                            game_obj_cleanup[
-                                persona.scratch.get_curr_obj_event_and_desc()
-                            ] = new_tile
-                            self.maze.add_event_from_tile(
-                                persona.scratch.get_curr_obj_event_and_desc(),
-                                new_tile,
-                            )
-                            # We also need to remove the temporary blank action for the
-                            # object that is currently taking the action.
-                            blank = (
-                                persona.scratch.get_curr_obj_event_and_desc()[0],
-                                None,
-                                None,
-                                None,
-                            )
-                            self.maze.remove_event_from_tile(blank, new_tile)
-
-                    # Then we need to actually have each of the personas perceive and
-                    # move. The movement for each of the personas comes in the form of
-                    # x y coordinates where the persona will move towards. e.g., (50, 34)
-                    # This is where the core brains of the personas are invoked.
-                    movements = {"persona": dict(), "meta": dict()}
+                        # We also need to remove the temporary blank action for the
+                        # object that is currently taking the action.
+                        blank = (
+                            persona.scratch.get_curr_obj_event_and_desc()[0],
+                            None,
+                            None,
+                            None,
+                        )
+                        self.maze.remove_event_from_tile(blank, new_tile)
+
+                # Then we need to actually have each of the personas perceive and
+                # move. The movement for each of the personas comes in the form of
+                # x y coordinates where the persona will move towards. e.g., (50, 34)
+                # This is where the core brains of the personas are invoked.
+                # Each persona's random number generator is seeded from the
+                # simulation's seed, the step and its name, so that its picks do
+                # not depend on the order the personas think in.
+                for persona_name, persona in self.personas.items():
+                    persona.rng.seed(f"{self.seed}:{self.step}:{persona_name}")
+                movements = {"persona": dict(), "meta": dict()}
+                if self.persona_workers > 1:
+                    executions = self.move_personas_parallel()
+                else:
+                    executions = dict()
                     for persona_name, persona in self.personas.items():
-                        # <next_tile> is a x,y coordinate. e.g., (58, 9)
-                        # <pronunciatio> is an emoji. e.g., "\ud83d\udca4"
-                        # <description> is a string description of the movement. e.g.,
-                        #   writing her next novel (editing her novel)
-                        #   @ double studio:double studio:common room:sofa
-                        next_tile, pronunciatio, description = persona.move(
+                        executions[persona_name] = persona.move(
                             self.maze,
                             self.personas,
                             self.personas_tile[persona_name],
                             self.curr_time,
                         )
-                        movements["persona"][persona_name] = {}
-                        movements["persona"][persona_name]["movement"] = next_tile
-                        movements["persona"][persona_name]["pronunciatio"] = (
-                            pronunciatio
-                        )
-                        movements["persona"][persona_name]["description"] = description
-                        movements["persona"][persona_name]["chat"] = (
-                            persona.scratch.chat
-                        )
+                for persona_name, persona in self.personas.items():
+                    # <next_tile> is a x,y coordinate. e.g., (58, 9)
+                    # <pronunciatio> is an emoji. e.g., "\ud83d\udca4"
+                    # <description> is a string description of the movement. e.g.,
+                    #   writing her next novel (editing her novel)
+                    #   @ double studio:double studio:common room:sofa
+                    next_tile, pronunciatio, description = executions[persona_name]
+                    movements["persona"][persona_name] = {}
+                    movements["persona"][persona_name]["movement"] = next_tile
+                    movements["persona"][persona_name]["pronunciatio"] = pronunciatio
+                    movements["persona"][persona_name]["description"] = description
+                    movements["persona"][persona_name]["chat"] = persona.scratch.chat
+
+                # Include the meta information about the current stage in the
+                # movements dictionary.
+                movements["meta"]["curr_time"] = self.curr_time.strftime(
+                    "%B %d, %Y, %H:%M:%S",
+                )
+
+                # We then write the personas' movements to a file that will be sent
+                # to the frontend server.
+                # Example json output:
+                # {"persona": {"Maria Lopez": {"movement": [58, 9]}},
+                #  "persona": {"Klaus Mueller": {"movement": [38, 12]}},
+                #  "meta": {curr_time: <datetime>}}
+                self.transport.put_movement(self.step, movements)
+
+                # After this cycle, the world takes one step forward, and the
+                # current time moves by <sec_per_step> amount.
+                self.step += 1
+                self.curr_time += datetime.timedelta(seconds=self.sec_per_step)
+
+                int_counter -= 1
+
+    def move_personas_parallel(self):
+        """
+        Has all personas move for the current step, with up to
+        <self.persona_workers> of them thinking at the same time. This does
+        what persona.move does for each persona, in four phases:
+          1) All personas perceive, retrieve and plan at the same time. While
+             doing so, a persona only changes its own state, and sees the other
+             personas as they were at the start of the step (snapshots).
+          2) The conversations the personas asked to start are granted in
+             persona order (see commit_chat_requests) and generated at the
+             same time, since no two of them share a persona.
+          3) All personas reflect at the same time.
+          4) The personas execute their plans one after the other, in persona
+             order, so that the paths they pick do not depend on timing.
+        The Maze is not changed during these phases, only read.
 
-                    # Include the meta information about the current stage in the
-                    # movements dictionary.
-                    movements["meta"]["curr_time"] = self.curr_time.strftime(
-                        "%B %d, %Y, %H:%M:%S",
-                    )
+        INPUT
+          None
+        OUTPUT
+          A dictionary of persona names to their executions
+          (next_tile, pronunciatio, description).
+        """
+        new_days = dict()
+        for persona_name, persona in self.personas.items():
+            new_days[persona_name] = persona.start_step(
+                self.personas_tile[persona_name],
+                self.curr_time,
+            )
+        persona_snapshots = dict()
+        for persona_name, persona in self.personas.items():
+            persona_snapshots[persona_name] = persona.snapshot()
+
+        chat_requests = dict()
+        for persona_name in self.personas:
+            chat_requests[persona_name] = []
+
+        def think(persona_name):
+            self.personas[persona_name].think(
+                self.maze,
+                persona_snapshots,
+                new_days[persona_name],
+                chat_requests[persona_name],
+            )
 
-                    # We then write the personas' movements to a file that will be sent
-                    # to the frontend server.
-                    # Example json output:
-                    # {"persona": {"Maria Lopez": {"movement": [58, 9]}},
-                    #  "persona": {"Klaus Mueller": {"movement": [38, 12]}},
-                    #  "meta": {curr_time: <datetime>}}
-                    curr_move_file = f"{sim_folder}/movement/{self.step}.json"
-                    with open(curr_move_file, "w") as outfile:
-                        outfile.write(json.dumps(movements, indent=2))
+        with ThreadPoolExecutor(self.persona_workers) as executor:
+            list(executor.map(think, self.personas))
+            all_chat_requests = []
+            for persona_name in self.personas:
+                all_chat_requests += chat_requests[persona_name]
+            commit_chat_requests(
+                self.maze,
+                all_chat_requests,
+                self.personas,
+                executor,
+            )
+            list(
+                executor.map(lambda persona: persona.reflect(), self.personas.values())
+            )
 
-                    # After this cycle, the world takes one step forward, and the
-                    # current time moves by <sec_per_step> amount.
-                    self.step += 1
-                    self.curr_time += datetime.timedelta(seconds=self.sec_per_step)
+        executions = dict()
+        for persona_name, persona in self.personas.items():
+            executions[persona_name] = persona.execute(
+                self.maze,
+                self.personas,
+                persona.scratch.act_address,
+            )
+        return executions
 
-                    int_counter -= 1
+    def start_headless_server(self, int_counter, dump_every=None):
+        """
+        Runs the simulation for <int_counter> steps without the frontend. The
+        personas' movements are applied right away instead of waiting for the
+        browser to play them out, so the steps go as fast as the personas can
+        think. See <HeadlessTransport>.
+        INPUT
+          int_counter: Integer value for the number of steps to take.
+          dump_every: If given, the environment and movement files are written
+                      every <dump_every> steps so the run can be replayed.
+        OUTPUT
+          None
+        """
+        sim_folder = f"{fs_storage}/{self.sim_code}"
 
-            # Sleep so we don't burn our machines.
-            time.sleep(self.server_sleep)
+        environment = dict()
+        for persona_name, tile in self.personas_tile.items():
+            environment[persona_name] = {
+                "maze": self.maze.maze_name,
+                "x": tile[0],
+                "y": tile[1],
+            }
+
+        frontend_transport = self.transport
+        self.transport = HeadlessTransport(
+            sim_folder,
+            self.maze.maze_name,
+            environment,
+            self.step,
+            dump_every,
+        )
+        try:
+            self.start_server(int_counter)
+        finally:
+            # The environment of the current step is what a saved simulation
+            # (or a fork of it) starts from, so it is always written.
+            self.transport.write_environment()
+            self.transport = frontend_transport
 
     def open_server(self):
         """
@@ -466,6 +581,7 @@ class ReverieServer:
                     # Finishes the simulation environment and saves the progress.
                     # Example: fin
                     self.save()
+                    self.transport.close()
                     break
 
                 if sim_command.lower() == "start path tester mode":
@@ -480,6 +596,7 @@ class ReverieServer:
                     # and erases all saved data from current simulation.
                     # Example: exit
                     shutil.rmtree(sim_folder)
+                    self.transport.close()
                     break
 
                 elif sim_command.lower() == "save":
@@ -487,6 +604,18 @@ class ReverieServer:
                     # Example: save
                     self.save()
 
+                elif sim_command[:12].lower() == "run headless":
+                    # Runs the number of steps specified in the prompt without the
+                    # frontend, optionally dumping the environment and movement
+                    # files every given number of steps for replaying.
+                    # Example: run headless 1000
+                    # Example: run headless 1000 dump 10
+                    args = sim_command.split()[2:]
+                    dump_every = None
+                    if len(args) == 3 and args[1].lower() == "dump":
+                        dump_every = int(args[2])
+                    self.start_headless_server(int(args[0]), dump_every)
+
                 elif sim_command[:3].lower() == "run":
                     # Runs the number of steps specified in the prompt.
                     # Example: run 1000
@@ -578,6 +707,12 @@ class ReverieServer:
                     ret_str += f"{self.curr_time.strftime('%B %d, %Y, %H:%M:%S')}\n"
                     ret_str += f"steps: {self.step}"
 
+                elif "print llm cache stats" in sim_command.lower():
+                    # Print the hit rate and the size of the LLM response cache.
+                    # Ex: print llm cache stats
+                    for key, val in get_llm_cache().stats().items():
+                        ret_str += f"{key}: {val}\n"
+
                 elif "print tile event" in sim_command[:16].lower():
                     # Print the tile events in the tile specified in the prompt
                     # Ex: print tile event 50, 30
@@ -0,0 +1,47 @@
+"""
+File: settings.py
+Description: Reads the optional settings of the backend from utils.py. Each
+module asks for its settings with a default, so utils.py only has to set the
+ones it changes. e.g., to have 8 personas think at the same time, add this
+line to utils.py:
+  persona_workers = 8
+"""
+
+import threading
+
+import utils
+
+
+def get_setting(name, default):
+    """
+    Returns the setting <name> from utils.py, or <default> if utils.py does
+    not set it.
+
+    INPUT:
+      name: The name of the setting. e.g., "persona_workers"
+      default: The value of the setting when utils.py does not set it.
+    OUTPUT:
+      The value of the setting.
+    """
+    return getattr(utils, name, default)
+
+
+class Shared:
+    """
+    An object that the whole backend shares (e.g., the LLM client), which is
+    only created by <create> when it is first asked for.
+    """
+
+    def __init__(self, create):
+        self.create = create
+        self.instance = None
+        self.lock = threading.Lock()
+
+    def get(self):
+        """
+        Returns the shared object, creating it if this is the first call.
+        """
+        with self.lock:
+            if self.instance is None:
+                self.instance = self.create()
+        return self.instance
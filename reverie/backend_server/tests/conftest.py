@@ -0,0 +1,63 @@
+"""
+File: conftest.py
+Description: Test setup for the backend. The modules are imported the way
+reverie.py imports them (from this folder), and they read their settings from
+utils.py. If there is no utils.py (e.g., on a fresh checkout), one is written
+to a temporary folder, with the assets of this repository and an empty
+storage folder, so that the tests never touch real simulations. Every test
+also gets its own embedding store (see isolated_embedding_store).
+"""
+
+import importlib.util
+import os
+import sys
+import tempfile
+
+import pytest
+
+backend_server = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, backend_server)
+
+if importlib.util.find_spec("utils") is None:
+    test_folder = tempfile.mkdtemp()
+    assets = os.path.join(
+        backend_server,
+        "../../environment/frontend_server/static_dirs/assets",
+    )
+    with open(os.path.join(test_folder, "utils.py"), "w") as outfile:
+        outfile.write(
+            f"""openai_api_key = ""
+key_owner = ""
+maze_assets_loc = {os.path.abspath(assets)!r}
+env_matrix = f"{{maze_assets_loc}}/the_ville/matrix"
+env_visuals = f"{{maze_assets_loc}}/the_ville/visuals"
+fs_storage = {os.path.join(test_folder, "storage")!r}
+fs_temp_storage = {os.path.join(test_folder, "temp_storage")!r}
+collision_block_id = "32125"
+debug = False
+""",
+        )
+    sys.path.insert(0, test_folder)
+
+from persona.memory_structures import embedding_store
+from persona.prompt_template import llm_embeddings
+from settings import Shared
+
+
+@pytest.fixture(autouse=True)
+def isolated_embedding_store(tmp_path, monkeypatch):
+    """
+    Gives every test its own embedding store under <tmp_path>, so that the
+    small test embeddings never end up in the store the simulations share.
+    """
+    store = embedding_store.EmbeddingStore(str(tmp_path / "embedding_store"))
+    monkeypatch.setattr(embedding_store, "_embedding_store", Shared(lambda: store))
+    service = Shared(
+        lambda: llm_embeddings.EmbeddingService(
+            store,
+            llm_embeddings.llm_embedding_model,
+            llm_embeddings.llm_embedding_max_batch,
+        ),
+    )
+    monkeypatch.setattr(llm_embeddings, "_embedding_service", service)
+    return store
@@ -0,0 +1,259 @@
+"""
+File: test_associative_memory.py
+Description: Checks the associative memory: its node sequences, the snapshots
+other personas read during a parallel step, and saving and loading
+nodes.jsonl.
+"""
+
+import datetime
+import json
+
+import pytest
+from persona.memory_structures.associative_memory import *
+
+start_time = datetime.datetime(2023, 2, 13, 8, 0, 0)
+
+
+def new_memory(folder):
+    """
+    Returns an empty AssociativeMemory saved in <folder>, the way a new
+    persona's bootstrap memory starts out.
+    """
+    folder.mkdir(parents=True, exist_ok=True)
+    (folder / "nodes.jsonl").write_text("")
+    (folder / "kw_strength.json").write_text(
+        json.dumps({"kw_strength_event": {}, "kw_strength_thought": {}}),
+    )
+    return AssociativeMemory(str(folder))
+
+
+def embedding(i):
+    """
+    Returns a small embedding that is different for each <i>.
+    """
+    return [1.0, float(i % 7), float(i % 3), 0.5]
+
+
+def add_event(memory, i, s="Isabella Rodriguez", p="is", o=None):
+    """
+    Adds the <i>-th test event to <memory> and returns it.
+    """
+    o = o or f"task {i}"
+    description = f"{s} {p} {o}"
+    return memory.add_event(
+        start_time + datetime.timedelta(minutes=i),
+        None,
+        s,
+        p,
+        o,
+        description,
+        {s, o},
+        i % 10,
+        (f"test memory {description}", embedding(i)),
+        [],
+    )
+
+
+def add_thought(memory, i, filling=None):
+    """
+    Adds the <i>-th test thought to <memory> and returns it.
+    """
+    description = f"Isabella Rodriguez thinks about idea {i}"
+    return memory.add_thought(
+        start_time + datetime.timedelta(minutes=i),
+        start_time + datetime.timedelta(days=30),
+        "Isabella Rodriguez",
+        "thinks about",
+        f"idea {i}",
+        description,
+        {"Isabella Rodriguez", f"idea {i}"},
+        5,
+        (f"test memory {description}", embedding(i)),
+        filling or [],
+    )
+
+
+def test_node_sequence_reads_newest_first():
+    seq = NodeSequence(range(5))
+    seq.append(5)
+    newest_first = [5, 4, 3, 2, 1, 0]
+
+    assert len(seq) == 6
+    assert list(seq) == newest_first
+    assert seq == newest_first
+    assert seq == NodeSequence(range(6))
+    assert seq != newest_first[::-1]
+    for i in range(-6, 6):
+        assert seq[i] == newest_first[i]
+    for index in [slice(3), slice(2, 5), slice(-2, None), slice(None, None, 2)]:
+        assert seq[index] == newest_first[index]
+    assert seq[:100] == newest_first
+    with pytest.raises(IndexError):
+        seq[6]
+    with pytest.raises(IndexError):
+        seq[-7]
+
+    other = [9]
+    assert seq + other == [*newest_first, 9]
+    assert other + seq == [9, *newest_first]
+    assert seq + NodeSequence(other) == [*newest_first, 9]
+    assert NodeSequence() == []
+    assert not NodeSequence()
+
+
+def test_node_sequence_up_to(tmp_path):
+    memory = new_memory(tmp_path / "associative_memory")
+    for i in range(5):
+        add_event(memory, i)
+
+    assert memory.seq_event.up_to(5) == memory.seq_event
+    assert memory.seq_event.up_to(3) == memory.seq_event[2:]
+    assert memory.seq_event.up_to(0) == []
+
+
+def test_snapshot_does_not_see_later_nodes(tmp_path):
+    memory = new_memory(tmp_path / "associative_memory")
+    for i in range(3):
+        add_event(memory, i)
+    add_thought(memory, 3)
+    memory_snapshot = memory.snapshot()
+
+    add_event(memory, 4, o="task 0")
+    add_thought(memory, 5)
+    add_event(memory, 6, o="a new task")
+
+    assert len(memory_snapshot.nodes) == 4
+    assert len(memory_snapshot.seq_event) == 3
+    assert len(memory_snapshot.seq_thought) == 1
+    assert len(memory_snapshot.kw_to_event["task 0"]) == 1
+    assert "a new task" in memory.kw_to_event
+    assert "a new task" not in memory_snapshot.kw_to_event
+    assert len(memory_snapshot.kw_to_thought["isabella rodriguez"]) == 1
+    assert memory_snapshot.retrieve_relevant_thoughts(
+        "isabella rodriguez",
+        "is",
+        "idle",
+    ) == set(memory.seq_thought[1:])
+    assert "node_5" not in memory_snapshot.id_to_node
+    assert memory.kw_strength_event != memory_snapshot.kw_strength_event
+
+
+def test_nodes_of_a_memory_share_their_subjects(tmp_path):
+    memory = new_memory(tmp_path / "associative_memory")
+    # Two equal subjects that are different str objects.
+    nodes = [add_event(memory, i, s="Isabella Rodriguez ".strip()) for i in range(2)]
+
+    assert nodes[0].subject is nodes[1].subject
+    assert nodes[0].description not in memory.symbols.symbols
+    # The keywords are kept as IDs, and the nodes with the same ones share
+    # their tuple of IDs.
+    assert nodes[0].keywords == {"Isabella Rodriguez", "task 0"}
+    other = add_event(memory, 2, o="task 0")
+    assert other.keyword_ids is nodes[0].keyword_ids
+    assert new_memory(tmp_path / "other").symbols is not memory.symbols
+
+
+def summarize(memory):
+    """
+    Returns what a memory holds of each of its nodes, to compare memories.
+    """
+    return [
+        (
+            node.node_id,
+            node.type,
+            node.created,
+            node.expiration,
+            node.description,
+            node.keywords,
+            list(memory.embeddings[node.embedding_key]),
+        )
+        for node in memory.nodes
+    ]
+
+
+def test_save_appends_to_nodes_jsonl(tmp_path):
+    folder = tmp_path / "associative_memory"
+    memory = new_memory(folder)
+    for i in range(3):
+        add_event(memory, i)
+    memory.save(str(folder))
+    saved = (folder / "nodes.jsonl").read_bytes()
+
+    loaded = AssociativeMemory(str(folder))
+    assert summarize(loaded) == summarize(memory)
+    add_event(loaded, 3)
+    add_thought(loaded, 4, filling=["node_1"])
+    loaded.save(str(folder))
+
+    lines = (folder / "nodes.jsonl").read_bytes().splitlines(keepends=True)
+    assert len(lines) == 5
+    assert b"".join(lines[:3]) == saved
+    reloaded = AssociativeMemory(str(folder))
+    assert summarize(reloaded) == summarize(loaded)
+    assert reloaded.seq_thought[0].filling == ["node_1"]
+
+
+def test_partial_last_line_is_dropped(tmp_path):
+    folder = tmp_path / "associative_memory"
+    memory = new_memory(folder)
+    for i in range(3):
+        add_event(memory, i)
+    memory.save(str(folder))
+    # A save that was interrupted in the middle of the fourth node.
+    with open(folder / "nodes.jsonl", "ab") as log_file:
+        log_file.write(b'{"node_count": 4, "type')
+
+    loaded = AssociativeMemory(str(folder))
+    assert summarize(loaded) == summarize(memory)
+    add_event(loaded, 3)
+    loaded.save(str(folder))
+
+    lines = (folder / "nodes.jsonl").read_text().splitlines()
+    assert [json.loads(line)["node_count"] for line in lines] == [1, 2, 3, 4]
+    assert summarize(AssociativeMemory(str(folder))) == summarize(loaded)
+
+
+def test_old_format_is_saved_as_nodes_jsonl(tmp_path):
+    folder = tmp_path / "associative_memory"
+    folder.mkdir()
+    nodes = dict()
+    embeddings = dict()
+    for i in range(3):
+        created = start_time + datetime.timedelta(minutes=i)
+        description = f"bed {i} is idle"
+        nodes[f"node_{i + 1}"] = {
+            "node_count": i + 1,
+            "type_count": i + 1,
+            "type": "event",
+            "depth": 0,
+            "created": created.strftime("%Y-%m-%d %H:%M:%S"),
+            "expiration": None,
+            "subject": f"bed {i}",
+            "predicate": "is",
+            "object": "idle",
+            "description": description,
+            "embedding_key": f"old format {description}",
+            "poignancy": 1,
+            "keywords": [f"bed {i}", "idle"],
+            "filling": None,
+        }
+        embeddings[f"old format {description}"] = embedding(i)
+    (folder / "nodes.json").write_text(json.dumps(nodes))
+    (folder / "embeddings.json").write_text(json.dumps(embeddings))
+    (folder / "kw_strength.json").write_text(
+        json.dumps({"kw_strength_event": {"idle": 3}, "kw_strength_thought": {}}),
+    )
+
+    memory = AssociativeMemory(str(folder))
+    assert [node.description for node in memory.seq_event] == [
+        "bed 2 is idle",
+        "bed 1 is idle",
+        "bed 0 is idle",
+    ]
+    memory.save(str(folder))
+
+    assert not (folder / "nodes.json").exists()
+    assert not (folder / "embeddings.json").exists()
+    loaded = AssociativeMemory(str(folder))
+    assert summarize(loaded) == summarize(memory)
+    assert loaded.kw_strength_event == {"idle": 3}
@@ -0,0 +1,67 @@
+"""
+File: test_embedding_store.py
+Description: Checks the embedding store that the personas share, and that an
+exported associative memory loads on a machine without the store.
+"""
+
+import numpy as np
+import pytest
+from persona.memory_structures import associative_memory
+from persona.memory_structures.embedding_store import *
+from test_associative_memory import add_event, new_memory
+
+
+def test_store_keeps_its_embeddings(tmp_path):
+    store = EmbeddingStore(str(tmp_path / "store"))
+    emb_id = store.add("bed is idle", [1.0, 2.0, 3.0])
+    assert emb_id == embedding_id("bed is idle")
+    assert len(emb_id) == 64
+    assert store.add("bed is idle", [9.0, 9.0, 9.0]) == emb_id
+    store.flush()
+    store.add("desk is idle", [4.0, 5.0, 6.0])
+
+    assert np.array_equal(store.get_vector("bed is idle"), [1.0, 2.0, 3.0])
+    assert np.array_equal(store.get_vector("desk is idle"), [4.0, 5.0, 6.0])
+    store.flush()
+
+    reopened = EmbeddingStore(str(tmp_path / "store"))
+    assert len(reopened) == 2
+    assert np.array_equal(reopened.get_vector("desk is idle"), [4.0, 5.0, 6.0])
+
+
+def test_store_refuses_another_dimension(tmp_path):
+    store = EmbeddingStore(str(tmp_path / "store"))
+    store.add("bed is idle", [1.0, 2.0, 3.0])
+    with pytest.raises(ValueError):
+        store.add("desk is idle", [1.0, 2.0])
+
+
+def test_exported_memory_loads_without_the_store(tmp_path, monkeypatch):
+    monkeypatch.setattr(
+        associative_memory,
+        "get_embedding_store",
+        lambda: EmbeddingStore(str(tmp_path / "store")),
+    )
+    folder = tmp_path / "associative_memory"
+    memory = new_memory(folder)
+    for i in range(3):
+        add_event(memory, i)
+    memory.save(str(folder))
+    memory.embeddings.export(str(folder / "embeddings.json"))
+
+    # Another machine, with an empty store.
+    monkeypatch.setattr(
+        associative_memory,
+        "get_embedding_store",
+        lambda: EmbeddingStore(str(tmp_path / "other_store")),
+    )
+    loaded = associative_memory.AssociativeMemory(str(folder))
+    assert len(loaded.nodes) == 3
+    for node in memory.nodes:
+        assert np.array_equal(
+            loaded.embeddings[node.embedding_key],
+            memory.embeddings[node.embedding_key],
+        )
+
+    loaded.save(str(folder))
+    assert not (folder / "embeddings.json").exists()
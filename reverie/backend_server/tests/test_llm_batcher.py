@@ -0,0 +1,78 @@
+"""
+File: test_llm_batcher.py
+Description: Checks that batched prompts get their own responses back, both
+from the PromptBatcher and from ChatGPT_batch_request.
+"""
+
+import json
+import threading
+
+from persona.prompt_template import gpt_structure
+from persona.prompt_template.llm_batcher import *
+
+
+class FakeLLMClient:
+    """
+    Answers every chat request with <response>, and keeps the prompts.
+    """
+
+    def __init__(self, response):
+        self.response = response
+        self.prompts = []
+
+    def chat(self, prompt, model):
+        self.prompts += [prompt]
+        return self.response
+
+    def run(self, response):
+        return response
+
+
+def test_batch_responses_are_matched_by_index(monkeypatch):
+    # The responses come back out of order, and the one for prompt 1 is
+    # missing.
+    response = json.dumps(
+        [
+            {"index": 2, "output": {"output": "c"}},
+            {"index": 0, "output": {"output": "a"}},
+            {"index": 7, "output": {"output": "x"}},
+        ],
+    )
+    llm_client = FakeLLMClient(f"Here you go: {response}")
+    monkeypatch.setattr(gpt_structure, "get_llm_client", lambda: llm_client)
+
+    responses = gpt_structure.ChatGPT_batch_request(["a?", "b?", "c?"])
+    assert responses == ['{"output": "a"}', None, '{"output": "c"}']
+    assert '"index": 2' in llm_client.prompts[0]
+
+
+def test_batcher_hands_each_caller_its_response():
+    batcher = PromptBatcher(window=1, max_items=3)
+    sent = []
+
+    def send_batch(requests):
+        sent.append(requests)
+        return [f"answer to {i}" for i in requests]
+
+    responses = dict()
+
+    def submit(request):
+        responses[request] = batcher.submit("key", request, send_batch)
+
+    threads = [threading.Thread(target=submit, args=(i,)) for i in "abc"]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(sent) == 1
+    assert responses == {i: f"answer to {i}" for i in "abc"}
+
+
+def test_failed_batch_leaves_the_callers_without_a_response():
+    batcher = PromptBatcher(window=0, max_items=3)
+
+    def send_batch(requests):
+        raise ValueError("not a json array")
+
+    assert batcher.submit("key", "a", send_batch) is None
@@ -0,0 +1,108 @@
+"""
+File: test_llm_cache.py
+Description: Checks the cache of LLM responses: hits and misses, the TTL, the
+least recently used eviction, and that a replay never sends a request.
+"""
+
+from types import SimpleNamespace
+
+import pytest
+from persona.prompt_template import gpt_structure, llm_cache
+from persona.prompt_template.llm_cache import *
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """
+    Replaces the time the cache reads with <clock.now>, in seconds.
+    """
+    clock = SimpleNamespace(now=1000.0)
+    monkeypatch.setattr(llm_cache, "time", SimpleNamespace(time=lambda: clock.now))
+    return clock
+
+
+def test_hits_and_misses_are_counted(tmp_path):
+    cache = LLMCache(str(tmp_path / "llm_cache.sqlite3"))
+    assert cache.get("gpt-3.5-turbo", "wake up hour?") is None
+    cache.put("gpt-3.5-turbo", "wake up hour?", None, "7am")
+    assert cache.get("gpt-3.5-turbo", "wake up hour?") == "7am"
+    # Another model or other parameters are another request.
+    assert cache.get("gpt-4", "wake up hour?") is None
+    assert cache.get("gpt-3.5-turbo", "wake up hour?", {"temperature": 1}) is None
+
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"], stats["entries"]) == (1, 3, 1)
+    assert stats["hit_rate"] == 0.25
+
+    cache.invalidate("gpt-3.5-turbo", "wake up hour?")
+    assert cache.get("gpt-3.5-turbo", "wake up hour?") is None
+
+
+def test_responses_expire_after_the_ttl(tmp_path, clock):
+    cache = LLMCache(str(tmp_path / "llm_cache.sqlite3"), ttl=60)
+    cache.put("gpt-3.5-turbo", "wake up hour?", None, "7am")
+    clock.now += 59
+    assert cache.get("gpt-3.5-turbo", "wake up hour?") == "7am"
+    clock.now += 2
+    assert cache.get("gpt-3.5-turbo", "wake up hour?") is None
+    cache.evict()
+    assert cache.stats()["entries"] == 0
+
+
+def test_least_recently_used_responses_are_evicted(tmp_path, clock):
+    cache = LLMCache(str(tmp_path / "llm_cache.sqlite3"), max_entries=2)
+    cache.evict_every = 3
+    for prompt in ["a?", "b?"]:
+        cache.put("gpt-3.5-turbo", prompt, None, prompt.upper())
+        clock.now += 1
+    cache.get("gpt-3.5-turbo", "a?")
+    clock.now += 1
+    # The third new response evicts the least recently used one, "b?".
+    cache.put("gpt-3.5-turbo", "c?", None, "C?")
+
+    assert cache.stats()["entries"] == 2
+    assert cache.get("gpt-3.5-turbo", "a?") == "A?"
+    assert cache.get("gpt-3.5-turbo", "b?") is None
+    assert cache.get("gpt-3.5-turbo", "c?") == "C?"
+
+
+def test_replay_raises_on_a_miss(tmp_path, monkeypatch):
+    path = str(tmp_path / "llm_cache.sqlite3")
+    LLMCache(path).put("gpt-3.5-turbo", "wake up hour?", None, "7am")
+    cache = LLMCache(path, mode="replay")
+    monkeypatch.setattr(gpt_structure, "get_llm_cache", lambda: cache)
+
+    def no_requests():
+        raise AssertionError("a replay sent a request")
+
+    monkeypatch.setattr(gpt_structure, "get_llm_client", no_requests)
+
+    assert gpt_structure.ChatGPT_single_request("wake up hour?") == "7am"
+    assert gpt_structure.ChatGPT_request("wake up hour?") == "7am"
+    with pytest.raises(LLMCacheMissError):
+        gpt_structure.ChatGPT_single_request("bed time?")
+    # Nothing is cached in replay mode.
+    cache.put("gpt-3.5-turbo", "bed time?", None, "11pm")
+    with pytest.raises(LLMCacheMissError):
+        cache.get("gpt-3.5-turbo", "bed time?")
+
+
+def test_single_requests_are_cached(tmp_path, monkeypatch):
+    cache = LLMCache(str(tmp_path / "llm_cache.sqlite3"))
+    monkeypatch.setattr(gpt_structure, "get_llm_cache", lambda: cache)
+    prompts = []
+
+    class FakeLLMClient:
+        def chat(self, prompt, model):
+            prompts.append(prompt)
+            return f"answer to {prompt}"
+
+        def run(self, response):
+            return response
+
+    monkeypatch.setattr(gpt_structure, "get_llm_client", FakeLLMClient)
+
+    for _ in range(2):
+        response = gpt_structure.ChatGPT_single_request("revise the plan")
+        assert response == "answer to revise the plan"
+    assert prompts == ["revise the plan"]
@@ -0,0 +1,202 @@
+"""
+File: test_llm_client.py
+Description: Checks the LLM client against a local mock server that speaks
+the OpenAI API: its retries of rate-limited requests, its bound on the
+requests in flight, and its token buckets.
+"""
+
+import asyncio
+import threading
+from types import SimpleNamespace
+
+import openai
+import pytest
+from aiohttp import web
+from persona.prompt_template import llm_client
+from persona.prompt_template.llm_client import *
+
+
+class MockServer:
+    """
+    A local server for /v1/chat/completions. Each response takes <delay>
+    seconds and reports <total_tokens> tokens, and the first <rate_limited>
+    requests are answered with a 429 instead.
+    """
+
+    def __init__(self, delay=0.02, total_tokens=100, rate_limited=0):
+        self.delay = delay
+        self.total_tokens = total_tokens
+        self.rate_limited = rate_limited
+        self.request_count = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self.thread.start()
+        self.runner = None
+        self.api_base = asyncio.run_coroutine_threadsafe(
+            self._start(),
+            self.loop,
+        ).result()
+
+    async def _start(self):
+        app = web.Application()
+        app.router.add_post("/v1/chat/completions", self.chat_completions)
+        self.runner = web.AppRunner(app)
+        await self.runner.setup()
+        await web.TCPSite(self.runner, "127.0.0.1", 0).start()
+        host, port = self.runner.addresses[0][:2]
+        return f"http://{host}:{port}/v1"
+
+    async def chat_completions(self, request):
+        body = await request.json()
+        self.request_count += 1
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        await asyncio.sleep(self.delay)
+        self.in_flight -= 1
+
+        if self.request_count <= self.rate_limited:
+            return web.json_response(
+                {"error": {"message": "Rate limit reached", "type": "requests"}},
+                status=429,
+            )
+        content = body["messages"][0]["content"]
+        return web.json_response(
+            {
+                "id": f"chatcmpl-{self.request_count}",
+                "object": "chat.completion",
+                "model": body["model"],
+                "choices": [
+                    {
+                        "index": 0,
+                        "message": {"role": "assistant", "content": f"re: {content}"},
+                        "finish_reason": "stop",
+                    },
+                ],
+                "usage": {
+                    "prompt_tokens": 10,
+                    "completion_tokens": self.total_tokens - 10,
+                    "total_tokens": self.total_tokens,
+                },
+            },
+        )
+
+    def close(self):
+        asyncio.run_coroutine_threadsafe(self.runner.cleanup(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """
+    Replaces the time the token buckets read with <clock.now>, in seconds, so
+    that they only refill when a test moves the clock.
+    """
+    clock = SimpleNamespace(now=1000.0)
+    monkeypatch.setattr(
+        llm_client,
+        "time",
+        SimpleNamespace(monotonic=lambda: clock.now),
+    )
+    return clock
+
+
+@pytest.fixture
+def mock_client(monkeypatch):
+    """
+    Returns a function that starts a MockServer with the given arguments and
+    an LLMClient for it. Both are closed after the test.
+    """
+    monkeypatch.setattr(openai, "api_key", "sk-test")
+    started = []
+
+    def start(client_kwargs=None, **server_kwargs):
+        server = MockServer(**server_kwargs)
+        client = LLMClient(
+            api_base=server.api_base,
+            backoff_base=0.01,
+            **(client_kwargs or dict()),
+        )
+        started.extend([client, server])
+        return client, server
+
+    yield start
+    for i in started:
+        i.close()
+
+
+@pytest.mark.usefixtures("clock")
+def test_rate_limited_requests_are_retried(mock_client):
+    client, server = mock_client(rate_limited=2)
+    assert client.run(client.chat("wake up hour?")) == "re: wake up hour?"
+    assert (server.request_count, client.request_count) == (3, 3)
+    assert (client.retry_count, client.error_count) == (2, 0)
+    # Each attempt takes a request from the bucket.
+    assert client.request_bucket.tokens == client.requests_per_minute - 3
+
+
+def test_retries_give_up_after_max_retries(mock_client):
+    client, server = mock_client({"max_retries": 1}, rate_limited=5)
+    with pytest.raises(openai.error.RateLimitError):
+        client.run(client.chat("wake up hour?"))
+    assert (server.request_count, client.retry_count, client.error_count) == (
+        2,
+        1,
+        1,
+    )
+
+
+def test_requests_in_flight_are_bounded(mock_client):
+    client, server = mock_client({"max_concurrency": 2}, delay=0.05)
+
+    async def chat_all():
+        return await asyncio.gather(*[client.chat(f"prompt {i}") for i in range(6)])
+
+    assert client.run(chat_all()) == [f"re: prompt {i}" for i in range(6)]
+    assert server.max_in_flight == 2
+
+
+@pytest.mark.usefixtures("clock")
+def test_token_bucket_takes_the_actual_usage(mock_client):
+    client, _ = mock_client(
+        {"tokens_per_minute": 10000},
+        total_tokens=1000,
+    )
+    client.run(client.chat("wake up hour?", max_tokens=100))
+    # The estimate that was taken before the request is corrected to the
+    # usage the response reports.
+    assert client.token_bucket.tokens == 10000 - 1000
+
+
+def test_token_bucket_refills(clock):
+    bucket = TokenBucket(60)
+    asyncio.run(bucket.acquire(50))
+    assert bucket.tokens == 10
+    bucket.consume(30)
+    assert bucket.tokens == -20
+    clock.now += 10
+    bucket.consume(0)
+    assert bucket.tokens == -10
+    clock.now += 1000
+    bucket.consume(0)
+    assert bucket.tokens == 60
+
+
+def test_token_bucket_waits_for_tokens():
+    bucket = TokenBucket(600)
+    asyncio.run(bucket.acquire(600))
+    start = llm_client.time.monotonic()
+    # 3 tokens take 0.3 seconds at 10 tokens per second.
+    asyncio.run(bucket.acquire(3))
+    assert llm_client.time.monotonic() - start >= 0.25
+
+
+def test_retryable_errors():
+    assert is_retryable(openai.error.RateLimitError("slow down"))
+    assert is_retryable(openai.error.APIError("bad gateway", http_status=502))
+    assert is_retryable(openai.error.APIConnectionError("no route"))
+    assert not is_retryable(openai.error.APIError("bad request", http_status=400))
+    assert not is_retryable(openai.error.InvalidRequestError("no model", "model"))
+    assert not is_retryable(openai.error.AuthenticationError("no key"))
@@ -0,0 +1,96 @@
+"""
+File: test_maze.py
+Description: Checks that a Maze loaded from its binary snapshot is the same as
+one built from the map's csv files, and that changes to its collision maze
+reach its path engine.
+"""
+
+import json
+
+import numpy as np
+from maze import *
+
+
+def empty_maze():
+    """
+    Returns a Maze with only the meta information of the_ville, so that it
+    can be built from the csv files or loaded from a snapshot directly.
+    """
+    maze = Maze.__new__(Maze)
+    meta_info = json.load(open(f"{env_matrix}/maze_meta_info.json"))
+    maze.maze_name = "the_ville"
+    maze.maze_width = int(meta_info["maze_width"])
+    maze.maze_height = int(meta_info["maze_height"])
+    return maze
+
+
+def test_snapshot_matches_fresh_build(tmp_path):
+    built = empty_maze()
+    built._build_from_matrix()
+    built._save_snapshot(f"{tmp_path}/snapshot")
+
+    loaded = empty_maze()
+    assert loaded._load_snapshot(f"{tmp_path}/snapshot")
+
+    assert loaded.world == built.world
+    assert loaded.collision_maze == built.collision_maze
+    assert np.array_equal(loaded.collision, built.collision)
+    for name in [
+        "sector_labels",
+        "arena_labels",
+        "game_object_labels",
+        "spawning_location_labels",
+    ]:
+        assert np.array_equal(getattr(loaded, name), getattr(built, name))
+    assert loaded.spawning_location_names == built.spawning_location_names
+
+    # Every tile has the same address at every level.
+    for level in ["world", "sector", "arena", "game_object"]:
+        built_names = built.tile_path_names[level]
+        loaded_names = loaded.tile_path_names[level]
+        built_paths = np.array(built_names, dtype=object)[built.tile_path_labels[level]]
+        loaded_paths = np.array(loaded_names, dtype=object)[
+            np.asarray(loaded.tile_path_labels[level])
+        ]
+        assert np.array_equal(loaded_paths, built_paths)
+
+    assert loaded.address_tiles == built.address_tiles
+    assert loaded.path_engine.address_fields.keys() == (
+        built.path_engine.address_fields.keys()
+    )
+    for address, field in built.path_engine.address_fields.items():
+        assert np.array_equal(loaded.path_engine.address_fields[address], field)
+    assert np.array_equal(loaded.path_engine.walkable, built.path_engine.walkable)
+
+
+def test_missing_snapshot_is_not_loaded(tmp_path):
+    maze = empty_maze()
+    assert not maze._load_snapshot(f"{tmp_path}/snapshot")
+    assert not hasattr(maze, "address_tiles")
+
+
+def test_collision_changes_reach_the_path_engine():
+    maze = empty_maze()
+    maze._build_from_matrix()
+    engine = maze.path_engine
+    address = "the Ville:Hobbs Cafe:cafe"
+    field = engine.address_fields[address]
+    ys, xs = np.nonzero(field == 20)
+    start = (int(xs[0]), int(ys[0]))
+    path = engine.find_path(start, address)
+    assert len(path) == 21
+
+    # An unchanged collision maze keeps the cached paths.
+    assert not maze.update_collision_maze([list(row) for row in maze.collision_maze])
+    assert engine.find_path(start, address) == path
+    assert engine.cache_info()["hits"] == 1
+
+    # Blocking a tile of the path drops them, and the fields go around it.
+    x, y = path[10]
+    collision_maze = [list(row) for row in maze.collision_maze]
+    collision_maze[y][x] = collision_block_id
+    assert maze.update_collision_maze(collision_maze)
+    assert maze.collision[y, x]
+    assert engine.cache_info()["size"] == 0
+    assert engine.address_fields[address][y, x] == -1
+    assert (x, y) not in engine.find_path(start, address)
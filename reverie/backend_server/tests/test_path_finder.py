@@ -0,0 +1,178 @@
+"""
+File: test_path_finder.py
+Description: Checks the PathEngine (distance fields, A* and the multi-target
+searches) against the original flood fill, path_finder_v2, on random mazes.
+"""
+
+import random
+
+import pytest
+from path_finder import *
+
+
+def random_maze(rng, width=18, height=14, wall_share=0.3):
+    """
+    Returns a random collision maze (a list of rows of "#" and " ").
+    """
+    return [
+        ["#" if rng.random() < wall_share else " " for _ in range(width)]
+        for _ in range(height)
+    ]
+
+
+def walkable_tiles(maze):
+    """
+    Returns the (x, y) tiles of <maze> that are not walls.
+    """
+    return [
+        (x, y)
+        for y, row in enumerate(maze)
+        for x, block in enumerate(row)
+        if block != "#"
+    ]
+
+
+def v2_length(maze, start, end):
+    """
+    Returns the number of steps of the path_finder_v2 path from <start> to
+    <end> ((x, y) tiles), or None if it does not reach <end>.
+    """
+    path = path_finder_v2(maze, (start[1], start[0]), (end[1], end[0]), "#")
+    if path[0] != (start[1], start[0]) or path[-1] != (end[1], end[0]):
+        return None
+    return len(path) - 1
+
+
+def assert_valid_path(maze, path, start, end):
+    """
+    Checks that <path> goes from <start> to <end> one walkable tile at a time.
+    """
+    assert path[0] == tuple(start)
+    assert path[-1] == tuple(end)
+    for (x_1, y_1), (x_2, y_2) in zip(path, path[1:]):
+        assert abs(x_1 - x_2) + abs(y_1 - y_2) == 1
+        assert maze[y_2][x_2] != "#"
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_distance_field_matches_v2(seed):
+    rng = random.Random(seed)
+    maze = random_maze(rng)
+    engine = PathEngine(maze, "#")
+    tiles = walkable_tiles(maze)
+    for _ in range(10):
+        start, end = rng.sample(tiles, 2)
+        field = engine.distance_field([start])
+        length = v2_length(maze, start, end)
+        if length is None:
+            assert field[end[1], end[0]] == -1
+        else:
+            assert field[end[1], end[0]] == length
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_astar_matches_v2(seed):
+    rng = random.Random(seed)
+    maze = random_maze(rng)
+    engine = PathEngine(maze, "#")
+    tiles = walkable_tiles(maze)
+    for _ in range(10):
+        start, end = rng.sample(tiles, 2)
+        path = engine.path_astar(start, end)
+        length = v2_length(maze, start, end)
+        if length is None:
+            assert path == []
+        else:
+            assert len(path) - 1 == length
+            assert_valid_path(maze, path, start, end)
+
+
+def test_path_finder_uses_the_given_engine():
+    rng = random.Random(0)
+    maze = random_maze(rng)
+    engine = PathEngine(maze, "#")
+    tiles = walkable_tiles(maze)
+    for _ in range(10):
+        start, end = rng.sample(tiles, 2)
+        path = path_finder(maze, start, end, "#", path_engine=engine)
+        assert path == path_finder(maze, start, end, "#")
+        assert path == engine.path_astar(start, end)
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_address_paths(seed):
+    rng = random.Random(seed)
+    maze = random_maze(rng)
+    tiles = walkable_tiles(maze)
+    goal_tiles = rng.sample(tiles, 4)
+    engine = PathEngine(maze, "#", {"the Ville:cafe": goal_tiles})
+    for _ in range(10):
+        start = rng.choice(tiles)
+        lengths = [v2_length(maze, start, goal) for goal in goal_tiles]
+        lengths = sorted(i for i in lengths if i is not None)
+
+        path = engine.find_path(start, "the Ville:cafe")
+        nearest = engine.path_to_nearest(start, goal_tiles)
+        paths = engine.paths_to_nearest(start, goal_tiles, 3)
+        if not lengths:
+            assert path == []
+            assert nearest == []
+            assert paths == []
+            continue
+        assert len(path) - 1 == lengths[0]
+        assert_valid_path(maze, path, start, path[-1])
+        assert path[-1] in goal_tiles
+        assert len(nearest) - 1 == lengths[0]
+        assert [len(i) - 1 for i in paths] == lengths[:3]
+        for i in paths:
+            assert_valid_path(maze, i, start, i[-1])
+        assert len(set(i[-1] for i in paths)) == len(paths)
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_paths_to_address_descend_the_field(seed):
+    rng = random.Random(seed)
+    maze = random_maze(rng, wall_share=0.2)
+    tiles = walkable_tiles(maze)
+    goal_tiles = rng.sample(tiles, 6)
+    engine = PathEngine(maze, "#", {"the Ville:cafe": goal_tiles})
+    for _ in range(10):
+        start = rng.choice(tiles)
+        taken = rng.choice(goal_tiles)
+        paths = engine.paths_to_address(
+            start,
+            "the Ville:cafe",
+            3,
+            lambda i, taken=taken: i != taken,
+        )
+        nearest = engine.find_path(start, "the Ville:cafe")
+        if not nearest:
+            assert paths == []
+            continue
+        # The first path goes through the closest tile of the address.
+        assert paths[0][: len(nearest)] == nearest
+        assert 1 <= len(paths) <= 3
+        assert len(set(i[-1] for i in paths)) == len(paths)
+        for i in paths:
+            assert_valid_path(maze, i, start, i[-1])
+            assert i[-1] in goal_tiles
+            assert i[-1] != taken
+
+    # The descent to the address is served by the path cache.
+    hits = engine.cache_info()["hits"]
+    engine.paths_to_address(start, "the Ville:cafe", 3)
+    assert engine.cache_info()["hits"] == hits + 1
+    assert engine.paths_to_address(start, "the Ville:library", 3) == []
+
+
+def test_find_path_cache_is_dropped_when_the_maze_changes():
+    maze = [list("     "), list("     "), list("     ")]
+    engine = PathEngine(maze, "#")
+    assert len(engine.find_path((0, 1), (4, 1))) == 5
+    assert engine.sync(maze) is False
+
+    maze[1][2] = "#"
+    assert engine.sync(maze) is True
+    path = engine.find_path((0, 1), (4, 1))
+    assert len(path) == 7
+    assert_valid_path(maze, path, (0, 1), (4, 1))
@@ -0,0 +1,46 @@
+"""
+File: test_perceive.py
+Description: Checks how perceive turns the events of the maze into the
+events and embedding texts it stores.
+"""
+
+from types import SimpleNamespace
+
+from persona.cognitive_modules.perceive import *
+
+persona = SimpleNamespace(
+    name="Isabella Rodriguez",
+    scratch=SimpleNamespace(act_description="chatting about the party"),
+)
+
+
+def test_empty_object_is_idle():
+    event = ("the Ville:Hobbs Cafe:cafe:refrigerator", None, None, None)
+    assert normalize_event(persona, event) == (
+        ("the Ville:Hobbs Cafe:cafe:refrigerator", "is", "idle"),
+        "refrigerator is idle",
+        "refrigerator is idle",
+        None,
+    )
+
+
+def test_embedding_text_is_taken_from_the_parentheses():
+    event = (
+        "Klaus Mueller",
+        "is",
+        "reading",
+        "reading a book (reading about gentrification)",
+    )
+    spo, desc, embedding_text, chat_text = normalize_event(persona, event)
+    assert spo == ("Klaus Mueller", "is", "reading")
+    assert desc == "Klaus Mueller is reading a book (reading about gentrification)"
+    assert embedding_text == "reading about gentrification"
+    assert chat_text is None
+
+
+def test_own_chat_has_a_chat_text():
+    event = ("Isabella Rodriguez", "chat with", "Klaus Mueller", "chatting")
+    assert normalize_event(persona, event)[3] == "chatting about the party"
+
+    event = ("Klaus Mueller", "chat with", "Isabella Rodriguez", "chatting")
+    assert normalize_event(persona, event)[3] is None
@@ -0,0 +1,123 @@
+"""
+File: test_retrieve.py
+Description: Checks that new_retrieve with an approximate nearest neighbour
+index scores the nodes the way the exact retrieval does.
+"""
+
+import datetime
+from types import SimpleNamespace
+
+import numpy as np
+from persona.cognitive_modules import retrieve as retrieve_module
+from persona.memory_structures import associative_memory
+from persona.memory_structures.ann_index import *
+from test_associative_memory import add_event, add_thought, new_memory, start_time
+
+
+def new_persona(folder, n_nodes):
+    """
+    Returns a persona whose memory has <n_nodes> events and thoughts.
+    """
+    memory = new_memory(folder)
+    for i in range(n_nodes):
+        if i % 4 == 3:
+            add_thought(memory, i)
+        else:
+            add_event(memory, i)
+    scratch = SimpleNamespace(
+        recency_w=1,
+        relevance_w=1,
+        importance_w=1,
+        recency_decay=0.99,
+        curr_time=start_time + datetime.timedelta(minutes=n_nodes),
+    )
+    return SimpleNamespace(a_mem=memory, scratch=scratch)
+
+
+def access_positions(a_mem, rows):
+    """
+    Returns the position of each of <rows> when they are sorted by the time
+    they were last accessed, the way the exact retrieval sorts them.
+    """
+    order = np.lexsort(
+        (-rows, a_mem.node_is_thought[rows], a_mem.node_last_accessed[rows]),
+    )
+    position = np.empty(rows.size, dtype=int)
+    position[order] = np.arange(rows.size)
+    return order, position
+
+
+def test_access_order_follows_the_accesses(tmp_path):
+    persona = new_persona(tmp_path / "associative_memory", 60)
+    a_mem = persona.a_mem
+    rows = np.flatnonzero(a_mem.node_retrievable[: len(a_mem.nodes)])
+    access_order = retrieve_module.AccessOrder(a_mem, rows, persona.scratch.curr_time)
+
+    rng = np.random.default_rng(0)
+    for _ in range(5):
+        indices = rng.choice(rows.size, 7, replace=False)
+        a_mem.set_last_accessed(
+            [a_mem.nodes[rows[i]] for i in indices],
+            persona.scratch.curr_time,
+        )
+        access_order.access(indices)
+
+        order, position = access_positions(a_mem, rows)
+        all_indices = np.arange(rows.size)
+        assert np.array_equal(access_order.positions(all_indices), position)
+        assert np.array_equal(access_order.first(20), order[:20])
+        assert np.array_equal(access_order.first(rows.size), order)
+
+
+def test_index_retrieval_matches_the_exact_one(tmp_path, monkeypatch):
+    n_nodes = 80
+    focal_points = ["the party", "the cafe", "the painting"]
+    rng = np.random.default_rng(0)
+    focal_embeddings = rng.normal(size=(len(focal_points), 4)).tolist()
+    monkeypatch.setattr(
+        retrieve_module,
+        "get_embeddings",
+        lambda texts: focal_embeddings,
+    )
+    # With as many candidates as nodes, the index changes nothing but the
+    # way the scores are computed.
+    monkeypatch.setattr(retrieve_module, "ann_candidates", n_nodes)
+    monkeypatch.setattr(associative_memory, "ann_min_nodes", 0)
+
+    retrieved = dict()
+    for index_type in [None, "ivf"]:
+        monkeypatch.setattr(associative_memory, "ann_index_type", index_type)
+        persona = new_persona(tmp_path / f"memory_{index_type}", n_nodes)
+        assert (persona.a_mem.get_ann_index() is None) == (index_type is None)
+        retrieved[index_type] = [
+            [node.node_id for node in nodes]
+            for nodes in retrieve_module.new_retrieve(
+                persona,
+                focal_points,
+                10,
+            ).values()
+        ]
+    assert retrieved[None] == retrieved["ivf"]
+
+
+def test_no_focal_points_retrieve_nothing(tmp_path, monkeypatch):
+    monkeypatch.setattr(retrieve_module, "get_embeddings", lambda texts: [])
+    persona = new_persona(tmp_path / "associative_memory", 10)
+    assert retrieve_module.new_retrieve(persona, []) == dict()
+
+
+def test_ivf_index_finds_the_closest_rows():
+    rng = np.random.default_rng(0)
+    vectors = rng.normal(size=(400, 8)).astype(np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    rows = np.arange(300)
+    ivf_index = IVFIndex(nprobe=20)
+    ivf_index.train(vectors[rows], rows)
+    for row in range(300, 400):
+        ivf_index.add(row, vectors[row])
+
+    # Probing every cluster makes the search exact.
+    query = vectors[7]
+    found = ivf_index.search(vectors, query, 10)
+    assert set(found.tolist()) == set(np.argsort(-(vectors @ query))[:10].tolist())
+    assert sorted(row for rows in ivf_index.lists for row in rows) == list(range(400))
@@ -0,0 +1,323 @@
+"""
+File: transport.py
+Description: Defines the channels through which Reverie exchanges each step
+with the frontend server. The frontend sends the environment (where the
+personas currently are) for a step, and Reverie answers with the personas'
+movements for that step.
+
+The original handshake goes through the file system: the frontend writes
+storage/<sim_code>/environment/<step>.json, which Reverie polls for, and
+Reverie writes storage/<sim_code>/movement/<step>.json, which the frontend
+polls for. <FileTransport> keeps that behavior and stays the default.
+<HTTPTransport> hands the steps over in memory instead, and serves that
+channel (a <LocalTransport>) on a local port so the Django views can forward
+the environment to Reverie and long-poll for the movements.
+<HeadlessTransport> does without the frontend altogether and moves the
+personas itself.
+
+The transport is picked in utils.py. e.g.,
+  reverie_transport = "http"
+  reverie_transport_port = 8001
+"""
+
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from global_methods import *
+from settings import *
+from utils import *
+
+# <reverie_transport> is either "file" or "http".
+reverie_transport = get_setting("reverie_transport", "file")
+reverie_transport_host = get_setting("reverie_transport_host", "127.0.0.1")
+reverie_transport_port = get_setting("reverie_transport_port", 8001)
+# <reverie_long_poll_timeout> is how long (in seconds) a request for the
+# movements of a step is held open before we answer that they are not ready.
+reverie_long_poll_timeout = get_setting("reverie_long_poll_timeout", 10)
+
+
+class FileTransport:
+    """
+    The original file-polling handshake. get_environment checks for the
+    frontend's environment file of the step and sleeps for <poll_sleep> if it
+    is not there yet.
+    """
+
+    def __init__(self, sim_folder, poll_sleep=0.1):
+        self.sim_folder = sim_folder
+        self.poll_sleep = poll_sleep
+
+    def get_environment(self, step):
+        """
+        Returns the environment the frontend sent for <step>, or None if it is
+        not there yet.
+
+        INPUT
+          step: The step of the simulation.
+        OUTPUT
+          The environment dictionary, e.g., {"Maria Lopez": {"maze":
+          "the_ville", "x": 58, "y": 9}, ...}, or None.
+        """
+        curr_env_file = f"{self.sim_folder}/environment/{step}.json"
+        if check_if_file_exists(curr_env_file):
+            try:
+                # Try and load block since the frontend may still be writing it.
+                with open(curr_env_file) as json_file:
+                    return json.load(json_file)
+            except:
+                pass
+        # Sleep so we don't burn our machines.
+        time.sleep(self.poll_sleep)
+        return None
+
+    def put_movement(self, step, movements):
+        """
+        Hands the personas' movements for <step> to the frontend.
+
+        INPUT
+          step: The step of the simulation.
+          movements: The movements dictionary that Reverie computed.
+            e.g., {"persona": {"Maria Lopez": {"movement": [58, 9], ...}},
+                   "meta": {"curr_time": <datetime string>}}
+        OUTPUT
+          None
+        """
+        curr_move_file = f"{self.sim_folder}/movement/{step}.json"
+        with open(curr_move_file, "w") as outfile:
+            outfile.write(json.dumps(movements, indent=2))
+
+    def close(self):
+        pass
+
+
+class LocalTransport:
+    """
+    Hands the environments and movements over in memory. The waiting side is
+    woken up as soon as the other side puts its part, so there is no polling.
+    Something else has to put the environments: this is the base of
+    <HTTPTransport> (where the frontend's requests put them) and
+    <HeadlessTransport> (which puts them itself).
+
+    If <sim_folder> is given, the movements are still written to the movement
+    folder (after they have been handed over) so that the simulation can be
+    compressed and replayed later.
+    """
+
+    def __init__(self, sim_folder=None, poll_sleep=0.1, kept_steps=10):
+        self.sim_folder = sim_folder
+        # <poll_sleep> is how long get_environment waits before it gives up
+        # for this round (Reverie's loop then calls it again).
+        self.poll_sleep = poll_sleep
+        # <kept_steps> is how many of the latest movements we keep around so
+        # that a frontend that asks again for a step still gets it.
+        self.kept_steps = kept_steps
+        self.environments = dict()
+        self.movements = dict()
+        self.cond = threading.Condition()
+
+    def put_environment(self, step, environment):
+        with self.cond:
+            self.environments[int(step)] = environment
+            self.cond.notify_all()
+
+    def get_environment(self, step, timeout=None):
+        """
+        Waits (up to <timeout> seconds, or <poll_sleep> if None) for the
+        environment of <step> and returns it, or None if it did not arrive.
+        """
+        if timeout is None:
+            timeout = self.poll_sleep
+        with self.cond:
+            self.cond.wait_for(lambda: step in self.environments, timeout)
+            return self.environments.pop(step, None)
+
+    def put_movement(self, step, movements):
+        with self.cond:
+            self.movements[step] = movements
+            for old_step in [i for i in self.movements if i <= step - self.kept_steps]:
+                del self.movements[old_step]
+            self.cond.notify_all()
+
+        if self.sim_folder:
+            curr_move_file = f"{self.sim_folder}/movement/{step}.json"
+            with open(curr_move_file, "w") as outfile:
+                outfile.write(json.dumps(movements, indent=2))
+
+    def get_movement(self, step, timeout=None):
+        """
+        Waits (up to <timeout> seconds, or forever if None) for the movements of
+        <step> and returns them, or None if they did not arrive.
+        """
+        with self.cond:
+            self.cond.wait_for(lambda: step in self.movements, timeout)
+            return self.movements.get(step)
+
+    def close(self):
+        pass
+
+
+class HTTPTransport(LocalTransport):
+    """
+    A <LocalTransport> that is also served on <host>:<port>, so that the
+    frontend server's process_environment and update_environment views can
+    forward their requests here (with the same JSON bodies the browser sends
+    them) instead of going through the file system.
+    """
+
+    def __init__(
+        self,
+        sim_code,
+        sim_folder=None,
+        host="127.0.0.1",
+        port=8001,
+        long_poll_timeout=10,
+        poll_sleep=0.1,
+    ):
+        super().__init__(sim_folder, poll_sleep)
+        self.sim_code = sim_code
+        self.long_poll_timeout = long_poll_timeout
+
+        transport = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                # A body that is not a json object with a "step" int and a
+                # "sim_code" (and an "environment" for process_environment)
+                # gets a 400 instead of leaving the frontend waiting.
+                try:
+                    length = int(self.headers.get("Content-Length", 0))
+                    data = json.loads(self.rfile.read(length))
+                    step = int(data["step"])
+                    sim_code = data["sim_code"]
+                    if self.path.rstrip("/") == "/process_environment":
+                        environment = data["environment"]
+                except (ValueError, KeyError, TypeError):
+                    self._reply(400, {"<step>": -1})
+                    return
+
+                if sim_code != transport.sim_code:
+                    self._reply(404, {"<step>": -1})
+                elif self.path.rstrip("/") == "/process_environment":
+                    transport.put_environment(step, environment)
+                    self._reply(200, "received")
+                elif self.path.rstrip("/") == "/update_environment":
+                    movements = transport.get_movement(
+                        step,
+                        transport.long_poll_timeout,
+                    )
+                    if movements is None:
+                        self._reply(200, {"<step>": -1})
+                    else:
+                        self._reply(200, dict(movements, **{"<step>": step}))
+                else:
+                    self._reply(404, {"<step>": -1})
+
+            def _reply(self, code, content):
+                body = json.dumps(content).encode()
+                self.send_response(code)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, fmt, *args):
+                # Every step goes through here, so we keep the terminal quiet.
+                pass
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class HeadlessTransport(LocalTransport):
+    """
+    Stands in for the frontend so that Reverie can run without a browser. The
+    movements of a step are applied right away: each persona is placed on its
+    <next_tile>, and that becomes the environment of the next step.
+
+    Nothing is written to the storage folder except every <dump_every> steps
+    (if given), when the environment and movement files of the step are
+    written, so the run can be replayed later. write_environment writes the
+    environment a simulation resumes from.
+    """
+
+    def __init__(self, sim_folder, maze_name, environment, step, dump_every=None):
+        super().__init__()
+        self.sim_folder = sim_folder
+        self.maze_name = maze_name
+        self.dump_every = dump_every
+        # <curr_environment> is the latest environment we put, so that the last
+        # one can be written out when the run ends.
+        self.curr_environment = environment
+        self.curr_step = step
+        self.put_environment(step, environment)
+
+    def _dump(self, step):
+        return self.dump_every and step % self.dump_every == 0
+
+    def put_environment(self, step, environment):
+        self.curr_environment = environment
+        self.curr_step = step
+        if self._dump(step):
+            self.write_environment()
+        super().put_environment(step, environment)
+
+    def get_environment(self, step, timeout=None):
+        # The environment of the step is always already there.
+        return super().get_environment(step, 0)
+
+    def put_movement(self, step, movements):
+        if self._dump(step):
+            curr_move_file = f"{self.sim_folder}/movement/{step}.json"
+            with open(curr_move_file, "w") as outfile:
+                outfile.write(json.dumps(movements, indent=2))
+
+        environment = dict()
+        for persona_name, persona_move in movements["persona"].items():
+            environment[persona_name] = {
+                "maze": self.maze_name,
+                "x": persona_move["movement"][0],
+                "y": persona_move["movement"][1],
+            }
+        self.put_environment(step + 1, environment)
+
+    def write_environment(self):
+        """
+        Writes the latest environment to the environment folder. This is the
+        file that Reverie (or a fork of the simulation) starts from.
+        """
+        curr_env_file = f"{self.sim_folder}/environment/{self.curr_step}.json"
+        with open(curr_env_file, "w") as outfile:
+            outfile.write(json.dumps(self.curr_environment, indent=2))
+
+
+def create_transport(sim_code, poll_sleep=0.1):
+    """
+    Creates the transport that is configured in utils.py for the simulation.
+
+    INPUT
+      sim_code: The code of the current simulation.
+      poll_sleep: How long the transport waits for an environment per round.
+    OUTPUT
+      A <FileTransport> or <HTTPTransport> instance.
+    """
+    sim_folder = f"{fs_storage}/{sim_code}"
+    if reverie_transport == "file":
+        return FileTransport(sim_folder, poll_sleep)
+    if reverie_transport == "http":
+        return HTTPTransport(
+            sim_code,
+            sim_folder,
+            reverie_transport_host,
+            reverie_transport_port,
+            reverie_long_poll_timeout,
+            poll_sleep,
+        )
+    raise ValueError(f"Unknown reverie_transport: {reverie_transport}")